@@ -0,0 +1,208 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import xml.etree.ElementTree
+
+# same lift kinds, in the same order, as lift/render.py
+order = ['squat', 'press', 'bench', 'pull-up', 'dip', 'deadlift', 'clean']
+
+swim_venues = ['Forum', 'Picornell', 'Sant Jordi', 'Montjuïc', 'Can Caralleu',
+    'Joan Miró']
+swim_kinds = ['technique', 'technique drills', 'endurance', 'speed',
+    'recovery']
+strokes = ['free', 'back', 'breast', 'fly', 'IM']
+lift_venues = ['Gymnàsio', 'Garage', 'Club Natació', 'Hotel gym']
+notes = ['felt good', 'slept badly', 'ate well', 'tired legs', 'lane 3',
+    'busy pool', 'focus on the catch', 'keep the elbows high',
+    'more kick next time', 'shoulder a bit sore', 'easy', 'fast',
+    'rower 5min', 'bar x10', 'belt on the last set']
+
+##############################################################################
+# dates
+##############################################################################
+
+# spread sessions evenly over the years, several on a day get -SUFFIX
+def dates(count, years, first):
+    days = max(1, int(years * 365.25))
+    previous = None
+    suffix = 1
+    for i in range(count):
+        date = first + datetime.timedelta(days=i * days // count)
+        suffix = suffix + 1 if date == previous else 1
+        previous = date
+        name = date.strftime('%Y%m%d') + ('-%d' % suffix if suffix > 1 else '')
+        yield date, name
+
+def clock(rng, morning):
+    hour = rng.choice([6, 7, 8, 12, 13]) if morning else rng.choice([17, 18, 19, 20])
+    return datetime.time(hour, rng.choice([0, 15, 30, 45]))
+
+def some_notes(rng, most=3):
+    return rng.sample(notes, rng.randint(1, most))
+
+##############################################################################
+# session XML, as written by transcribe.py
+##############################################################################
+
+def insert_el(el, tag):
+    return xml.etree.ElementTree.SubElement(el, tag)
+def insert_notes(el, lines):
+    if len(lines) == 1:
+        el.text = lines[0]
+    else:
+        for line in lines:
+            insert_el(el, 'note').text = line
+
+def swim_session(rng, date):
+    session = xml.etree.ElementTree.Element('session')
+    start = datetime.datetime.combine(date, clock(rng, True))
+    insert_el(session, 'meta').attrib.update(type='swim',
+        kind=rng.choice(swim_kinds), start=str(start),
+        volume=str(rng.randrange(1000, 4000, 50)))
+    insert_notes(insert_el(session, 'injuries'),
+        some_notes(rng, 1) if rng.random() < 0.1 else [])
+    venue = insert_el(session, 'venue')
+    venue.set('name', rng.choice(swim_venues))
+    if rng.random() < 0.3:
+        venue.set('spacious', 'yes')
+        insert_notes(venue, ['spacious'])
+    sets = insert_el(insert_el(session, 'work'), 'swimming')
+    stroke = rng.choice(strokes)
+    for i in range(rng.choice([1, 1, 2, 3, 4])):
+        s = insert_el(sets, 'set')
+        # most multi-set sessions stick to one stroke
+        if rng.random() < 0.8:
+            s.set('stroke', stroke if rng.random() < 0.8 else rng.choice(strokes))
+        insert_notes(insert_el(s, 'preparation'), some_notes(rng))
+        insert_el(s, 'summary').text = '%dx%d %s' % (rng.randint(4, 20),
+            rng.choice([25, 50, 100, 200]), s.get('stroke', 'mixed'))
+        if rng.random() < 0.3:
+            insert_notes(insert_el(s, 'structure'), some_notes(rng))
+        if rng.random() < 0.5:
+            insert_notes(insert_el(s, 'comments'), some_notes(rng))
+        if rng.random() < 0.3:
+            insert_notes(insert_el(s, 'times'),
+                ['%ds' % rng.randint(30, 120) for j in range(rng.randint(1, 4))])
+        insert_notes(insert_el(s, 'next'), some_notes(rng, 2))
+    if rng.random() < 0.5:
+        insert_notes(insert_el(session, 'cooldown'), ['%d easy' % rng.choice([100, 200])])
+    return session
+
+def lift_session(rng, date):
+    session = xml.etree.ElementTree.Element('session')
+    start = datetime.datetime.combine(date, clock(rng, False))
+    insert_el(session, 'meta').attrib.update(type='lift', start=str(start))
+    insert_notes(insert_el(session, 'injuries'), ['none'])
+    insert_el(session, 'venue').set('name', rng.choice(lift_venues))
+    insert_notes(insert_el(session, 'warmup'), some_notes(rng, 2))
+    lifts = insert_el(insert_el(session, 'work'), 'lifting')
+    for kind in rng.sample(order, rng.randint(2, len(order))):
+        l = insert_el(lifts, 'lift')
+        l.set('kind', kind)
+        l.set('weight', str(float(rng.randrange(20, 160)) + rng.choice([0, 0.5])))
+        insert_notes(insert_el(l, 'preparation'), some_notes(rng))
+        insert_notes(insert_el(l, 'warm-up'), some_notes(rng, 2))
+        if rng.random() < 0.4:
+            insert_notes(insert_el(l, 'comments'), some_notes(rng))
+        insert_notes(insert_el(l, 'next'), ['%gkg' % (float(l.get('weight')) + 2.5)])
+    return session
+
+##############################################################################
+# OPML notes, as read by transcribe.py
+##############################################################################
+
+def outline(parent, text, lines=None):
+    el = insert_el(parent, 'outline')
+    el.set('text', text)
+    for line in lines or []:
+        insert_el(el, 'outline').set('text', line)
+    return el
+
+def opml(title):
+    root = xml.etree.ElementTree.Element('opml', version='2.0')
+    insert_el(insert_el(root, 'head'), 'title').text = title
+    return root, insert_el(root, 'body')
+
+def ampm(time):
+    return time.strftime('%-I:%M%p').lower()
+
+# swim notes only ever describe one set
+def swim_note(rng):
+    stroke = rng.choice(strokes)
+    root, body = opml('%s %s' % (rng.choice(swim_venues), rng.choice(swim_kinds)))
+    outline(body, 'time', [ampm(clock(rng, True))])
+    if rng.random() < 0.3:
+        outline(body, 'venue', ['spacious'])
+    outline(body, 'stroke', [stroke])
+    outline(body, 'preparation', some_notes(rng))
+    outline(body, 'summary', ['%dx%d %s' % (rng.randint(4, 20),
+        rng.choice([25, 50, 100]), stroke)])
+    if rng.random() < 0.5:
+        outline(body, 'comments', some_notes(rng))
+    outline(body, 'next', some_notes(rng, 2))
+    outline(body, 'volume', ['%dm' % rng.randrange(1000, 4000, 50)])
+    return root
+
+def lift_note(rng):
+    root, body = opml(rng.choice(lift_venues))
+    outline(body, 'time', [ampm(clock(rng, False))])
+    outline(body, 'injuries', ['none'])
+    outline(body, 'warm-up', some_notes(rng, 2))
+    for kind in rng.sample(order, rng.randint(2, len(order))):
+        weight = float(rng.randrange(20, 160))
+        l = outline(body, '%s %gkg' % (kind, weight))
+        outline(l, 'preparation', some_notes(rng))
+        outline(l, 'warm-up', some_notes(rng, 2))
+        if rng.random() < 0.4:
+            outline(l, 'comments', some_notes(rng))
+        outline(l, 'next', ['%gkg' % (weight + 2.5)])
+    return root
+
+##############################################################################
+# corpus
+##############################################################################
+
+def write(root, path, declaration):
+    with open(path, 'w') as fh:
+        print(xml.etree.ElementTree.tostring(root, encoding='unicode',
+            xml_declaration=declaration), file=fh)
+
+def generate(outdir, sessions, opmls=0, years=10, seed=1):
+    rng = random.Random(seed)
+    first = datetime.date(2000, 1, 1)
+    for kind in ['swim', 'lift']:
+        os.makedirs(os.path.join(outdir, kind), exist_ok=True)
+        make = swim_session if kind == 'swim' else lift_session
+        for date, name in dates(sessions, years, first):
+            write(make(rng, date), os.path.join(outdir, kind, name + '.xml'),
+                True)
+        if opmls:
+            os.makedirs(os.path.join(outdir, 'opml', kind), exist_ok=True)
+            make = swim_note if kind == 'swim' else lift_note
+            for date, name in dates(opmls, years, first):
+                write(make(rng), os.path.join(outdir, 'opml', kind,
+                    name + '.opml'), False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outdir',
+        metavar='OUTDIR', help='Write OUTDIR/{swim,lift}/YYYYMMDD[-N].xml and OUTDIR/opml/{swim,lift}/YYYYMMDD[-N].opml')
+    parser.add_argument('-n', '--sessions', type=int, default=1000,
+        metavar='N', help='Swim and lift sessions each (default: %(default)s)')
+    parser.add_argument('--opml', type=int, default=None,
+        metavar='N', help='Swim and lift OPML notes each (default: as many as --sessions)')
+    parser.add_argument('--years', type=float, default=10,
+        metavar='YEARS', help='Spread the sessions over YEARS from 2000 (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1,
+        metavar='SEED', help='Random seed, the same seed gives the same corpus (default: %(default)s)')
+    args = vars(parser.parse_args(argv))
+    opmls = args['sessions'] if args['opml'] is None else args['opml']
+    generate(args['outdir'], args['sessions'], opmls, args['years'],
+        args['seed'])
+    print('wrote %d swim and %d lift sessions, %d notes each' % \
+        (args['sessions'], args['sessions'], opmls), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# a minimal session of each type so that every command does real work
+swim_xml = '''<?xml version='1.0' encoding='utf-8'?>
+<session><meta type="swim" kind="technique" start="2022-01-03 07:00:00" volume="2000" /><injuries /><venue name="Forum" /><work><swimming><set stroke="fly"><preparation>ok</preparation><summary>10x50 fly</summary><next>more</next></set></swimming></work></session>
+'''
+lift_xml = '''<?xml version='1.0' encoding='utf-8'?>
+<session><meta type="lift" start="2022-01-03 19:00:00" /><injuries /><venue name="Gym" /><warmup>row</warmup><work><lifting><lift kind="squat" weight="80.0"><preparation>ok</preparation><next>85kg</next></lift></lifting></work></session>
+'''
+swim_opml = '''<?xml version="1.0"?>
+<opml version="2.0"><head><title>Forum technique</title></head><body>
+<outline text="time"><outline text="7am"/></outline>
+<outline text="preparation"><outline text="ok"/></outline>
+<outline text="summary"><outline text="10x50 fly"/></outline>
+<outline text="next"><outline text="more"/></outline>
+<outline text="volume"><outline text="2000m"/></outline>
+</body></opml>
+'''
+
+def commands(root, tmp):
+    swim = os.path.join(root, 'swim')
+    lift = os.path.join(root, 'lift')
+    s = os.path.join(tmp, 'swim.xml')
+    l = os.path.join(tmp, 'lift.xml')
+    o = os.path.join(tmp, 'swim.opml')
+    return {
+        'swim --landing': [os.path.join(swim, 'render.py'), '--no-cache', '-t', 'S', '-l', s],
+        'swim --totals': [os.path.join(swim, 'render.py'), '--no-cache', '-s', s],
+        'swim --database': [os.path.join(swim, 'render.py'), '--no-cache', '-d', s],
+        'swim --single': [os.path.join(swim, 'render.py'), '-1', s],
+        'lift --landing': [os.path.join(lift, 'render.py'), '--no-cache', '-t', 'L', '-l', l],
+        'lift --summary': [os.path.join(lift, 'render.py'), '--no-cache', '-s', l],
+        'lift --single': [os.path.join(lift, 'render.py'), '-1', l],
+        'swim transcribe': [os.path.join(swim, 'transcribe.py'), o, '20220103'],
+    }
+
+def import_time(argv):
+    # total self time of every import, as reported by -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('package'):
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules.append((int(self_us), name.strip()))
+    modules.sort(reverse=True)
+    return sum(us for us, name in modules) / 1000, [name for us, name in modules[:5]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs', type=int, default=10,
+        metavar='N', help='Runs per command (default: %(default)s)')
+    parser.add_argument('--json', action='store_true',
+        help='Print results as JSON')
+    args = vars(parser.parse_args(argv))
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, text in [('swim.xml', swim_xml), ('lift.xml', lift_xml),
+                ('swim.opml', swim_opml)]:
+            with open(os.path.join(tmp, name), 'w') as fh:
+                fh.write(text)
+        for name, argv in commands(root, tmp).items():
+            times = []
+            for i in range(args['runs']):
+                start = time.perf_counter()
+                subprocess.run([sys.executable] + argv, check=True,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                times.append((time.perf_counter() - start) * 1000)
+            imports, slowest = import_time(argv)
+            results[name] = {'median_ms': round(statistics.median(times), 2),
+                'import_ms': round(imports, 2), 'slowest_imports': slowest}
+
+    if args['json']:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, r in results.items():
+            print('%-16s %7.1fms  imports %6.1fms  %s' % (name,
+                r['median_ms'], r['import_ms'], ', '.join(r['slowest_imports'])))
+
+if __name__ == '__main__':
+    main()
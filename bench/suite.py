@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import corpus
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# swim/ and lift/ both have a render.py, so load them under distinct names;
+# a transcriber imports the timeparse.py next to it when loaded, so the one
+# the other kind loaded is dropped from sys.modules first
+def load(kind, name):
+    path = os.path.join(root, kind, name + '.py')
+    sys.path.insert(0, os.path.dirname(path))
+    sys.modules.pop('timeparse', None)
+    spec = importlib.util.spec_from_file_location('%s_%s' % (kind, name), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+##############################################################################
+# stages
+##############################################################################
+
+pages = 100 # single pages rendered per run
+
+def url(s):
+    return '%s.html' % s.filename.replace('.xml', '')
+
+def stages(directory, tmp):
+    swim = load('swim', 'render')
+    lift = load('lift', 'render')
+    swim_transcribe = load('swim', 'transcribe')
+    lift_transcribe = load('lift', 'transcribe')
+    swims = sorted(glob.glob(os.path.join(directory, 'swim', '*.xml')))
+    lifts = sorted(glob.glob(os.path.join(directory, 'lift', '*.xml')))
+    swim_notes = os.path.join(directory, 'opml', 'swim')
+    lift_notes = os.path.join(directory, 'opml', 'lift')
+
+    def sink(mode, *args):
+        return lambda: mode(*args, out=io.StringIO())
+    def singles(render, files, *args):
+        return lambda: [render.single(file, *args, out=io.StringIO())
+            for file in files[:pages]]
+    def parse(render, files):
+        return lambda: [render.parse(file) for file in files]
+    def transcribe(transcriber, notes, outdir):
+        return lambda: transcriber.batch([notes], outdir)
+
+    return {
+        'swim transcribe': (transcribe(swim_transcribe, swim_notes,
+            os.path.join(tmp, 'swim')), len(glob.glob(os.path.join(swim_notes, '*.opml')))),
+        'swim parse': (parse(swim, swims), len(swims)),
+        'swim landing': (sink(swim.landing, swims, 'Swimming', url), len(swims)),
+        'swim totals': (sink(swim.totals, swims), len(swims)),
+        'swim database': (sink(swim.database, swims), len(swims)),
+        'swim single': (singles(swim, swims, 'picture.jpg'), min(pages, len(swims))),
+        'lift transcribe': (transcribe(lift_transcribe, lift_notes,
+            os.path.join(tmp, 'lift')), len(glob.glob(os.path.join(lift_notes, '*.opml')))),
+        'lift parse': (parse(lift, lifts), len(lifts)),
+        'lift landing': (sink(lift.landing, lifts, 'Lifting', url), len(lifts)),
+        'lift summary': (sink(lift.summary, lifts), len(lifts)),
+        'lift database': (sink(lift.database, lifts), len(lifts)),
+        'lift single': (singles(lift, lifts, {kind: 'picture.jpg'
+            for kind in corpus.order}), min(pages, len(lifts))),
+    }
+
+def measure(run, runs):
+    times = []
+    for i in range(runs):
+        # batch() reports on standard error
+        with contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+##############################################################################
+# main
+##############################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--sessions', type=int, default=1000,
+        metavar='N', help='Generate N swim and N lift sessions (default: %(default)s)')
+    parser.add_argument('--opml', type=int, default=None,
+        metavar='N', help='Generate N swim and N lift OPML notes (default: as many as --sessions)')
+    parser.add_argument('-c', '--corpus',
+        metavar='DIRECTORY', help='Use a corpus written by corpus.py instead of generating one')
+    parser.add_argument('-r', '--runs', type=int, default=5,
+        metavar='N', help='Runs per stage (default: %(default)s)')
+    parser.add_argument('-k', '--stage', action='append',
+        metavar='NAME', help='Only run stages whose name contains NAME (repeatable)')
+    parser.add_argument('--compare',
+        metavar='JSONFILE', help='Show the change against an earlier --json run')
+    parser.add_argument('--json', action='store_true',
+        help='Print results as JSON')
+    args = vars(parser.parse_args(argv))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args['corpus']
+        if directory is None:
+            directory = os.path.join(tmp, 'corpus')
+            opmls = args['sessions'] if args['opml'] is None else args['opml']
+            corpus.generate(directory, args['sessions'], opmls)
+        for name, (run, count) in stages(directory, tmp).items():
+            if args['stage'] and not any(k in name for k in args['stage']):
+                continue
+            times = measure(run, args['runs'])
+            median = statistics.median(times)
+            results[name] = {'count': count,
+                'median_ms': round(median, 2),
+                'min_ms': round(min(times), 2),
+                'per_item_us': round(median * 1000 / count, 2) if count else None}
+
+    report = {'python': platform.python_version(), 'runs': args['runs'],
+        'results': results}
+    old = {}
+    if args['compare']:
+        with open(args['compare']) as fh:
+            old = json.load(fh)['results']
+    if args['json']:
+        for name, r in results.items():
+            if name in old and old[name]['median_ms']:
+                r['change'] = round(r['median_ms'] / old[name]['median_ms'], 3)
+        print(json.dumps(report, indent=2))
+    else:
+        for name, r in results.items():
+            change = ''
+            if name in old and old[name]['median_ms']:
+                change = '  x%.2f' % (r['median_ms'] / old[name]['median_ms'])
+            print('%-16s %7d %9.1fms %9.1fus/item%s' % (name, r['count'],
+                r['median_ms'], r['per_item_us'] or 0, change))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+
+import corpus
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root, 'swim'))
+import timeparse
+
+##############################################################################
+# inputs
+##############################################################################
+
+# "time" lines as the notes give them, the corpus' 7:00am form most often
+def times(count, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        t = corpus.clock(rng, rng.random() < 0.5)
+        form = rng.random()
+        if form < 0.7:
+            lines.append(corpus.ampm(t))
+        elif form < 0.8:
+            lines.append(t.strftime('%-I%p').lower())
+        elif form < 0.9:
+            lines.append(t.strftime('%-I.%M%p').lower())
+        else:
+            lines.append(t.strftime('%H:%M'))
+    return lines
+
+# meta/@start values as render.py reads them
+def starts(count):
+    first = datetime.datetime(2000, 1, 1, 7)
+    return [str(first + datetime.timedelta(hours=i * 13)) for i in range(count)]
+
+##############################################################################
+# stages
+##############################################################################
+
+def dateutil_clock(lines):
+    import dateutil.parser
+    with warnings.catch_warnings():
+        # "tzname CEST identified but not understood"
+        warnings.simplefilter('ignore')
+        return [dateutil.parser.parse(line + ' CEST').time() for line in lines]
+
+def cold_clock(lines):
+    timeparse.clock.cache_clear()
+    return [timeparse.clock(line) for line in lines]
+
+def warm_clock(lines):
+    return [timeparse.clock(line) for line in lines]
+
+def strptime_start(lines):
+    return [datetime.datetime.strptime(line, '%Y-%m-%d %H:%M:%S')
+        for line in lines]
+
+def isoformat_start(lines):
+    return [datetime.datetime.fromisoformat(line) for line in lines]
+
+def measure(run, lines, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        run(lines)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+##############################################################################
+# main
+##############################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=10000,
+        metavar='N', help='Strings parsed per run (default: %(default)s)')
+    parser.add_argument('-r', '--runs', type=int, default=5,
+        metavar='N', help='Runs per stage (default: %(default)s)')
+    parser.add_argument('--json', action='store_true',
+        help='Print results as JSON')
+    args = vars(parser.parse_args(argv))
+
+    lines = times(args['count'])
+    stamps = starts(args['count'])
+    stages = {
+        'dateutil clock': (dateutil_clock, lines),
+        'timeparse cold': (cold_clock, lines),
+        'timeparse warm': (warm_clock, lines),
+        'strptime start': (strptime_start, stamps),
+        'isoformat start': (isoformat_start, stamps),
+    }
+    results = {}
+    for name, (run, inputs) in stages.items():
+        median = statistics.median(measure(run, inputs, args['runs']))
+        results[name] = {'median_ms': round(median, 2),
+            'per_item_us': round(median * 1000 / len(inputs), 3)}
+    # dateutil drops the minutes of 7.30am, the fast path does not
+    differ = sorted({line for line, a, b in zip(lines, dateutil_clock(lines),
+        cold_clock(lines)) if a != b})
+
+    if args['json']:
+        print(json.dumps({'results': results, 'differ': differ}, indent=2))
+    else:
+        for name, r in results.items():
+            print('%-16s %9.1fms %9.3fus/item' % (name, r['median_ms'],
+                r['per_item_us']))
+        if differ:
+            print('dateutil differs on %d forms, e.g. %s' % (len(differ),
+                ', '.join(differ[:5])))
+
+if __name__ == '__main__':
+    main()
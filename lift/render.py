@@ -1,10 +1,12 @@
+# modules only some modes need (csv, html, pickle, sqlite3, unidecode, ...)
+# are imported inside the functions using them to keep startup fast
 import argparse
-import csv
 import datetime
 import glob
+import io
 import os
 import sys
-import unidecode
+import time
 import xml.etree.ElementTree
 
 order = ['squat', 'press', 'bench', 'pull-up', 'dip', 'deadlift', 'clean']
@@ -13,16 +15,141 @@ order = ['squat', 'press', 'bench', 'pull-up', 'dip', 'deadlift', 'clean']
 # helpers
 ##############################################################################
 
+# strftime() is slow enough to show up on long landing pages, so the few
+# fields needed are formatted directly (Python leaves LC_TIME as "C")
+weekdays = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+
 def time_ampm(t):
     if t.minute > 0:
-        minutes = '.' + t.strftime('%M')
+        minutes = '.%02d' % t.minute
     else:
         minutes = ''
-    return '%s%s%s' % (t.strftime('%-I'), minutes, t.strftime('%p').lower())
+    return '%d%s%s' % (t.hour % 12 or 12, minutes, 'am' if t.hour < 12 else 'pm')
 
 def capitalise(s):
     return s[0].upper() + s[1:]
 
+def filename(file):
+    # parse() also accepts open files, e.g. sys.stdin
+    if not isinstance(file, str):
+        file = getattr(file, 'name', '')
+    return os.path.basename(file)
+
+def to_string(mode, *args):
+    out = io.StringIO()
+    mode(*args, out=out)
+    return out.getvalue()
+
+##############################################################################
+# --profile
+##############################################################################
+
+# stage -> [wall s, CPU s, peak bytes, calls]; None unless profiling
+profile = None
+
+def profile_start(dump=None):
+    global profile
+    import tracemalloc
+    tracemalloc.start()
+    profile = {'stages': {}, 'current': None, 'files': 0, 'bytes': 0,
+        'dump': dump, 'profiler': None}
+    if dump:
+        import cProfile
+        profile['profiler'] = cProfile.Profile()
+        profile['profiler'].enable()
+
+# ends the running stage and starts the next one, stage(None) ends the last
+def stage(name):
+    if profile is None:
+        return
+    import tracemalloc
+    now = (time.perf_counter(), time.process_time())
+    if profile['current']:
+        previous, wall, cpu = profile['current']
+        entry = profile['stages'].setdefault(previous, [0.0, 0.0, 0, 0])
+        entry[0] += now[0] - wall
+        entry[1] += now[1] - cpu
+        entry[2] = max(entry[2], tracemalloc.get_traced_memory()[1])
+        entry[3] += 1
+    tracemalloc.reset_peak()
+    profile['current'] = (name, now[0], now[1]) if name else None
+
+def profile_read(files):
+    # bytes are only counted for files actually parsed, not cache hits
+    if profile is None:
+        return
+    for file in files:
+        profile['files'] += 1
+        if isinstance(file, str):
+            profile['bytes'] += os.stat(file).st_size
+        elif isinstance(file, io.BytesIO):
+            profile['bytes'] += len(file.getbuffer())
+
+def profile_report(path):
+    import tracemalloc
+    stage(None)
+    if profile['profiler']:
+        profile['profiler'].disable()
+        profile['profiler'].dump_stats(profile['dump'])
+    tracemalloc.stop()
+    stages = {name: {'wall_ms': round(wall * 1000, 3),
+        'cpu_ms': round(cpu * 1000, 3), 'peak_bytes': peak, 'calls': calls}
+        for name, (wall, cpu, peak, calls) in profile['stages'].items()}
+    report = {'files': profile['files'], 'bytes': profile['bytes'],
+        'peak_bytes': max([s['peak_bytes'] for s in stages.values()] or [0]),
+        'stages': stages}
+    if path != '-':
+        import json
+        with open(path, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        return
+    print('profile: %d files, %d bytes read, peak %.1f MiB traced' % \
+        (report['files'], report['bytes'], report['peak_bytes'] / 2**20),
+        file=sys.stderr)
+    for name, s in stages.items():
+        print('  %-10s %10.1fms wall %10.1fms CPU %8.1f MiB peak' % (name,
+            s['wall_ms'], s['cpu_ms'], s['peak_bytes'] / 2**20), file=sys.stderr)
+
+##############################################################################
+# session model
+##############################################################################
+
+# __slots__ keep a multi-year archive compact in memory; fields missing from
+# the XML (or skipped by parse_projected) are None
+class Session:
+    __slots__ = ['start', 'injuries', 'venue', 'warmup', 'lifts', 'filename']
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+class Venue:
+    __slots__ = ['name', 'notes']
+
+    def __init__(self, name, notes=None):
+        self.name = sys.intern(name)
+        self.notes = notes
+
+class Lift:
+    __slots__ = ['kind', 'weight', 'preparation', 'warmup', 'comments', 'next',
+        'video']
+
+    def __init__(self, kind, weight, **fields):
+        self.kind = sys.intern(kind)
+        self.weight = weight
+        for field in self.__slots__[2:]:
+            setattr(self, field, fields.get(field))
+
+# venues without notes are shared between all sessions held there
+venues = {}
+
+def intern_venue(name, notes=None):
+    if notes:
+        return Venue(name, notes)
+    if name not in venues:
+        venues[name] = Venue(name)
+    return venues[name]
+
 ##############################################################################
 # parsing
 ##############################################################################
@@ -40,7 +167,9 @@ def parse_meta(el):
     assert 'start' in el.attrib
     assert 'type' in el.attrib
     assert el.attrib['type'] == 'lift'
-    start = datetime.datetime.strptime(el.attrib['start'], '%Y-%m-%d %H:%M:%S')
+    # written by transcribe.py as YYYY-MM-DD HH:MM:SS, which fromisoformat()
+    # reads many times faster than strptime()
+    start = datetime.datetime.fromisoformat(el.attrib['start'])
     return start
 
 def parse_injuries(el):
@@ -48,35 +177,30 @@ def parse_injuries(el):
 
 def parse_venue(el):
     assert 'name' in el.attrib
-    venue = {'name': el.attrib['name']}
-    notes = parse_notes(el)
-    if notes:
-        venue['notes'] = notes
-    return venue
+    return intern_venue(el.attrib['name'], parse_notes(el))
 
 def parse_warmup(el):
     return parse_notes(el)
 
 def parse_lift(el):
-    s = {}
     assert {'kind', 'weight'} <= set(el.attrib)
-    s['kind'], s['weight'] = el.attrib['kind'], float(el.attrib['weight'])
+    s = Lift(el.attrib['kind'], float(el.attrib['weight']))
     for child in el:
         if child.tag == 'preparation':
-            s['preparation'] = parse_notes(child)
+            s.preparation = parse_notes(child)
         elif child.tag == 'warm-up':
-            s['warmup'] = parse_notes(child)
+            s.warmup = parse_notes(child)
         elif child.tag == 'comments':
-            s['comments'] = parse_notes(child)
+            s.comments = parse_notes(child)
         elif child.tag == 'next':
-            s['next'] = parse_notes(child)
+            s.next = parse_notes(child)
         elif child.tag == 'video':
-            s['video'] = parse_notes(child)
+            s.video = parse_notes(child)
         else:
             raise NameError('unknown tag "%s"' % child.tag)
     mandatory = ['preparation', 'next']
     for tag in mandatory:
-        assert tag in s
+        assert not getattr(s, tag) is None
     return s
 
 def parse_work(el):
@@ -88,7 +212,7 @@ def parse_work(el):
     return lifts
 
 def parse(file):
-    session = {}
+    session = Session()
     try:
         tree = xml.etree.ElementTree.parse(file)
     except Exception as e:
@@ -98,37 +222,400 @@ def parse(file):
     assert root.tag == 'session'
     for child in root:
         if child.tag == 'meta':
-            session['start'] = parse_meta(child)
+            session.start = parse_meta(child)
         elif child.tag == 'injuries':
-            session['injuries'] = parse_injuries(child)
+            session.injuries = parse_injuries(child)
         elif child.tag == 'venue':
-            session['venue'] = parse_venue(child)
+            session.venue = parse_venue(child)
         elif child.tag == 'warmup':
-            session['warmup'] = parse_warmup(child)
+            session.warmup = parse_warmup(child)
         elif child.tag == 'work':
-            session['lifts'] = parse_work(child)
+            session.lifts = parse_work(child)
         else:
             raise NameError('unknown tag "%s"' % child.tag)
     mandatory = ['start', 'venue', 'warmup', 'lifts']
     for tag in mandatory:
-        assert tag in session
-    session['filename'] = os.path.basename(file)
+        assert not getattr(session, tag) is None
+    session.filename = filename(file)
     return session
 
 ##############################################################################
-# --landing
+# projected parsing
+##############################################################################
+
+# summary modes pass the session fields they read; the file is streamed,
+# notes are never collected and parsing stops once every field is known
+def parse_projected(file, fields):
+    session = Session()
+    wanted = set(fields)
+    found = set()
+    depth = 0
+    try:
+        for event, el in xml.etree.ElementTree.iterparse(file, ('start', 'end')):
+            if event == 'start':
+                if depth == 0:
+                    assert el.tag == 'session'
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if el.tag == 'meta' and 'start' in wanted:
+                session.start = parse_meta(el)
+                found.add('start')
+            elif el.tag == 'venue' and 'venue' in wanted:
+                assert 'name' in el.attrib
+                session.venue = intern_venue(el.attrib['name'])
+                found.add('venue')
+            elif el.tag == 'work' and 'lifts' in wanted:
+                assert len(el) == 1
+                session.lifts = []
+                for child in next(iter(el)):
+                    assert child.tag == 'lift'
+                    assert {'kind', 'weight'} <= set(child.attrib)
+                    session.lifts.append(Lift(child.attrib['kind'],
+                        float(child.attrib['weight'])))
+                found.add('lifts')
+            el.clear()
+            if wanted <= found:
+                break
+    except Exception as e:
+        print('in file:', file)
+        raise e
+    for field in wanted:
+        assert field in found
+    session.filename = filename(file)
+    return session
+
+def parse_fields(file, fields):
+    if fields is None:
+        return parse(file)
+    return parse_projected(file, fields)
+
+##############################################################################
+# parsed-session cache
+##############################################################################
+
+# bump whenever the shape of parse() output changes to drop stale entries
+cache_version = 3
+cache = None
+
+def cache_default_path():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'exercise-log', 'lift-sessions.pickle')
+
+def cache_open(path, limit):
+    # entries are loaded on first use so that --single never pays for them
+    return {'path': path, 'limit': limit, 'entries': None,
+        'hits': 0, 'misses': 0, 'dirty': False}
+
+def cache_load(cache):
+    import pickle
+    cache['entries'] = {}
+    try:
+        with open(cache['path'], 'rb') as fh:
+            version, entries = pickle.load(fh)
+        if version == cache_version:
+            cache['entries'] = entries
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print('warning: ignoring unreadable cache %s: %s' % (cache['path'], e),
+            file=sys.stderr)
+
+# entries remember the projection they were parsed with, None meaning all
+def cache_get(cache, file, fields):
+    st = os.stat(file)
+    key = os.path.abspath(file)
+    entry = cache['entries'].pop(key, None)
+    if entry and entry[0] == (st.st_size, st.st_mtime_ns) and \
+            (entry[1] is None or (fields is not None and fields <= entry[1])):
+        cache['hits'] += 1
+        # re-insert so that dict order doubles as least-recently-used order
+        cache['entries'][key] = entry
+        return entry[2]
+    cache['misses'] += 1
+    return None
+
+def cache_put(cache, file, fields, session):
+    st = os.stat(file)
+    cache['entries'][os.path.abspath(file)] = \
+        ((st.st_size, st.st_mtime_ns), fields, session)
+    cache['dirty'] = True
+
+# pickled to a temporary file of its own and renamed, so that concurrent
+# runs never see or replace half a cache; failing to write only means the
+# next run parses again
+def cache_write(path, data):
+    import pickle
+    import tempfile
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+            prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        print('warning: not writing cache %s: %s' % (path, e), file=sys.stderr)
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+def cache_close(cache):
+    if cache['entries'] is None:
+        return
+    entries = cache['entries']
+    while len(entries) > cache['limit']:
+        del entries[next(iter(entries))]
+        cache['dirty'] = True
+    if cache['dirty']:
+        cache_write(cache['path'], (cache_version, entries))
+    print('cache: %d hits, %d misses' % (cache['hits'], cache['misses']),
+        file=sys.stderr)
+
+def parse_all(files, fields=None):
+    if files is None:
+        # no XML files named on the command line, use --pack or --index
+        if store is not None:
+            return store_sessions(store, fields, **store_filters)
+        return index_sessions(index, **index_filters)
+    if fields is not None:
+        fields = frozenset(fields)
+    if cache is None:
+        return parse_many(files, fields)
+    if cache['entries'] is None:
+        cache_load(cache)
+    sessions = [cache_get(cache, file, fields) for file in files]
+    missing = [i for i, session in enumerate(sessions) if session is None]
+    parsed = parse_many([files[i] for i in missing], fields)
+    for i, session in zip(missing, parsed):
+        cache_put(cache, files[i], fields, session)
+        sessions[i] = session
+    return sessions
+
+##############################################################################
+# parallel parsing
 ##############################################################################
 
-def landing(files, title, url_generator):
+jobs = 1
+
+def parse_chunk(files, fields):
     sessions = []
     for file in files:
-        sessions.append(parse(file))
-    sessions = sorted(sessions, key=lambda s: s['start'])
-    year = ''
+        try:
+            sessions.append(parse_fields(file, fields))
+        except Exception as e:
+            # the traceback of a worker process does not show its arguments
+            raise RuntimeError('in file: %s' % file) from e
+    return sessions
+
+def parse_many(files, fields):
+    profile_read(files)
+    if jobs <= 1 or len(files) < 2:
+        return [parse_fields(file, fields) for file in files]
+    import concurrent.futures
+    # a few chunks per worker keeps them busy without one IPC trip per file
+    size = max(1, len(files) // (jobs * 4))
+    chunks = [files[i:i + size] for i in range(0, len(files), size)]
+    sessions = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        for chunk in pool.map(parse_chunk, chunks, [fields] * len(chunks)):
+            sessions.extend(chunk)
+    return sessions
+
+##############################################################################
+# SQLite index
+##############################################################################
+
+# same schema as swim/render.py so both archives can share one database file
+index_schema = '''
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS venues (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    start TEXT NOT NULL,
+    kind TEXT,
+    volume INTEGER,
+    venue_id INTEGER NOT NULL REFERENCES venues(id),
+    spacious INTEGER);
+CREATE INDEX IF NOT EXISTS sessions_type_start ON sessions(type, start);
+CREATE TABLE IF NOT EXISTS sets (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    stroke TEXT,
+    summary TEXT);
+CREATE INDEX IF NOT EXISTS sets_session ON sets(session_id);
+CREATE INDEX IF NOT EXISTS sets_stroke ON sets(stroke);
+CREATE TABLE IF NOT EXISTS lifts (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    weight REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS lifts_session ON lifts(session_id);
+CREATE INDEX IF NOT EXISTS lifts_kind ON lifts(kind);
+CREATE TABLE IF NOT EXISTS notes (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    item INTEGER, -- position of the set or lift, NULL for the whole session
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT);
+CREATE INDEX IF NOT EXISTS notes_session ON notes(session_id);
+'''
+
+index = None
+index_filters = {}
+
+def index_open(path):
+    import sqlite3
+    db = sqlite3.connect(path)
+    db.executescript(index_schema)
+    return db
+
+def index_notes(db, session_id, item, field, notes):
+    if notes is None:
+        return
+    if type(notes) != list:
+        notes = [notes]
+    db.executemany('INSERT INTO notes VALUES (?, ?, ?, ?, ?)',
+        [(session_id, item, field, pos, note) for pos, note in enumerate(notes)])
+
+def index_session(db, path, stamp, session):
+    db.execute('DELETE FROM sessions WHERE path = ?', (path,))
+    db.execute('INSERT OR IGNORE INTO venues (name) VALUES (?)',
+        (session.venue.name,))
+    venue_id = db.execute('SELECT id FROM venues WHERE name = ?',
+        (session.venue.name,)).fetchone()[0]
+    session_id = db.execute('INSERT INTO sessions (path, size, mtime_ns, '
+        'type, start, venue_id) VALUES (?, ?, ?, ?, ?, ?)',
+        (path, stamp[0], stamp[1], 'lift', str(session.start),
+        venue_id)).lastrowid
+    index_notes(db, session_id, None, 'venue', session.venue.notes)
+    for field in ['injuries', 'warmup']:
+        index_notes(db, session_id, None, field, getattr(session, field))
+    for pos, l in enumerate(session.lifts):
+        db.execute('INSERT INTO lifts VALUES (?, ?, ?, ?)',
+            (session_id, pos, l.kind, l.weight))
+        for field in ['preparation', 'warmup', 'comments', 'next', 'video']:
+            index_notes(db, session_id, pos, field, getattr(l, field))
+
+def index_update(db, directories):
+    known = {path: (size, mtime_ns) for path, size, mtime_ns in db.execute(
+        'SELECT path, size, mtime_ns FROM sessions WHERE type = ?', ('lift',))}
+    seen = set()
+    changed = []
+    for directory in directories:
+        for file in glob.glob(os.path.join(directory, '*.xml')):
+            path = os.path.abspath(file)
+            st = os.stat(path)
+            seen.add(path)
+            if known.get(path) != (st.st_size, st.st_mtime_ns):
+                changed.append((path, (st.st_size, st.st_mtime_ns)))
+    parsed = parse_many([path for path, stamp in changed], None)
+    for (path, stamp), session in zip(changed, parsed):
+        index_session(db, path, stamp, session)
+    # only forget sessions from the directories that were scanned
+    scanned = {os.path.abspath(directory) for directory in directories}
+    removed = [path for path in known
+        if path not in seen and os.path.dirname(path) in scanned]
+    db.executemany('DELETE FROM sessions WHERE path = ?',
+        [(path,) for path in removed])
+    db.commit()
+    print('index: %d updated, %d removed' % (len(changed), len(removed)),
+        file=sys.stderr)
+
+def index_sessions(db, since=None, until=None, venue=None, lift=None):
+    where = ['s.type = ?']
+    params = ['lift']
+    if since:
+        where.append('s.start >= ?')
+        params.append(str(since))
+    # before the next day keeps to the (type, start) index; there is no
+    # day after date.max, and nothing to leave out either
+    if until and until < datetime.date.max:
+        where.append('s.start < ?')
+        params.append(str(until + datetime.timedelta(days=1)))
+    if venue:
+        where.append('v.name = ?')
+        params.append(venue)
+    if lift:
+        where.append('s.id IN (SELECT session_id FROM lifts WHERE kind = ?)')
+        params.append(lift)
+    where = ' AND '.join(where)
+    sessions = {}
+    for session_id, path, start, name in db.execute('SELECT s.id, s.path, '
+            's.start, v.name FROM sessions s '
+            'JOIN venues v ON v.id = s.venue_id WHERE ' + where, params):
+        sessions[session_id] = Session(
+            start=datetime.datetime.fromisoformat(start),
+            venue=intern_venue(name),
+            lifts=[],
+            filename=os.path.basename(path))
+    for session_id, kind, weight in db.execute('SELECT l.session_id, '
+            'l.kind, l.weight FROM lifts l '
+            'JOIN sessions s ON s.id = l.session_id '
+            'JOIN venues v ON v.id = s.venue_id WHERE ' + where +
+            ' ORDER BY l.session_id, l.position', params):
+        sessions[session_id].lifts.append(Lift(kind, weight))
+    return list(sessions.values())
 
-    print('<html><head><title>%s</title>' % title)
-    print('<link rel="icon" type="image/x-icon" href="favicon.ico">')
-    print('''<style> /* Top-Right-Bottom-Left */
+##############################################################################
+# packed store
+##############################################################################
+
+# --pack: sessions are read from a pack.py store rather than XML files,
+# straight out of its memory map without a syscall per session
+store = None
+store_filters = {}
+
+def store_sessions(store, fields, since=None, until=None):
+    import pack
+    since = since or datetime.date.min
+    until = until or datetime.date.max
+    if fields is not None:
+        fields = frozenset(fields) | {'start'}
+    sessions = []
+    for name in pack.pack_names(store):
+        date = file_date(name)
+        if date is not None and not since <= date <= until:
+            continue
+        member = pack.pack_member(store, name)
+        profile_read([member])
+        session = parse_fields(member, fields)
+        if date is None and not since <= session.start.date() <= until:
+            continue
+        sessions.append(session)
+    return sessions
+
+# --single names a session in the --pack store, with or without .xml
+def member(file):
+    import pack
+    if store is None:
+        return file
+    name = os.path.basename(file)
+    if not name.endswith('.xml'):
+        name += '.xml'
+    return pack.pack_member(store, name)
+
+##############################################################################
+# output
+##############################################################################
+
+# pages are collected as a list of strings filled in from the templates
+# below and written out with one write() instead of a print() per line
+def write_page(page, out):
+    out.write(''.join(page))
+
+landing_head = '''<html><head><title>%s</title>
+<link rel="icon" type="image/x-icon" href="favicon.ico">
+<style> /* Top-Right-Bottom-Left */
       HTML             { font-family: Helvetica; padding: 20pt 0pt 0pt 20pt; }
       TD               { font-size: 7pt; padding-top: 4pt; padding-bottom: 4pt; }
       TD A             { color: white; }
@@ -145,130 +632,525 @@ def landing(files, title, url_generator):
       #ex1, #ex2,
         #ex3, #ex4     { background: #C9C9C9; }
       #ex5, #ex6       { background: #B8B8B8; }
-    </style>''')
-    print('</head><body>')
+    </style>
+</head><body>
+'''
+landing_month = '<h1>%s%s</h1> <table><thead><tr><td colspan="2"/> ' + \
+    ''.join('<td class="label">%s</td>' % name for name in order) + \
+    ' </tr></thead><tbody>\n'
+landing_month_end = '</tbody></table>\n'
+# url, day, url, weekday, then one cell per lift in order
+landing_row = '<tr><td class="col1"><a href="%s">%d</a></td> ' \
+    '<td class="col2"><a href="%s">%s</a></td>\n' + \
+    ''.join('<td class="col4" id="ex%d">%%s</td>' % pos
+        for pos in range(len(order))) + \
+    '</tr>\n'
+landing_foot = '<p><a href="..">../</a></p>\n</body></html>\n'
+# --landing-progress section, a column per lift as in the month tables
+progress_head = landing_month % ('Progress', '')
+# label, then one cell per lift in order
+progress_row = '<tr><td class="col1" colspan="2">%s</td>\n' + \
+    ''.join('<td class="col4" id="ex%d">%%s</td>' % pos
+        for pos in range(len(order))) + \
+    '</tr>\n'
+shards_row = '<p><a href="%s.html">%s</a>, %d sessions</p>\n'
+shard_foot = '<p><a href="index.html">%s</a></p>\n</body></html>\n'
+
+single_head = '''<html><head><meta charset="utf-8">
+<link rel="icon" type="image/x-icon" href="favicon.ico">
+<title>%s</title></head><body><main>
+<header><h2>%s</h2>
+<p>%s, %s</p></header>
+'''
+single_ul = '<section>%s<ul>\n%s</ul></section>\n'
+single_li = '<li>%s</li>\n'
+single_p = '<section><p>%s%s</p></section>\n'
+single_h3 = '<h3>%gkg %s</h3>\n'
+single_picture = '<section><p><img width="200" src="%s" alt="%s"></p></section>\n'
+# mobile Safari reader mode seems to require the 'main' semantic HTML tag
+single_foot = '</main></body></html>\n'
+
+##############################################################################
+# --publish
+##############################################################################
+
+# for static hosting every page written gets .gz (and, with the brotli
+# module, .br) siblings and its SHA-256 in a manifest.json next to it;
+# pages whose content did not change are left alone, mtimes and all
+publish = None
+
+def publish_start():
+    global publish
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    publish = {'manifests': {}, 'brotli': brotli, 'written': 0, 'unchanged': 0}
+
+def publish_manifest(directory):
+    import json
+    if directory not in publish['manifests']:
+        try:
+            with open(os.path.join(directory, 'manifest.json')) as fh:
+                publish['manifests'][directory] = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            publish['manifests'][directory] = {}
+    return publish['manifests'][directory]
+
+# compressed siblings --publish writes next to each page, part of the
+# --shards fingerprints so that adding --publish (or brotli) redoes them
+def publish_siblings():
+    if publish is None:
+        return []
+    return ['.gz', '.br'] if publish['brotli'] else ['.gz']
+
+def publish_file(path, text):
+    import gzip
+    import hashlib
+    data = text.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    directory, name = os.path.split(os.path.abspath(path))
+    manifest = publish_manifest(directory)
+    if manifest.get(name) == digest and all(os.path.exists(path + ext)
+            for ext in [''] + publish_siblings()):
+        publish['unchanged'] += 1
+        return
+    siblings = {'': data, '.gz': gzip.compress(data, 9, mtime=0)}
+    if publish['brotli']:
+        siblings['.br'] = publish['brotli'].compress(data)
+    for ext, body in siblings.items():
+        tmp = os.path.join(directory, '.%s%s.tmp' % (name, ext))
+        with open(tmp, 'wb') as fh:
+            fh.write(body)
+        os.replace(tmp, path + ext)
+    manifest[name] = digest
+    publish['written'] += 1
+
+def publish_close():
+    import json
+    for directory, manifest in publish['manifests'].items():
+        text = json.dumps(manifest, indent=1, sort_keys=True) + '\n'
+        path = os.path.join(directory, 'manifest.json')
+        try:
+            with open(path) as fh:
+                if fh.read() == text:
+                    continue
+        except FileNotFoundError:
+            pass
+        with open(path + '.tmp', 'w') as fh:
+            fh.write(text)
+        os.replace(path + '.tmp', path)
+    print('publish: %d written, %d unchanged' % (publish['written'],
+        publish['unchanged']), file=sys.stderr)
 
+##############################################################################
+# --landing
+##############################################################################
+
+landing_fields = ('start', 'venue', 'lifts')
+
+# appends the month blocks of SESSIONS, in order, to PAGE
+def landing_blocks(sessions, url_generator, page):
+    year = ''
     block = None
     for s in sessions:
-        year_suffix = ' %d' % s['start'].year if year != s['start'].year else ''
-        month = s['start'].strftime('%B')
-        year = s['start'].year
-        if block != month:
+        start = s.start
+        year_suffix = ' %d' % start.year if year != start.year else ''
+        year = start.year
+        if block != start.month:
             if block:
-                print('</tbody></table>')
-            print(
-                '<h1>%s%s</h1>' % (month, year_suffix),
-                '<table><thead><tr><td colspan="2"/>',
-                ''.join(('<td class="label">%s</td>') % name for name in order),
-                '</tr></thead><tbody>'
-            )
-            block = month
+                page.append(landing_month_end)
+            page.append(landing_month % (start.strftime('%B'), year_suffix))
+            block = start.month
 
         url = url_generator(s)
-        venue_short = unidecode.unidecode(s['venue']['name']).lower()
-        venue_full = s['venue']['name'].encode('ascii', 'xmlcharrefreplace').decode()
-        print(
-            '<tr><td class="col1"><a href="%s">%s</a></td>' % \
-                (url, s['start'].strftime('%-d')),
-            '<td class="col2"><a href="%s">%s</a></td>' % \
-                (url, s['start'].strftime('%a')[0:2])
-        )
-        for pos in range(len(order)):
-            lift = next((l for l in s['lifts'] \
-                if order[pos] == l['kind']), None)
-            print('<td class="col4" id="ex%d">%s</td>' % \
-                (pos, lift['weight'] if lift else ''), end='')
-        print('</tr>')
+        weights = {l.kind: l.weight for l in reversed(s.lifts)}
+        page.append(landing_row % ((
+            url, start.day,
+            url, weekdays[start.weekday()]) +
+            tuple(weights.get(kind, '') for kind in order)))
     if block:
-        print('</tbody></table>')
+        page.append(landing_month_end)
+
+# --landing-progress: progress per lift shown after the sessions
+landing_progress = False
+
+def landing(files, title, url_generator, out=None):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    sessions = parse_all(files, landing_fields)
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    page = [landing_head % title]
+    landing_blocks(sessions, url_generator, page)
+    if landing_progress:
+        progress_section(sessions, page)
+    page.append(landing_foot)
+    stage('write')
+    write_page(page, out)
+
+##############################################################################
+# --shards
+##############################################################################
 
-    print('<p><a href="..">../</a></p>')
-    print('</body></html>')
+# one landing page per year (or per N months) and an index of them; the
+# stamps of each shard's files are kept in OUTDIR/.shards.json so shards
+# whose files did not change are not parsed or written again
+def shard_key(date, months):
+    if months == 12:
+        return '%d' % date.year
+    return '%d-%02d' % (date.year, (date.month - 1) // months * months + 1)
+
+# first and last day of the shard KEY
+def shard_range(key, months):
+    import calendar
+    if '-' not in key:
+        year = int(key)
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    year, month = [int(part) for part in key.split('-')]
+    last = min(month + months - 1, 12)
+    return datetime.date(year, month, 1), \
+        datetime.date(year, last, calendar.monthrange(year, last)[1])
+
+def shard_write(outdir, name, page):
+    if publish:
+        publish_file(os.path.join(outdir, name), ''.join(page))
+        return
+    tmp = os.path.join(outdir, '.%s.tmp' % name)
+    with open(tmp, 'w') as fh:
+        write_page(page, fh)
+    os.replace(tmp, os.path.join(outdir, name))
+
+# and its --publish siblings
+def shard_remove(outdir, name):
+    if publish:
+        publish_manifest(os.path.abspath(outdir)).pop(name, None)
+    for ext in ['', '.gz', '.br']:
+        try:
+            os.remove(os.path.join(outdir, name + ext))
+        except FileNotFoundError:
+            pass
+
+# SINCE and UNTIL are the --since/--until the files were pruned to, widened
+# to whole shards; shards outside them are left as they are
+def shards(files, title, url_generator, outdir, months=12, since=None,
+        until=None):
+    import hashlib
+    import json
+    stage('parse')
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, '.shards.json')
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    groups = {}
+    if files is None:
+        # --pack or --index sessions have no stamps, render every shard
+        for s in parse_all(None, landing_fields):
+            groups.setdefault(shard_key(s.start, months), []).append(s)
+        fingerprints = {key: None for key in groups}
+    else:
+        unnamed = []
+        for file in files:
+            date = file_date(file)
+            if date is None:
+                unnamed.append(file)
+            else:
+                groups.setdefault(shard_key(date, months), []).append(file)
+        for file, s in zip(unnamed, parse_all(unnamed, ('start',))):
+            groups.setdefault(shard_key(s.start, months), []).append(file)
+        fingerprints = {}
+        for key, group in groups.items():
+            stamps = sorted((os.path.abspath(file), os.stat(file).st_size,
+                os.stat(file).st_mtime_ns) for file in group)
+            fingerprints[key] = hashlib.sha1(repr((title, publish_siblings(),
+                stamps)).encode()
+                ).hexdigest()
+        changed = [key for key in groups if fingerprints[key] !=
+            manifest.get(key, {}).get('fingerprint') or
+            not all(os.path.exists(os.path.join(outdir, key + '.html' + ext))
+            for ext in [''] + publish_siblings())]
+        parsed = iter(parse_all([file for key in changed
+            for file in groups[key]], landing_fields))
+        groups = {key: [next(parsed) for file in groups[key]]
+            if key in changed else None for key in groups}
+    stage('render')
+    written = 0
+    for key, sessions in groups.items():
+        if sessions is None:
+            continue
+        written += 1
+        sessions.sort(key=lambda s: s.start)
+        page = [landing_head % ('%s %s' % (title, key))]
+        landing_blocks(sessions, url_generator, page)
+        page.append(shard_foot % title)
+        shard_write(outdir, key + '.html', page)
+        manifest[key] = {'fingerprint': fingerprints[key],
+            'sessions': len(sessions)}
+    for key in list(manifest):
+        first, last = shard_range(key, months)
+        if key not in groups and (since is None or first >= since) and \
+                (until is None or last <= until):
+            del manifest[key]
+            shard_remove(outdir, key + '.html')
+    page = [landing_head % title]
+    for key in sorted(manifest, reverse=True):
+        page.append(shards_row % (key, key, manifest[key]['sessions']))
+    page.append(landing_foot)
+    stage('write')
+    shard_write(outdir, 'index.html', page)
+    with open(manifest_path, 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    print('shards: %d written, %d unchanged' % (written,
+        len(groups) - written), file=sys.stderr)
 
 ##############################################################################
 # --single
 ##############################################################################
 
-def single(file, pictures):
+def single(file, pictures, out=None):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    profile_read([file])
     session = parse(file)
+    stage('render')
+    page = single_page(session, pictures)
+    stage('write')
+    write_page(page, out)
 
-    shortdate = session['start'].strftime('%b %-d')
-    print('<html><head><meta charset="utf-8">')
-    print('<link rel="icon" type="image/x-icon" href="favicon.ico">')
-    print('<title>%s</title></head><body><main>' % shortdate)
-    print('<header><h2>%s</h2>' % shortdate)
-
+def single_page(session, pictures):
+    shortdate = session.start.strftime('%b %-d')
     # explicit encoding: encode('ascii', 'xmlcharrefreplace').decode()
-    print('<p>%s, %s</p></header>' % \
-        (time_ampm(session['start']), session['venue']['name']))
+    page = [single_head % (shortdate, shortdate,
+        time_ampm(session.start), session.venue.name)]
 
     def p_or_ul(obj, prefix):
         if type(obj) == list:
-            print('<section>%s<ul>' % prefix)
-            for bullet in obj:
-                print('<li>%s</li>' % bullet)
-            print('</ul></section>')
+            page.append(single_ul % (prefix,
+                ''.join(single_li % bullet for bullet in obj)))
         else:
-            print('<section><p>%s%s</p></section>' % (prefix, capitalise(obj)))
+            page.append(single_p % (prefix, capitalise(obj)))
 
-    if 'notes' in session['venue']:
-        p_or_ul(session['venue']['notes'], '')
+    if session.venue.notes is not None:
+        p_or_ul(session.venue.notes, '')
 
-    if 'injuries' in session and session['injuries']:
-        p_or_ul(session['injuries'], 'Injuries: ')
+    if session.injuries:
+        p_or_ul(session.injuries, 'Injuries: ')
 
-    p_or_ul(session['warmup'], 'Warm-up: ')
+    p_or_ul(session.warmup, 'Warm-up: ')
 
-    for l in session['lifts']:
-        print('<h3>%gkg %s</h3>' % (l['weight'], l['kind']))
+    for l in session.lifts:
+        page.append(single_h3 % (l.weight, l.kind))
 
-        p_or_ul(l['preparation'], '')
-        if 'warmup' in l:
-            p_or_ul(l['warmup'], 'Warm-up: ')
-        if 'comments' in l:
-            p_or_ul(l['comments'], 'Comments: ')
-        if 'video' in l:
-            p_or_ul(l['video'], 'Video: ')
-        p_or_ul(l['next'], 'Next: ')
+        p_or_ul(l.preparation, '')
+        if l.warmup is not None:
+            p_or_ul(l.warmup, 'Warm-up: ')
+        if l.comments is not None:
+            p_or_ul(l.comments, 'Comments: ')
+        if l.video is not None:
+            p_or_ul(l.video, 'Video: ')
+        p_or_ul(l.next, 'Next: ')
 
-        if l['kind'] in pictures:
-            print('<section><p><img width="200" src="%s" alt="%s"></p></section>' % \
-                (pictures[l['kind']], shortdate))
+        if l.kind in pictures:
+            page.append(single_picture % (pictures[l.kind], shortdate))
 
-    # mobile Safari reader mode seems to require the 'main' semantic HTML tag
-    print('</main></body></html>')
+    page.append(single_foot)
+    return page
 
 ##############################################################################
 # --summary
 ##############################################################################
 
-def summary(files):
-    sessions = []
-    for file in files:
-        sessions.append(parse(file))
-    sessions = sorted(sessions, key=lambda s: s['start'])
-    writer = csv.writer(sys.stdout)
+def summary(files, out=None):
+    if out is None:
+        out = sys.stdout
+    fields = ('start', 'lifts')
+    stage('parse')
+    sessions = parse_all(files, fields)
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    summary_write(sessions, out)
+
+# SESSIONS in order
+def summary_write(sessions, out):
+    import csv
+    writer = csv.writer(out)
     for s in sessions:
-        for l in s['lifts']:
+        for l in s.lifts:
             writer.writerow([
-                s['start'].strftime('%Y-%m-%d'),
-                l['kind'],
-                '%gkg' % l['weight'],
+                s.start.strftime('%Y-%m-%d'),
+                l.kind,
+                '%gkg' % l.weight,
                 ''
             ])
 
+##############################################################################
+# --progress
+##############################################################################
+
+# per lift kind, at each of its sessions: the best weight so far, the best
+# estimated one-rep max so far (Epley; the XML has no reps, so working sets
+# are taken to be progress_reps each), the least-squares trend in kg per week
+# over the last progress_window days, and a stall when that trend is flat
+# or falling over at least progress_minimum sessions. Uses NumPy when
+# installed, plain lists otherwise
+progress_fields = ('start', 'lifts')
+progress_reps = 5
+progress_window = 84
+progress_minimum = 4
+
+# kind -> (starts, {'weight', 'best', 'e1rm', 'trend', 'stalled': [...]})
+def progress_series(sessions):
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    sessions = sorted(sessions, key=lambda s: s.start)
+    if not sessions:
+        return {}
+    first = sessions[0].start.date()
+    points = {kind: ([], [], []) for kind in order}
+    for s in sessions:
+        for l in s.lifts:
+            starts, days, weights = points[l.kind]
+            starts.append(s.start)
+            days.append(float((s.start.date() - first).days))
+            weights.append(l.weight)
+    series = {}
+    for kind, (starts, days, weights) in points.items():
+        if not starts:
+            continue
+        if numpy is None:
+            series[kind] = (starts, progress_lists(days, weights))
+        else:
+            series[kind] = (starts, progress_arrays(numpy, days, weights))
+    return series
+
+def progress_arrays(numpy, days, weights):
+    x = numpy.array(days)
+    y = numpy.array(weights, dtype=numpy.float64)
+    # where the window of each session starts
+    start = numpy.searchsorted(x, x - progress_window, side='right')
+    def window(v):
+        total = numpy.concatenate(([0.0], numpy.cumsum(v)))
+        return total[1:] - total[start]
+    n = window(numpy.ones_like(x))
+    sx = window(x)
+    sy = window(y)
+    denominator = n * window(x * x) - sx * sx
+    trend = numpy.zeros_like(x)
+    numpy.divide(n * window(x * y) - sx * sy, denominator, out=trend,
+        where=denominator > 0)
+    trend *= 7
+    return {'weight': y.tolist(),
+        'best': numpy.maximum.accumulate(y).tolist(),
+        'e1rm': (numpy.maximum.accumulate(y) * (1 + progress_reps / 30)
+            ).tolist(),
+        'trend': trend.tolist(),
+        'stalled': ((n >= progress_minimum) & (trend <= 0)).tolist()}
+
+def progress_lists(days, weights):
+    import bisect
+    import itertools
+    start = [bisect.bisect_right(days, x - progress_window) for x in days]
+    def window(v):
+        total = list(itertools.accumulate(v, initial=0.0))
+        return [total[i + 1] - total[start[i]] for i in range(len(v))]
+    n = window([1.0] * len(days))
+    sx = window(days)
+    sy = window(weights)
+    sxx = window([x * x for x in days])
+    sxy = window([x * y for x, y in zip(days, weights)])
+    trend = []
+    for i in range(len(days)):
+        denominator = n[i] * sxx[i] - sx[i] * sx[i]
+        if denominator > 0:
+            trend.append((n[i] * sxy[i] - sx[i] * sy[i]) / denominator * 7)
+        else:
+            trend.append(0.0)
+    return {'weight': [float(y) for y in weights],
+        'best': list(itertools.accumulate(weights, max)),
+        'e1rm': [y * (1 + progress_reps / 30)
+            for y in itertools.accumulate(weights, max)],
+        'trend': trend,
+        'stalled': [count >= progress_minimum and slope <= 0
+            for count, slope in zip(n, trend)]}
+
+def progress(files, out=None):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    sessions = parse_all(files, progress_fields)
+    stage('render')
+    progress_write(sessions, out)
+
+def progress_write(sessions, out):
+    import csv
+    rows = []
+    for kind, (starts, p) in progress_series(sessions).items():
+        for i, start in enumerate(starts):
+            rows.append((start, order.index(kind), [
+                start.strftime('%Y-%m-%d'),
+                kind,
+                '%gkg' % p['weight'][i],
+                '%gkg' % p['best'][i],
+                '%.1fkg' % p['e1rm'][i],
+                '%+.2fkg' % p['trend'][i],
+                'stalled' if p['stalled'][i] else ''
+            ]))
+    rows.sort(key=lambda row: row[:2])
+    writer = csv.writer(out)
+    for start, position, row in rows:
+        writer.writerow(row)
+
+# best weight and estimated 1RM, trend and stalls of each kind as of its last session
+def progress_section(sessions, page):
+    series = progress_series(sessions)
+    if not series:
+        return
+    page.append(progress_head)
+    for label, field, format in [('best', 'best', '%g'),
+            ('best e1RM', 'e1rm', '%.1f'), ('kg/week', 'trend', '%+.2f'),
+            ('stalled', 'stalled', None)]:
+        cells = []
+        for kind in order:
+            if kind not in series:
+                cells.append('')
+            elif format is None:
+                cells.append('yes' if series[kind][1][field][-1] else '')
+            else:
+                cells.append(format % series[kind][1][field][-1])
+        page.append(progress_row % ((label,) + tuple(cells)))
+    page.append(landing_month_end)
+
 ##############################################################################
 # --database
 ##############################################################################
 
-def database(files):
-    sessions = []
-    for file in files:
-        sessions.append(parse(file))
-    sessions = sorted(sessions, key=lambda s: s['start'])
-    writer = csv.writer(sys.stdout, delimiter='\t', lineterminator='\n')
+def database(files, out=None):
+    if out is None:
+        out = sys.stdout
+    fields = ('start', 'venue', 'lifts')
+    stage('parse')
+    sessions = parse_all(files, fields)
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    database_write(sessions, out)
+
+# SESSIONS in order
+def database_write(sessions, out):
+    import csv
+    import unidecode
+    writer = csv.writer(out, delimiter='\t', lineterminator='\n')
     for s in sessions:
-        venue_short = unidecode.unidecode(s['venue']['name']).lower()
+        venue_short = unidecode.unidecode(s.venue.name).lower()
 
         lifts = {
             'squat': -1.0,
@@ -279,14 +1161,14 @@ def database(files):
             'deadlift': -1.0,
             'clean': -1.0
         }
-        for l in s['lifts']:
-            assert l['kind'] in lifts
-            lifts[l['kind']] = l['weight']
+        for l in s.lifts:
+            assert l.kind in lifts
+            lifts[l.kind] = l.weight
 
         writer.writerow([
-            s['start'],
+            s.start,
             venue_short,
-            s['venue']['name'],
+            s.venue.name,
             lifts['squat'],
             lifts['press'],
             lifts['bench'],
@@ -296,51 +1178,505 @@ def database(files):
             lifts['clean']
         ])
 
+##############################################################################
+# --columnar
+##############################################################################
+
+# long-form tables for analytics, a row per session and one per lift joined
+# on "session"; written as Arrow IPC or Parquet with pyarrow, otherwise as
+# .columns files (see columns_write), strings dictionary-encoded either way
+columnar_types = {'session': 'int64', 'position': 'int64',
+    'start': 'timestamp', 'venue': 'dictionary', 'filename': 'dictionary',
+    'kind': 'dictionary', 'weight': 'float64'}
+
+def columnar_tables(sessions):
+    tables = {
+        'sessions': {column: [] for column in ['session', 'start', 'venue',
+            'filename']},
+        'lifts': {column: [] for column in ['session', 'position', 'kind',
+            'weight']}
+    }
+    rows = tables['sessions']
+    lifts = tables['lifts']
+    for i, s in enumerate(sessions):
+        rows['session'].append(i)
+        rows['start'].append(s.start)
+        rows['venue'].append(s.venue.name)
+        rows['filename'].append(s.filename)
+        for position, l in enumerate(s.lifts):
+            lifts['session'].append(i)
+            lifts['position'].append(position)
+            lifts['kind'].append(l.kind)
+            lifts['weight'].append(l.weight)
+    return tables
+
+def columnar(files, outdir, format=None):
+    if format is None:
+        try:
+            import pyarrow
+            format = 'arrow'
+        except ImportError:
+            format = 'columns'
+    stage('parse')
+    sessions = parse_all(files, ('start', 'venue', 'lifts'))
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    tables = columnar_tables(sessions)
+    stage('write')
+    os.makedirs(outdir, exist_ok=True)
+    for name, table in tables.items():
+        path = os.path.join(outdir, '%s.%s' % (name, format))
+        if format == 'columns':
+            columns_write(path, table)
+        else:
+            arrow_write(path, table, format)
+
+def arrow_write(path, table, format):
+    import pyarrow
+    types = {'int64': pyarrow.int64(), 'float64': pyarrow.float64(),
+        'bool': pyarrow.bool_(), 'timestamp': pyarrow.timestamp('s'),
+        'dictionary': pyarrow.string()}
+    arrays = {}
+    for column, values in table.items():
+        kind = columnar_types[column]
+        arrays[column] = pyarrow.array(values, types[kind])
+        if kind == 'dictionary':
+            arrays[column] = arrays[column].dictionary_encode()
+    table = pyarrow.table(arrays)
+    if format == 'parquet':
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, path)
+    else:
+        import pyarrow.ipc
+        with pyarrow.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+# a .columns file is one line of JSON describing the columns followed by
+# their little-endian arrays back to back: int64 and timestamp (seconds
+# since 1970, wall-clock time) as "q", float64 as "d", bool as "b" and
+# dictionary columns as "i" codes into the header's dictionary, -1 for None
+columns_codes = {'int64': 'q', 'timestamp': 'q', 'float64': 'd', 'bool': 'b',
+    'dictionary': 'i'}
+epoch = datetime.datetime(1970, 1, 1)
+second = datetime.timedelta(seconds=1)
+
+def columns_write(path, table):
+    import array
+    import json
+    header = {'rows': len(table['session']), 'columns': []}
+    buffers = []
+    offset = 0
+    for column, values in table.items():
+        kind = columnar_types[column]
+        entry = {'name': column, 'type': kind}
+        if kind == 'dictionary':
+            codes = {}
+            values = [-1 if v is None else codes.setdefault(v, len(codes))
+                for v in values]
+            entry['dictionary'] = list(codes)
+        elif kind == 'timestamp':
+            values = [(v - epoch) // second for v in values]
+        data = array.array(columns_codes[kind], values)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        entry['offset'] = offset
+        entry['length'] = len(data) * data.itemsize
+        offset += entry['length']
+        header['columns'].append(entry)
+        buffers.append(data.tobytes())
+    with open(path, 'wb') as fh:
+        fh.write(json.dumps(header).encode() + b'\n')
+        fh.write(b''.join(buffers))
+
+# column name -> list of values, for notebooks without pyarrow
+def columns_read(path):
+    import array
+    import json
+    with open(path, 'rb') as fh:
+        header = json.loads(fh.readline())
+        body = fh.read()
+    table = {}
+    for entry in header['columns']:
+        kind = entry['type']
+        data = array.array(columns_codes[kind])
+        data.frombytes(body[entry['offset']:entry['offset'] + entry['length']])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        if kind == 'dictionary':
+            dictionary = entry['dictionary']
+            table[entry['name']] = [None if code < 0 else dictionary[code]
+                for code in data]
+        elif kind == 'timestamp':
+            table[entry['name']] = [epoch + v * second for v in data]
+        elif kind == 'bool':
+            table[entry['name']] = [bool(v) for v in data]
+        else:
+            table[entry['name']] = data.tolist()
+    return table
+
+##############################################################################
+# --build
+##############################################################################
+
+# the landing page, summary, progress and database of all sessions and a diary page
+# for each, from one parse of every file; OUTDIR/.build.json keeps a
+# fingerprint of the inputs each output was made from (every XML file for
+# the summaries, its XML file and pictures for a diary page) so outputs
+# whose inputs did not change are not rendered or written again
+build_summaries = ['index.html', 'summary.csv', 'progress.csv',
+    'database.tsv']
+
+# NAME-KIND.jpg next to NAME.xml, as serve.py and watch.py look for them
+def build_pictures(file, outdir):
+    pictures = {}
+    for kind in order:
+        picture = '%s-%s.jpg' % (os.path.splitext(file)[0], kind)
+        if os.path.exists(picture):
+            pictures[kind] = os.path.relpath(picture, outdir)
+    return pictures
+
+# every output also depends on what --publish writes next to it
+def build_fingerprint(*inputs):
+    import hashlib
+    return hashlib.sha1(repr((publish_siblings(),) + inputs).encode()
+        ).hexdigest()
+
+def build(files, title, outdir):
+    import json
+    stage('parse')
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, '.build.json')
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    url = lambda s: '%s.html' % s.filename.replace('.xml', '')
+    fingerprints = {}
+    pictures = {}
+    if files is None:
+        # --pack sessions have no stamps or pictures, render everything
+        sessions = parse_all(None)
+        pages = {url(s): s for s in sessions}
+        fingerprints = {name: None for name in build_summaries + list(pages)}
+        pictures = {name: {} for name in pages}
+    else:
+        pages = {}
+        stamps = []
+        for file in files:
+            st = os.stat(file)
+            stamp = (os.path.abspath(file), st.st_size, st.st_mtime_ns)
+            stamps.append(stamp)
+            name = '%s.html' % filename(file).replace('.xml', '')
+            # pages are flat in OUTDIR, named like their XML files
+            if name in pages:
+                raise NameError('%s and %s would both be %s' % (pages[name],
+                    file, os.path.join(outdir, name)))
+            pages[name] = file
+            pictures[name] = build_pictures(file, outdir)
+            fingerprints[name] = build_fingerprint(stamp,
+                sorted(pictures[name].items()))
+        stamps.sort()
+        fingerprints['index.html'] = build_fingerprint(title,
+            landing_progress, progress_reps, stamps)
+        fingerprints['summary.csv'] = build_fingerprint(stamps)
+        fingerprints['progress.csv'] = build_fingerprint(progress_reps, stamps)
+        fingerprints['database.tsv'] = build_fingerprint(stamps)
+    stale = {name for name in fingerprints
+        if fingerprints[name] is None or fingerprints[name] !=
+        manifest.get(name) or not all(os.path.exists(os.path.join(outdir,
+        name + ext)) for ext in [''] + publish_siblings())}
+    if files is not None:
+        # the summaries need every session, otherwise only stale pages parse
+        if stale.intersection(build_summaries):
+            wanted = files
+        else:
+            wanted = [pages[name] for name in pages if name in stale]
+        parsed = dict(zip(wanted, parse_all(wanted)))
+        sessions = list(parsed.values())
+        pages = {name: parsed.get(file) for name, file in pages.items()}
+    stage('render')
+    for name, session in pages.items():
+        if name in stale:
+            shard_write(outdir, name, single_page(session, pictures[name]))
+    sessions.sort(key=lambda s: s.start)
+    if 'index.html' in stale:
+        page = [landing_head % title]
+        landing_blocks(sessions, url, page)
+        if landing_progress:
+            progress_section(sessions, page)
+        page.append(landing_foot)
+        shard_write(outdir, 'index.html', page)
+    if 'summary.csv' in stale:
+        shard_write(outdir, 'summary.csv', [to_string(summary_write, sessions)])
+    if 'progress.csv' in stale:
+        shard_write(outdir, 'progress.csv',
+            [to_string(progress_write, sessions)])
+    if 'database.tsv' in stale:
+        shard_write(outdir, 'database.tsv',
+            [to_string(database_write, sessions)])
+    stage('write')
+    for name in manifest:
+        if name not in fingerprints:
+            shard_remove(outdir, name)
+    with open(manifest_path, 'w') as fh:
+        json.dump(fingerprints, fh, indent=1)
+    print('build: %d written, %d unchanged, %d removed' % (len(stale),
+        len(fingerprints) - len(stale),
+        len(set(manifest) - set(fingerprints))), file=sys.stderr)
+
+##############################################################################
+# date pruning
+##############################################################################
+
+# session files are named YYYYMMDD[-SUFFIX].xml, None for other names
+def file_date(file):
+    name = os.path.basename(file).split('.')[0].split('-')[0]
+    if len(name) != 8 or not name.isdigit():
+        return None
+    try:
+        return datetime.date(int(name[:4]), int(name[4:6]), int(name[6:]))
+    except ValueError:
+        return None
+
+# drop files outside [since, until] by name, opening only the oddly named
+def prune(files, since, until):
+    if files is None or (since is None and until is None):
+        return files
+    stage('prune')
+    since = since or datetime.date.min
+    until = until or datetime.date.max
+    kept = []
+    unnamed = []
+    for file in files:
+        date = file_date(file)
+        if date is None:
+            unnamed.append(file)
+        elif since <= date <= until:
+            kept.append(file)
+    if unnamed:
+        for file, s in zip(unnamed, parse_all(unnamed, ('start',))):
+            if since <= s.start.date() <= until:
+                kept.append(file)
+    return kept
+
 ##############################################################################
 # main
 ##############################################################################
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--title',
-    metavar='TITLE', help='HTML title')
-parser.add_argument('-p', '--picture', action='append', nargs=2,
-    metavar=('JPGFILE', 'KIND'),
-    help='Picture to reference from HTML (with lift of given kind)')
-parser.add_argument('-l', '--landing', nargs='+',
-    metavar='XMLFILE', help='HTML landing page (HTML filenames from XML ones)')
-parser.add_argument('-s', '--summary', nargs='+',
-    metavar='XMLFILE', help='CSV summary')
-parser.add_argument('-d', '--database', nargs='+',
-    metavar='XMLFILE', help='Database-friendly summary with some detail')
-parser.add_argument('-D', '--database-dir', nargs='+',
-    metavar='DIRECTORY', help='Database-friendly summary with some detail (scan directory for XML files)')
-parser.add_argument('-1', '--single',
-    metavar='XMLFILE', help='HTML diary page')
-args = vars(parser.parse_args())
-if len(sys.argv) == 1:
-    parser.print_usage()
-    sys.exit(2)
-
-if args['landing']:
+def main(argv=None):
+    global cache, jobs, index, index_filters, store, store_filters
+    global landing_progress, progress_reps
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--title',
+        metavar='TITLE', help='HTML title')
+    parser.add_argument('-p', '--picture', action='append', nargs=2,
+        metavar=('JPGFILE', 'KIND'),
+        help='Picture to reference from HTML (with lift of given kind)')
+    parser.add_argument('-l', '--landing', nargs='*',
+        metavar='XMLFILE', help='HTML landing page (HTML filenames from XML ones, or from --index if none given)')
+    parser.add_argument('-s', '--summary', nargs='*',
+        metavar='XMLFILE', help='CSV summary (from --index if no XMLFILE given)')
+    parser.add_argument('-P', '--progress', nargs='*',
+        metavar='XMLFILE', help='Progress CSV, a row per lift: date, kind, weight, best so far, best estimated 1RM so far, trend per week over the last 12 weeks, "stalled" (from --index if no XMLFILE given)')
+    parser.add_argument('--landing-progress', action='store_true',
+        help='With --landing or --build, end the landing page with the progress of each lift')
+    parser.add_argument('--reps', type=int, default=progress_reps,
+        metavar='N', help='Repetitions per working set, for the estimated 1RM (default: %(default)s)')
+    parser.add_argument('-d', '--database', nargs='*',
+        metavar='XMLFILE', help='Database-friendly summary with some detail (from --index if no XMLFILE given)')
+    parser.add_argument('-D', '--database-dir', nargs='+',
+        metavar='DIRECTORY', help='Database-friendly summary with some detail (scan directory for XML files)')
+    parser.add_argument('--columnar',
+        metavar='OUTDIR', help='With --database, --database-dir or --query, write long-form tables to OUTDIR instead of TSV')
+    parser.add_argument('--columnar-format', choices=['arrow', 'parquet', 'columns'],
+        help='Arrow IPC or Parquet (need pyarrow) or the built-in .columns format (default: arrow if pyarrow is installed)')
+    parser.add_argument('-1', '--single',
+        metavar='XMLFILE', help='HTML diary page')
+    parser.add_argument('--shards',
+        metavar='OUTDIR', help='With --landing, write OUTDIR/YYYY.html per year and an OUTDIR/index.html of them, only redoing changed years')
+    parser.add_argument('--shard-months', type=int, default=12,
+        choices=[1, 2, 3, 4, 6, 12],
+        metavar='N', help='With --shards, one page per N months named YYYY-MM.html (default: %(default)s)')
+    parser.add_argument('-b', '--build', nargs='+',
+        metavar=('OUTDIR', 'XMLFILE'), help='Write the landing page, summary, progress, database and every diary page to OUTDIR, only redoing those whose XML files or pictures (NAME-KIND.jpg next to NAME.xml) changed (from --pack if no XMLFILE given)')
+    parser.add_argument('-o', '--output',
+        metavar='FILE', help='Write to FILE instead of standard output')
+    parser.add_argument('--publish', action='store_true',
+        help='For static hosting: leave unchanged --output and --shards pages alone, add .gz/.br siblings and a manifest.json of SHA-256 hashes')
+    parser.add_argument('--cache', default=cache_default_path(),
+        metavar='FILE', help='Parsed-session cache (default: %(default)s)')
+    parser.add_argument('--cache-limit', type=int, default=100000,
+        metavar='N', help='Maximum number of sessions kept in the cache')
+    parser.add_argument('--no-cache', action='store_true',
+        help='Parse every XML file, bypassing the cache')
+    parser.add_argument('--clear-cache', action='store_true',
+        help='Delete the cache before doing anything else')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        metavar='N', help='Parse XML files with N worker processes')
+    parser.add_argument('--pack',
+        metavar='PACKFILE', help='Read sessions from a pack.py store when no XMLFILE is given (--single then takes a session name)')
+    parser.add_argument('-i', '--index',
+        metavar='DBFILE', help='SQLite session index (can be shared with swim sessions)')
+    parser.add_argument('-u', '--index-update', nargs='+',
+        metavar='DIRECTORY', help='Add new and changed XML files from DIRECTORY to --index, drop deleted ones')
+    parser.add_argument('-q', '--query', action='store_true',
+        help='Database-friendly summary of the --index sessions matching the filters below')
+    parser.add_argument('--since', type=datetime.date.fromisoformat,
+        metavar='YYYY-MM-DD', help='Only sessions on or after this date (XML files are picked by name where possible)')
+    parser.add_argument('--until', type=datetime.date.fromisoformat,
+        metavar='YYYY-MM-DD', help='Only sessions on or before this date')
+    parser.add_argument('--year', type=int,
+        metavar='YYYY', help='Only sessions in this year')
+    parser.add_argument('--venue',
+        metavar='NAME', help='Only indexed sessions at this venue')
+    parser.add_argument('--lift',
+        metavar='KIND', help='Only indexed sessions with a lift of this kind')
+    parser.add_argument('--profile', action='store_true',
+        help='Report per-stage timings, files read and peak memory on standard error')
+    parser.add_argument('--profile-json',
+        metavar='JSONFILE', help='Write the --profile report as JSON to JSONFILE instead')
+    parser.add_argument('--profile-dump',
+        metavar='PSTATSFILE', help='Also write cProfile statistics to PSTATSFILE')
+    if argv is None:
+        argv = sys.argv[1:]
+    args = vars(parser.parse_args(argv))
+    if len(argv) == 0:
+        parser.print_usage()
+        sys.exit(2)
+
+    if args['profile'] or args['profile_json'] or args['profile_dump']:
+        profile_start(args['profile_dump'])
+        stage('setup')
+
+    if args['clear_cache']:
+        try:
+            os.remove(args['cache'])
+        except FileNotFoundError:
+            pass
+    if not args['no_cache']:
+        cache = cache_open(args['cache'], args['cache_limit'])
+    jobs = args['jobs']
+
+    since, until = args['since'], args['until']
+    if args['year']:
+        since = max(since or datetime.date.min, datetime.date(args['year'], 1, 1))
+        until = min(until or datetime.date.max, datetime.date(args['year'], 12, 31))
+        args['since'], args['until'] = since, until
+    if args['shards'] and args['landing'] is not None:
+        # a shard is always rendered from all of its sessions
+        if since:
+            since = shard_range(shard_key(since, args['shard_months']),
+                args['shard_months'])[0]
+        if until:
+            until = shard_range(shard_key(until, args['shard_months']),
+                args['shard_months'])[1]
+        args['since'], args['until'] = since, until
+
+    if args['pack']:
+        import pack
+        if args['index']:
+            parser.error('--pack and --index cannot be combined')
+        if args['index_update'] or args['query']:
+            parser.error('--index-update and --query need --index')
+        store = pack.pack_open(args['pack'])
+        store_filters = {'since': since, 'until': until}
+    elif args['index']:
+        index = index_open(args['index'])
+        index_filters = {key: args[key]
+            for key in ['since', 'until', 'venue', 'lift']}
+        if args['index_update']:
+            stage('index')
+            index_update(index, args['index_update'])
+    else:
+        for mode in ['landing', 'summary', 'progress', 'database']:
+            if args[mode] == []:
+                parser.error('--%s without XMLFILE needs --index or --pack' % mode)
+        if args['index_update'] or args['query']:
+            parser.error('--index-update and --query need --index')
+    if args['build'] and len(args['build']) == 1 and not args['pack']:
+        # indexed sessions have no notes to make diary pages from
+        parser.error('--build without XMLFILE needs --pack')
+    if args['build'] and (since or until):
+        # its summaries and page removals are for the whole archive
+        parser.error('--build cannot be combined with --since, --until or --year')
+
+    if args['publish']:
+        if not args['output'] and not args['shards'] and not args['build']:
+            parser.error('--publish needs --output, --shards or --build')
+        publish_start()
+        out = io.StringIO()
+    elif args['output']:
+        out = open(args['output'], 'w')
+    else:
+        out = sys.stdout
+
+    landing_progress = args['landing_progress']
+    progress_reps = args['reps']
+
     title = args['title']
-    if not title:
-        title = 'Swimming'
+    if not title and (args['landing'] is not None or args['build']):
+        title = 'Lifting'
         print('warning: --title not specifed, will use default "%s"' % title,
             file=sys.stderr)
-    landing(args['landing'], args['title'],
-        lambda s: '%s.html' % s['filename'].replace('.xml', ''))
-elif args['summary']:
-    summary(args['summary'])
-elif args['database']:
-    database(args['database'])
-elif args['database_dir']:
-    for directory in args['database_dir']:
-        database(glob.glob(os.path.join(directory, '*.xml')))
-elif args['single']:
-    pictures = {}
-    if args['picture']:
-        pictures = {kind: jpgfile for [jpgfile, kind] in args['picture']}
-    single(args['single'], pictures)
-else:
-    print('must specify --landing, --summary or --single', file=sys.stderr)
-    sys.exit(2)
+
+    if args['build']:
+        build(args['build'][1:] or None, title, args['build'][0])
+    elif args['landing'] is not None:
+        url = lambda s: '%s.html' % s.filename.replace('.xml', '')
+        if args['shards']:
+            shards(prune(args['landing'] or None, since, until), title, url,
+                args['shards'], args['shard_months'], since, until)
+        else:
+            landing(prune(args['landing'] or None, since, until),
+                args['title'], url, out)
+    elif args['summary'] is not None:
+        summary(prune(args['summary'] or None, since, until), out)
+    elif args['progress'] is not None:
+        progress(prune(args['progress'] or None, since, until), out)
+    elif args['database'] is not None:
+        files = prune(args['database'] or None, since, until)
+        if args['columnar']:
+            columnar(files, args['columnar'], args['columnar_format'])
+        else:
+            database(files, out)
+    elif args['database_dir']:
+        if args['columnar']:
+            files = [file for directory in args['database_dir']
+                for file in glob.glob(os.path.join(directory, '*.xml'))]
+            columnar(prune(files, since, until), args['columnar'],
+                args['columnar_format'])
+        else:
+            for directory in args['database_dir']:
+                database(prune(glob.glob(os.path.join(directory, '*.xml')),
+                    since, until), out)
+    elif args['single']:
+        pictures = {}
+        if args['picture']:
+            pictures = {kind: jpgfile for [jpgfile, kind] in args['picture']}
+        single(member(args['single']), pictures, out)
+    elif args['query']:
+        if args['columnar']:
+            columnar(None, args['columnar'], args['columnar_format'])
+        else:
+            database(None, out)
+    elif not args['clear_cache'] and not args['index_update']:
+        print('must specify --landing, --summary or --single', file=sys.stderr)
+        sys.exit(2)
+
+    if publish:
+        if args['output']:
+            publish_file(args['output'], out.getvalue())
+        publish_close()
+    elif out is not sys.stdout:
+        out.close()
+    if cache:
+        stage('cache')
+        cache_close(cache)
+    if profile:
+        profile_report(args['profile_json'] or '-')
+
+# guarded so that worker processes can import this file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import datetime
+import functools
+import re
+
+##############################################################################
+# time of day
+##############################################################################
+
+# the forms notes give the time in: 7pm, 7.30am, 7:30 PM, 7a.m., 19:30, 19.30
+clock_pattern = re.compile(
+    r'(\d{1,2})(?:[:.](\d\d))?\s*(?:([ap])\.?m\.?)?', re.IGNORECASE)
+
+# notes repeat the same few times over and over, so results are memoised;
+# anything else is left to dateutil, imported only then
+@functools.lru_cache(maxsize=1024)
+def clock(text):
+    m = clock_pattern.fullmatch(text.strip())
+    if m is None or (m.group(2) is None and m.group(3) is None):
+        # a bare number is a day of the month to dateutil, not an hour
+        import dateutil.parser
+        return dateutil.parser.parse(text).time()
+    hour = int(m.group(1))
+    minute = int(m.group(2) or 0)
+    if m.group(3) is not None:
+        if not 1 <= hour <= 12:
+            raise ValueError('hour out of range for am/pm: %s' % text)
+        hour = hour % 12 + (12 if m.group(3) in 'pP' else 0)
+    return datetime.time(hour, minute)
+
+##############################################################################
+# session start
+##############################################################################
+
+# notes are taken on Central European time; the transcribers used to append
+# " CEST" for dateutil, which was wrong from October to March (and ignored)
+zone = 'Europe/Madrid'
+
+# DATE at the time of day in TEXT, in ZONE; a time skipped when the clocks
+# go forward becomes the one an hour later
+def start(date, text, zone=zone):
+    import zoneinfo
+    tz = zoneinfo.ZoneInfo(zone)
+    local = datetime.datetime.combine(date, clock(text), tz)
+    return local.astimezone(datetime.timezone.utc).astimezone(tz)
+
+# the wall-clock form session XML keeps in meta/@start
+def wallclock(start):
+    return str(start.replace(tzinfo=None))
@@ -1,29 +1,17 @@
+# argparse and the batch mode modules are imported where they are used to
+# keep the startup of single-note runs fast
 import datetime
-import dateutil.parser
-import packaging.version
+import os
 import sys
+import time
 import xml.etree.ElementTree
 
-if len(sys.argv) != 3:
-    print('usage: %s OPMLFILE YYYYMMDD[-SUFFIX]' % sys.argv[0])
-    sys.exit(2)
+import timeparse
 
-if sys.argv[1] == '-':
-    tree = xml.etree.ElementTree.parse(sys.stdin)
-else:
-    tree = xml.etree.ElementTree.parse(sys.argv[1])
-root = tree.getroot()
+##############################################################################
+# transcription
+##############################################################################
 
-# date supplied on the side otherwise only present in OPML document file name
-date = datetime.datetime.strptime(sys.argv[2].split('-')[0], '%Y%m%d')
-
-# run some basic OPML checks as per OPML 2.0 specification plus require TITLE
-assert root.tag == 'opml'
-assert packaging.version.parse(root.attrib['version']).major == 2
-assert not root.find('head') is None
-assert not root.find('head').find('title') is None
-assert not root.find('body') is None
-title = root.find('head').find('title').text
 def check_outline_tags(x, depth):
     for child in x:
         assert 'outline' == child.tag
@@ -31,73 +19,14 @@ def check_outline_tags(x, depth):
         if child.attrib['text'] == 'volume' and depth == 0: # heuristic
             raise NameError('"volume" outline found, probably a swim session')
         check_outline_tags(child, depth + 1)
-check_outline_tags(root.find('body'), 0)
-
-other = ['time', 'injuries', 'venue', 'warm-up']
 
-# gather outlines following the OPML format (lines one level below labels)
-# preprocess 'squat 70kg' into 'squat -> weight: 70kg'
-outlines = {'other': {}}
 def gather_lines(node):
     lines = []
     for subnode in node:
         assert len(list(subnode)) == 0
         lines.append(subnode.attrib['text'])
     return lines
-for child in root.find('body'):
-    label = child.attrib['text']
-    split = label.rsplit(maxsplit=1)
-    if len(split) == 2:
-        [kind, weight] = split
-        assert kind not in outlines
-        suboutlines = {'weight': [weight]}
-        for grandchild in child:
-            label = grandchild.attrib['text']
-            assert label not in suboutlines
-            suboutlines[label] = gather_lines(grandchild)
-        outlines[kind] = suboutlines
-    else:
-        assert label not in outlines['other']
-        outlines['other'][label] = gather_lines(child)
-
-mandatory = {
-    'lifts': ['weight', 'preparation', 'warm-up', 'next'],
-    'other': ['time', 'injuries', 'warm-up']
-}
-simple = ['time', 'weight']
-
-# prepare output XML tree
-for label in simple:
-    for which in outlines:
-        if label in outlines[which]:
-            if len(outlines[which][label]) > 1:
-                raise NameError('simple outline %s (%s) has %d labels' % \
-                    (label, which, len(outlines[which][label])))
-for label in mandatory['other']:
-    if label not in outlines['other']:
-        raise NameError('missing "%s"' % label)
-for label in mandatory['lifts']:
-    for kind in outlines:
-        if kind != 'other':
-            if label not in outlines[kind]:
-                raise NameError('missing "%s" in %s' % (label, kind))
-b = xml.etree.ElementTree.TreeBuilder()
-b.start('session', {})
-meta = b.start('meta', {'type': 'lift'})
-b.end('meta')
-injuries = b.start('injuries', {})
-b.end('injuries')
-venue = b.start('venue', {})
-b.end('venue')
-warmup = b.start('warmup', {})
-b.end('warmup')
-work = b.start('work', {})
-lifts = b.start('lifting', {})
-b.end('lifting')
-b.end('work')
-b.end('session')
-
-# process outline into the output tree
+
 def insert_el(el, tag):
     return xml.etree.ElementTree.SubElement(el, tag)
 def insert_notes(el, notes):
@@ -115,40 +44,308 @@ def add_or_get_lift(lifts, kind):
     l = insert_el(lifts, 'lift')
     l.set('kind', kind)
     return l
-venue.set('name', title)
-for label, lines in outlines['other'].items():
-    if label == 'time':
-        time = dateutil.parser.parse(lines[0] + ' CEST')
-        meta.set('start', str(datetime.datetime.combine(date, time.time())))
-    elif label == 'injuries':
-        insert_notes(injuries, lines)
-    elif label == 'venue':
-        insert_notes(venue, lines)
-    elif label == 'warm-up':
-        insert_notes(warmup, lines)
-    else:
-        raise NameError('unknown outline "%s"' % label)
-for kind in outlines:
-    if kind == 'other':
-        continue
-    for label, lines in outlines[kind].items():
-        if label == 'weight':
-            add_or_get_lift(lifts, kind).set('weight',
-                str(float(lines[0].rstrip('kg'))))
-        elif label == 'preparation':
-            preparation = insert_el(add_or_get_lift(lifts, kind), 'preparation')
-            insert_notes(preparation, lines)
+
+# date supplied on the side otherwise only present in OPML document file name
+def parse_date(name):
+    return datetime.datetime.strptime(name.split('-')[0], '%Y%m%d')
+
+def transcribe_tree(root, date):
+    # run some basic OPML checks as per OPML 2.0 specification plus require TITLE
+    assert root.tag == 'opml'
+    assert int(root.attrib['version'].split('.')[0]) == 2
+    assert not root.find('head') is None
+    assert not root.find('head').find('title') is None
+    assert not root.find('body') is None
+    title = root.find('head').find('title').text
+    check_outline_tags(root.find('body'), 0)
+
+    other = ['time', 'injuries', 'venue', 'warm-up']
+
+    # gather outlines following the OPML format (lines one level below labels)
+    # preprocess 'squat 70kg' into 'squat -> weight: 70kg'
+    outlines = {'other': {}}
+    for child in root.find('body'):
+        label = child.attrib['text']
+        split = label.rsplit(maxsplit=1)
+        if len(split) == 2:
+            [kind, weight] = split
+            assert kind not in outlines
+            suboutlines = {'weight': [weight]}
+            for grandchild in child:
+                label = grandchild.attrib['text']
+                assert label not in suboutlines
+                suboutlines[label] = gather_lines(grandchild)
+            outlines[kind] = suboutlines
+        else:
+            assert label not in outlines['other']
+            outlines['other'][label] = gather_lines(child)
+
+    mandatory = {
+        'lifts': ['weight', 'preparation', 'warm-up', 'next'],
+        'other': ['time', 'injuries', 'warm-up']
+    }
+    simple = ['time', 'weight']
+
+    # prepare output XML tree
+    for label in simple:
+        for which in outlines:
+            if label in outlines[which]:
+                if len(outlines[which][label]) > 1:
+                    raise NameError('simple outline %s (%s) has %d labels' % \
+                        (label, which, len(outlines[which][label])))
+    for label in mandatory['other']:
+        if label not in outlines['other']:
+            raise NameError('missing "%s"' % label)
+    for label in mandatory['lifts']:
+        for kind in outlines:
+            if kind != 'other':
+                if label not in outlines[kind]:
+                    raise NameError('missing "%s" in %s' % (label, kind))
+    b = xml.etree.ElementTree.TreeBuilder()
+    b.start('session', {})
+    meta = b.start('meta', {'type': 'lift'})
+    b.end('meta')
+    injuries = b.start('injuries', {})
+    b.end('injuries')
+    venue = b.start('venue', {})
+    b.end('venue')
+    warmup = b.start('warmup', {})
+    b.end('warmup')
+    work = b.start('work', {})
+    lifts = b.start('lifting', {})
+    b.end('lifting')
+    b.end('work')
+    b.end('session')
+
+    # process outline into the output tree
+    venue.set('name', title)
+    for label, lines in outlines['other'].items():
+        if label == 'time':
+            meta.set('start', timeparse.wallclock(timeparse.start(date,
+                lines[0])))
+        elif label == 'injuries':
+            insert_notes(injuries, lines)
+        elif label == 'venue':
+            insert_notes(venue, lines)
         elif label == 'warm-up':
-            insert_notes(insert_el(add_or_get_lift(lifts, kind), 'warm-up'), lines)
-        elif label == 'comments':
-            insert_notes(insert_el(add_or_get_lift(lifts, kind), 'comments'), lines)
-        elif label == 'video':
-            insert_notes(insert_el(add_or_get_lift(lifts, kind), 'video'), lines)
-        elif label == 'next':
-            insert_notes(insert_el(add_or_get_lift(lifts, kind), 'next'), lines)
+            insert_notes(warmup, lines)
         else:
-            raise NameError('unknown outline %s' % label)
+            raise NameError('unknown outline "%s"' % label)
+    for kind in outlines:
+        if kind == 'other':
+            continue
+        for label, lines in outlines[kind].items():
+            if label == 'weight':
+                add_or_get_lift(lifts, kind).set('weight',
+                    str(float(lines[0].rstrip('kg'))))
+            elif label == 'preparation':
+                preparation = insert_el(add_or_get_lift(lifts, kind), 'preparation')
+                insert_notes(preparation, lines)
+            elif label == 'warm-up':
+                insert_notes(insert_el(add_or_get_lift(lifts, kind), 'warm-up'), lines)
+            elif label == 'comments':
+                insert_notes(insert_el(add_or_get_lift(lifts, kind), 'comments'), lines)
+            elif label == 'video':
+                insert_notes(insert_el(add_or_get_lift(lifts, kind), 'video'), lines)
+            elif label == 'next':
+                insert_notes(insert_el(add_or_get_lift(lifts, kind), 'next'), lines)
+            else:
+                raise NameError('unknown outline %s' % label)
+
+    return b.close()
+
+def transcribe(opml, date):
+    stage('parse')
+    profile_read([opml])
+    root = xml.etree.ElementTree.parse(opml).getroot()
+    stage('transcribe')
+    return transcribe_tree(root, date)
+
+def to_string(session):
+    return xml.etree.ElementTree.tostring(session,
+        encoding='unicode', xml_declaration=True)
+
+##############################################################################
+# --profile
+##############################################################################
+
+# stage -> [wall s, CPU s, peak bytes, calls]; None unless profiling
+profile = None
+
+def profile_start(dump=None):
+    global profile
+    import tracemalloc
+    tracemalloc.start()
+    profile = {'stages': {}, 'current': None, 'files': 0, 'bytes': 0,
+        'dump': dump, 'profiler': None}
+    if dump:
+        import cProfile
+        profile['profiler'] = cProfile.Profile()
+        profile['profiler'].enable()
+
+# ends the running stage and starts the next one, stage(None) ends the last
+def stage(name):
+    if profile is None:
+        return
+    import tracemalloc
+    now = (time.perf_counter(), time.process_time())
+    if profile['current']:
+        previous, wall, cpu = profile['current']
+        entry = profile['stages'].setdefault(previous, [0.0, 0.0, 0, 0])
+        entry[0] += now[0] - wall
+        entry[1] += now[1] - cpu
+        entry[2] = max(entry[2], tracemalloc.get_traced_memory()[1])
+        entry[3] += 1
+    tracemalloc.reset_peak()
+    profile['current'] = (name, now[0], now[1]) if name else None
+
+def profile_read(files):
+    if profile is None:
+        return
+    for file in files:
+        profile['files'] += 1
+        if isinstance(file, str):
+            profile['bytes'] += os.stat(file).st_size
+
+def profile_report(path):
+    import tracemalloc
+    stage(None)
+    if profile['profiler']:
+        profile['profiler'].disable()
+        profile['profiler'].dump_stats(profile['dump'])
+    tracemalloc.stop()
+    stages = {name: {'wall_ms': round(wall * 1000, 3),
+        'cpu_ms': round(cpu * 1000, 3), 'peak_bytes': peak, 'calls': calls}
+        for name, (wall, cpu, peak, calls) in profile['stages'].items()}
+    report = {'files': profile['files'], 'bytes': profile['bytes'],
+        'peak_bytes': max([s['peak_bytes'] for s in stages.values()] or [0]),
+        'stages': stages}
+    if path != '-':
+        import json
+        with open(path, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        return
+    print('profile: %d files, %d bytes read, peak %.1f MiB traced' % \
+        (report['files'], report['bytes'], report['peak_bytes'] / 2**20),
+        file=sys.stderr)
+    for name, s in stages.items():
+        print('  %-10s %10.1fms wall %10.1fms CPU %8.1f MiB peak' % (name,
+            s['wall_ms'], s['cpu_ms'], s['peak_bytes'] / 2**20), file=sys.stderr)
+
+def profile_args(argv):
+    # --profile works with both usages, so it is taken out before either
+    import argparse
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--profile-json')
+    parser.add_argument('--profile-dump')
+    args, argv = parser.parse_known_args(argv)
+    profile_start(args.profile_dump)
+    stage('setup')
+    return argv, args.profile_json or '-'
+
+##############################################################################
+# --batch
+##############################################################################
+
+# returns an error message instead of raising so one bad note cannot abort
+# the rest of the batch (or a worker pool)
+def transcribe_record(opml):
+    name = os.path.splitext(os.path.basename(opml))[0]
+    try:
+        session = transcribe(opml, parse_date(name))
+    except Exception as e:
+        return name + '.xml', None, '%s: %s: %s' % (opml, type(e).__name__, e)
+    stage('write')
+    return name + '.xml', to_string(session) + '\n', None
+
+def transcribe_file(opml, outdir):
+    name, text, error = transcribe_record(opml)
+    if error:
+        return error
+    with open(os.path.join(outdir, name), 'w') as fh:
+        fh.write(text)
+    return None
+
+# with PACKFILE the sessions are appended to a pack.py store instead, by
+# this process alone while workers only transcribe
+def batch(opmls, outdir, jobs=1, packfile=None):
+    import glob
+    files = []
+    for opml in opmls:
+        if os.path.isdir(opml):
+            files.extend(sorted(glob.glob(os.path.join(opml, '*.opml'))))
+        else:
+            files.append(opml)
+    if packfile:
+        work, args = transcribe_record, [files]
+    else:
+        os.makedirs(outdir, exist_ok=True)
+        work, args = transcribe_file, [files, [outdir] * len(files)]
+    if jobs > 1:
+        import concurrent.futures
+        chunksize = max(1, len(files) // (jobs * 4))
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(work, *args, chunksize=chunksize))
+    else:
+        results = list(map(work, *args))
+    if packfile:
+        import pack
+        store = pack.pack_open(packfile, write=True)
+        for name, text, error in results:
+            if not error:
+                pack.pack_append(store, name, text.encode())
+        pack.pack_close(store)
+        results = [error for name, text, error in results]
+    errors = [error for error in results if error]
+    for error in errors:
+        print('skipped %s' % error, file=sys.stderr)
+    print('transcribed %d of %d files' % (len(files) - len(errors), len(files)),
+        file=sys.stderr)
+    return len(errors) == 0
+
+def batch_main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog=argv[0])
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('-b', '--batch',
+        metavar='OUTDIR', help='Write one XMLFILE per OPMLFILE into OUTDIR, dated by the OPML file name')
+    output.add_argument('--pack',
+        metavar='PACKFILE', help='Append the sessions to a pack.py store instead, replacing those of the same name')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        metavar='N', help='Transcribe with N worker processes')
+    parser.add_argument('opml', nargs='+',
+        metavar='OPMLFILE|DIRECTORY', help='OPML files named YYYYMMDD[-SUFFIX].opml, or directories of them')
+    args = vars(parser.parse_args(argv[1:]))
+    return batch(args['opml'], args['batch'], args['jobs'], args['pack'])
+
+##############################################################################
+# main
+##############################################################################
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    report = None
+    if any(arg.startswith('--profile') for arg in argv):
+        argv, report = profile_args(argv)
+    if len(argv) > 1 and argv[1] in ['-b', '--batch', '--pack']:
+        ok = batch_main(argv)
+    elif len(argv) != 3:
+        print('usage: %s [--profile] OPMLFILE YYYYMMDD[-SUFFIX]' % argv[0])
+        print('       %s [--profile] --batch OUTDIR|--pack PACKFILE [--jobs N] OPMLFILE|DIRECTORY ...' % \
+            argv[0])
+        sys.exit(2)
+    else:
+        opml = sys.stdin if argv[1] == '-' else argv[1]
+        session = transcribe(opml, parse_date(argv[2]))
+        stage('write')
+        print(to_string(session))
+        ok = True
+    if report:
+        profile_report(report)
+    if not ok:
+        sys.exit(1)
 
-# convert intermediate tree into XML tree
-print(xml.etree.ElementTree.tostring(b.close(),
-    encoding='unicode', xml_declaration=True))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import os
+import sys
+import time
+
+import render
+import transcribe
+
+##############################################################################
+# polling
+##############################################################################
+
+notes = '.'
+outdir = '.'
+title = 'Lifting'
+interval = 1.0
+debounce = 2.0
+
+def scan():
+    # name -> (size, mtime_ns) of every OPML note, one scandir per poll
+    stamps = {}
+    for entry in os.scandir(notes):
+        if entry.name.endswith('.opml') and entry.is_file():
+            st = entry.stat()
+            stamps[entry.name[:-len('.opml')]] = (st.st_size, st.st_mtime_ns)
+    return stamps
+
+def changes(old, new):
+    changed = {name for name in new if old.get(name) != new[name]}
+    removed = {name for name in old if name not in new}
+    return changed, removed
+
+##############################################################################
+# output
+##############################################################################
+
+def url(s):
+    return '%s.html' % s.filename.replace('.xml', '')
+
+def pictures(name):
+    found = {}
+    for kind in render.order:
+        picture = '%s-%s.jpg' % (name, kind)
+        if os.path.exists(os.path.join(outdir, picture)):
+            found[kind] = picture
+    return found
+
+# written aside and renamed so that a web server never sends half a page
+def write(name, mode, *args):
+    path = os.path.join(outdir, name)
+    tmp = os.path.join(outdir, '.%s.tmp' % name)
+    with open(tmp, 'w') as fh:
+        mode(*args, out=fh)
+    os.replace(tmp, path)
+
+def remove(name):
+    for ext in ['.xml', '.html']:
+        try:
+            os.remove(os.path.join(outdir, name + ext))
+        except FileNotFoundError:
+            pass
+
+# after a restart, notes older than their diary page need no work
+def fresh(name):
+    try:
+        done = min(os.stat(os.path.join(outdir, name + ext)).st_mtime_ns
+            for ext in ['.xml', '.html'])
+    except FileNotFoundError:
+        return False
+    return done >= os.stat(os.path.join(notes, name + '.opml')).st_mtime_ns
+
+def update(changed, removed):
+    start = time.perf_counter()
+    done = 0
+    failed = 0
+    for name in sorted(removed):
+        remove(name)
+    for name in sorted(changed):
+        if fresh(name):
+            continue
+        error = transcribe.transcribe_file(os.path.join(notes, name + '.opml'),
+            outdir)
+        if error:
+            print('skipped %s' % error, file=sys.stderr)
+            failed += 1
+            continue
+        write(name + '.html', render.single, os.path.join(outdir, name + '.xml'),
+            pictures(name))
+        done += 1
+    files = sorted(os.path.join(outdir, entry.name)
+        for entry in os.scandir(outdir)
+        if entry.name.endswith('.xml') and entry.is_file())
+    write('index.html', render.landing, files, title, url)
+    write('summary.csv', render.summary, files)
+    print('%d transcribed, %d removed, %d skipped, %d sessions in %.1fms' % \
+        (done, len(removed), failed, len(files),
+        (time.perf_counter() - start) * 1000), file=sys.stderr)
+
+def watch(once=False):
+    # the first scan compares against nothing, so everything is built once
+    stamps = {}
+    pending = (set(), set())
+    quiet_since = None
+    while True:
+        new = scan()
+        changed, removed = changes(stamps, new)
+        stamps = new
+        if changed or removed:
+            # a note saved again before it was processed counts once
+            pending = ((pending[0] | changed) - removed,
+                (pending[1] | removed) - changed)
+            quiet_since = time.monotonic()
+        if quiet_since is not None and \
+                (once or time.monotonic() - quiet_since >= debounce):
+            update(*pending)
+            pending = (set(), set())
+            quiet_since = None
+        if once:
+            return
+        time.sleep(interval)
+
+##############################################################################
+# main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('notes',
+        metavar='OPMLDIR', help='Directory of OPML notes named YYYYMMDD[-SUFFIX].opml')
+    parser.add_argument('outdir',
+        metavar='OUTDIR', help='Directory for session XML, diary pages, index.html and summary.csv')
+    parser.add_argument('-t', '--title', default=title,
+        metavar='TITLE', help='HTML title (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=interval,
+        metavar='SECONDS', help='Time between directory scans (default: %(default)s)')
+    parser.add_argument('--debounce', type=float, default=debounce,
+        metavar='SECONDS', help='Wait until notes have been unchanged this long (default: %(default)s)')
+    parser.add_argument('--once', action='store_true',
+        help='Bring OUTDIR up to date and exit')
+    args = vars(parser.parse_args())
+
+    notes = args['notes']
+    outdir = args['outdir']
+    title = args['title']
+    interval = args['interval']
+    debounce = args['debounce']
+    os.makedirs(outdir, exist_ok=True)
+    # keep parsed sessions in memory so an edit only reparses itself
+    render.cache = render.cache_open(None, sys.maxsize)
+    render.cache['entries'] = {}
+
+    try:
+        watch(args['once'])
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,207 @@
+import argparse
+import glob
+import io
+import mmap
+import os
+import struct
+import sys
+
+##############################################################################
+# packed session store
+##############################################################################
+
+# PACKFILE is the magic followed by records of (body length, name length,
+# name, body), only ever appended to. A later record for a name replaces
+# the earlier one and an empty body deletes it. PACKFILE.idx holds the
+# offset of every record so opening needs no scan; if it falls behind
+# (say after a crash) the missing records are found from its last entry.
+magic = b'EXLOGPK1'
+header = struct.Struct('<IH')
+offset = struct.Struct('<Q')
+
+def pack_open(path, write=False):
+    if write and not os.path.exists(path):
+        with open(path, 'wb') as fh:
+            fh.write(magic)
+        with open(path + '.idx', 'wb'):
+            pass
+    pack = {'path': path, 'names': {}, 'offsets': [], 'mm': None, 'fh': None,
+        'idx': None, 'size': 0}
+    with open(path, 'rb') as fh:
+        if fh.read(len(magic)) != magic:
+            raise NameError('not a session pack: %s' % path)
+        pack['size'] = os.fstat(fh.fileno()).st_size
+        if pack['size'] > len(magic):
+            pack['mm'] = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        with open(path + '.idx', 'rb') as fh:
+            data = fh.read()
+        pack['offsets'] = [o for (o,) in offset.iter_unpack(
+            data[:len(data) - len(data) % offset.size])]
+    except FileNotFoundError:
+        pass
+    indexed = len(pack['offsets'])
+    # trust the index only as far as its records are complete
+    while pack['offsets'] and \
+            pack_end(pack, pack['offsets'][-1]) > pack['size']:
+        pack['offsets'].pop()
+    at = len(magic)
+    for o in pack['offsets']:
+        at = pack_record(pack, o)
+    while pack_end(pack, at) <= pack['size']:
+        pack['offsets'].append(at)
+        at = pack_record(pack, at)
+    if write:
+        pack['fh'] = open(path, 'ab')
+        if at != pack['size']:
+            # a torn last record, cut it off before appending after it
+            pack['fh'].truncate(at)
+            pack['size'] = at
+        pack['idx'] = open(path + '.idx', 'ab')
+        if len(pack['offsets']) != indexed:
+            pack['idx'].truncate(0)
+            pack['idx'].write(b''.join(offset.pack(o) for o in pack['offsets']))
+    return pack
+
+def pack_end(pack, at):
+    if at + header.size > pack['size']:
+        return pack['size'] + 1
+    length, name_length = header.unpack_from(pack['mm'], at)
+    return at + header.size + name_length + length
+
+# adds or removes the name of the record at AT, returns where it ends
+def pack_record(pack, at):
+    length, name_length = header.unpack_from(pack['mm'], at)
+    start = at + header.size
+    name = pack['mm'][start:start + name_length].decode()
+    if length:
+        pack['names'][name] = at
+    else:
+        pack['names'].pop(name, None)
+    return start + name_length + length
+
+def pack_names(pack):
+    return sorted(pack['names'])
+
+def pack_read(pack, name):
+    at = pack['names'][name]
+    if pack['mm'] is None or at >= len(pack['mm']):
+        # appended since the file was mapped
+        pack['fh'].flush()
+        with open(pack['path'], 'rb') as fh:
+            fh.seek(at)
+            length, name_length = header.unpack(fh.read(header.size))
+            fh.seek(name_length, os.SEEK_CUR)
+            return fh.read(length)
+    length, name_length = header.unpack_from(pack['mm'], at)
+    start = at + header.size + name_length
+    return pack['mm'][start:start + length]
+
+# a file-like session for render.parse(), named like the XML file it was
+def pack_member(pack, name):
+    member = io.BytesIO(pack_read(pack, name))
+    member.name = name
+    return member
+
+def pack_append(pack, name, body):
+    encoded = name.encode()
+    at = pack['size']
+    pack['fh'].write(header.pack(len(body), len(encoded)) + encoded + body)
+    pack['idx'].write(offset.pack(at))
+    pack['size'] += header.size + len(encoded) + len(body)
+    pack['offsets'].append(at)
+    if body:
+        pack['names'][name] = at
+    else:
+        pack['names'].pop(name, None)
+
+def pack_delete(pack, name):
+    if name in pack['names']:
+        pack_append(pack, name, b'')
+
+def pack_close(pack):
+    for key in ['fh', 'idx', 'mm']:
+        if pack[key] is not None:
+            pack[key].close()
+
+##############################################################################
+# import, export
+##############################################################################
+
+def pack_import(pack, files):
+    for file in files:
+        with open(file, 'rb') as fh:
+            pack_append(pack, os.path.basename(file), fh.read())
+
+def pack_export(pack, outdir, names):
+    os.makedirs(outdir, exist_ok=True)
+    for name in names:
+        with open(os.path.join(outdir, name), 'wb') as fh:
+            fh.write(pack_read(pack, name))
+
+# drop replaced and deleted records by rewriting the live ones
+def pack_compact(path):
+    pack = pack_open(path)
+    tmp = path + '.tmp'
+    for name in [tmp, tmp + '.idx']:
+        if os.path.exists(name):
+            os.remove(name)
+    compact = pack_open(tmp, write=True)
+    for name in pack_names(pack):
+        pack_append(compact, name, pack_read(pack, name))
+    pack_close(compact)
+    pack_close(pack)
+    os.replace(tmp + '.idx', path + '.idx')
+    os.replace(tmp, path)
+
+##############################################################################
+# main
+##############################################################################
+
+def xml_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.xml'))))
+        else:
+            files.append(path)
+    return files
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pack',
+        metavar='PACKFILE', help='Session pack (with its PACKFILE.idx offset index)')
+    parser.add_argument('-i', '--import', dest='add', nargs='+',
+        metavar='XMLFILE|DIRECTORY', help='Append session XML files, replacing sessions of the same name')
+    parser.add_argument('-x', '--export',
+        metavar='OUTDIR', help='Write every session (or those named) back out as XML files')
+    parser.add_argument('-r', '--remove', nargs='+',
+        metavar='NAME', help='Delete sessions')
+    parser.add_argument('-l', '--list', action='store_true',
+        help='List session names')
+    parser.add_argument('--compact', action='store_true',
+        help='Rewrite PACKFILE without replaced and deleted records')
+    parser.add_argument('names', nargs='*',
+        metavar='NAME', help='Sessions to --export, as YYYYMMDD[-SUFFIX].xml')
+    args = vars(parser.parse_args())
+
+    write = bool(args['add'] or args['remove'])
+    if not write and not os.path.exists(args['pack']):
+        parser.error('no such pack: %s' % args['pack'])
+    pack = pack_open(args['pack'], write)
+    if args['add']:
+        pack_import(pack, xml_files(args['add']))
+    for name in args['remove'] or []:
+        pack_delete(pack, name)
+    if args['export']:
+        pack_export(pack, args['export'], args['names'] or pack_names(pack))
+    if args['list']:
+        for name in pack_names(pack):
+            print(name)
+    pack_close(pack)
+    if args['compact']:
+        pack_compact(args['pack'])
+        pack = pack_open(args['pack'])
+        pack_close(pack)
+    print('%s: %d sessions in %d records, %d bytes' % (args['pack'],
+        len(pack['names']), len(pack['offsets']), pack['size']), file=sys.stderr)
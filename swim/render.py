@@ -1,27 +1,176 @@
+# modules only some modes need (csv, html, pickle, sqlite3, unidecode, ...)
+# are imported inside the functions using them to keep startup fast
 import argparse
-import csv
 import datetime
 import glob
-import html
+import io
 import os
 import sys
-import unidecode
+import time
 import xml.etree.ElementTree
 
 ##############################################################################
 # helpers
 ##############################################################################
 
+# strftime() is slow enough to show up on long landing pages, so the few
+# fields needed are formatted directly (Python leaves LC_TIME as "C")
+weekdays = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+
 def time_ampm(t):
     if t.minute > 0:
-        minutes = '.' + t.strftime('%M')
+        minutes = '.%02d' % t.minute
     else:
         minutes = ''
-    return '%s%s%s' % (t.strftime('%-I'), minutes, t.strftime('%p').lower())
+    return '%d%s%s' % (t.hour % 12 or 12, minutes, 'am' if t.hour < 12 else 'pm')
+
+# could support multi-stroke sessions, etc
+def session_stroke(s):
+    strokes = [workset.stroke for workset in s.sets if workset.stroke is not None]
+    if len(set(strokes)) == 1:
+        if strokes[0] in ['fly', 'back', 'breast', 'free']:
+            return strokes[0]
+        elif strokes[0].startswith('IM'):
+            return 'IM'
+    return 'other'
 
 def capitalise(s):
     return s[0].upper() + s[1:]
 
+def filename(file):
+    # parse() also accepts open files, e.g. sys.stdin
+    if not isinstance(file, str):
+        file = getattr(file, 'name', '')
+    return os.path.basename(file)
+
+def to_string(mode, *args):
+    out = io.StringIO()
+    mode(*args, out=out)
+    return out.getvalue()
+
+##############################################################################
+# --profile
+##############################################################################
+
+# stage -> [wall s, CPU s, peak bytes, calls]; None unless profiling
+profile = None
+
+def profile_start(dump=None):
+    global profile
+    import tracemalloc
+    tracemalloc.start()
+    profile = {'stages': {}, 'current': None, 'files': 0, 'bytes': 0,
+        'dump': dump, 'profiler': None}
+    if dump:
+        import cProfile
+        profile['profiler'] = cProfile.Profile()
+        profile['profiler'].enable()
+
+# ends the running stage and starts the next one, stage(None) ends the last
+def stage(name):
+    if profile is None:
+        return
+    import tracemalloc
+    now = (time.perf_counter(), time.process_time())
+    if profile['current']:
+        previous, wall, cpu = profile['current']
+        entry = profile['stages'].setdefault(previous, [0.0, 0.0, 0, 0])
+        entry[0] += now[0] - wall
+        entry[1] += now[1] - cpu
+        entry[2] = max(entry[2], tracemalloc.get_traced_memory()[1])
+        entry[3] += 1
+    tracemalloc.reset_peak()
+    profile['current'] = (name, now[0], now[1]) if name else None
+
+def profile_read(files):
+    # bytes are only counted for files actually parsed, not cache hits
+    if profile is None:
+        return
+    for file in files:
+        profile['files'] += 1
+        if isinstance(file, str):
+            profile['bytes'] += os.stat(file).st_size
+        elif isinstance(file, io.BytesIO):
+            profile['bytes'] += len(file.getbuffer())
+
+def profile_report(path):
+    import tracemalloc
+    stage(None)
+    if profile['profiler']:
+        profile['profiler'].disable()
+        profile['profiler'].dump_stats(profile['dump'])
+    tracemalloc.stop()
+    stages = {name: {'wall_ms': round(wall * 1000, 3),
+        'cpu_ms': round(cpu * 1000, 3), 'peak_bytes': peak, 'calls': calls}
+        for name, (wall, cpu, peak, calls) in profile['stages'].items()}
+    report = {'files': profile['files'], 'bytes': profile['bytes'],
+        'peak_bytes': max([s['peak_bytes'] for s in stages.values()] or [0]),
+        'stages': stages}
+    if path != '-':
+        import json
+        with open(path, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        return
+    print('profile: %d files, %d bytes read, peak %.1f MiB traced' % \
+        (report['files'], report['bytes'], report['peak_bytes'] / 2**20),
+        file=sys.stderr)
+    for name, s in stages.items():
+        print('  %-10s %10.1fms wall %10.1fms CPU %8.1f MiB peak' % (name,
+            s['wall_ms'], s['cpu_ms'], s['peak_bytes'] / 2**20), file=sys.stderr)
+
+##############################################################################
+# session model
+##############################################################################
+
+# __slots__ keep a multi-year archive compact in memory; fields missing from
+# the XML (or skipped by parse_projected) are None
+class Session:
+    __slots__ = ['start', 'kind', 'volume', 'injuries', 'venue', 'warmup',
+        'cooldown', 'sets', 'filename']
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+class Venue:
+    __slots__ = ['name', 'notes', 'spacious']
+
+    def __init__(self, name, notes=None, spacious=False):
+        self.name = sys.intern(name)
+        self.notes = notes
+        self.spacious = spacious
+
+class SwimSet:
+    __slots__ = ['stroke', 'preparation', 'structure', 'summary', 'comments',
+        'times', 'next', 'video']
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+        if self.stroke is not None:
+            self.stroke = sys.intern(self.stroke)
+
+# venues without notes are shared between all sessions held there
+venues = {}
+
+def intern_venue(name, notes=None, spacious=False):
+    if notes:
+        return Venue(name, notes, spacious)
+    if (name, spacious) not in venues:
+        venues[(name, spacious)] = Venue(name, None, spacious)
+    return venues[(name, spacious)]
+
+# venue name -> short ASCII name, as used for icon files and in --database
+venue_slugs = {}
+
+def venue_slug(name):
+    slug = venue_slugs.get(name)
+    if slug is None:
+        import unidecode
+        slug = unidecode.unidecode(name).lower().replace(' ', '')
+        venue_slugs[name] = slug
+    return slug
+
 ##############################################################################
 # parsing
 ##############################################################################
@@ -39,8 +188,10 @@ def parse_meta(el):
     assert 'start' in el.attrib
     assert 'type' in el.attrib
     assert el.attrib['type'] == 'swim'
-    start = datetime.datetime.strptime(el.attrib['start'], '%Y-%m-%d %H:%M:%S')
-    kind = el.attrib['kind']
+    # written by transcribe.py as YYYY-MM-DD HH:MM:SS, which fromisoformat()
+    # reads many times faster than strptime()
+    start = datetime.datetime.fromisoformat(el.attrib['start'])
+    kind = sys.intern(el.attrib['kind'])
     if 'volume' in el.attrib:
         volume = int(el.attrib['volume'])
     else:
@@ -52,43 +203,35 @@ def parse_injuries(el):
 
 def parse_venue(el):
     assert 'name' in el.attrib
-    venue = {'name': el.attrib['name']}
-    notes = parse_notes(el)
-    if notes:
-        venue['notes'] = notes
-    if 'spacious' in el.attrib:
-        venue['spacious'] = bool(el.attrib['spacious'])
-    return venue
+    spacious = bool(el.attrib['spacious']) if 'spacious' in el.attrib else False
+    return intern_venue(el.attrib['name'], parse_notes(el), spacious)
 
 def parse_warmup(el):
     return parse_notes(el)
 
 def parse_set(el):
-    s = {}
-    if 'stroke' in el.attrib:
-        s['stroke'] = el.attrib['stroke']
+    s = SwimSet(stroke=el.attrib.get('stroke'))
     for child in el:
         if child.tag == 'preparation':
-            s['preparation'] = parse_notes(child)
+            s.preparation = parse_notes(child)
         elif child.tag == 'structure':
-            s['structure'] = parse_notes(child)
+            s.structure = parse_notes(child)
         elif child.tag == 'summary':
-            s['summary'] = parse_notes(child)
+            s.summary = parse_notes(child)
         elif child.tag == 'comments':
-            s['comments'] = parse_notes(child)
+            s.comments = parse_notes(child)
         elif child.tag == 'times':
-            s['times'] = parse_notes(child)
+            s.times = parse_notes(child)
         elif child.tag == 'next':
-            s['next'] = parse_notes(child)
+            s.next = parse_notes(child)
         elif child.tag == 'video':
-            s['video'] = parse_notes(child)
+            s.video = parse_notes(child)
         else:
             raise NameError('unknown tag "%s"' % child.tag)
     mandatory = ['preparation', 'summary', 'next']
     for tag in mandatory:
-        assert tag in s
-        assert not s[tag] is None
-        assert len(s[tag]) > 0
+        assert not getattr(s, tag) is None
+        assert len(getattr(s, tag)) > 0
     return s
 
 def parse_work(el):
@@ -103,7 +246,7 @@ def parse_cooldown(el):
     return parse_notes(el)
 
 def parse(file):
-    session = {}
+    session = Session()
     try:
         tree = xml.etree.ElementTree.parse(file)
     except Exception as e:
@@ -113,40 +256,414 @@ def parse(file):
     assert root.tag == 'session'
     for child in root:
         if child.tag == 'meta':
-            session['start'], session['kind'], session['volume'] = \
-                parse_meta(child)
+            session.start, session.kind, session.volume = parse_meta(child)
         elif child.tag == 'injuries':
-            session['injuries'] = parse_injuries(child)
+            session.injuries = parse_injuries(child)
         elif child.tag == 'venue':
-            session['venue'] = parse_venue(child)
+            session.venue = parse_venue(child)
         elif child.tag == 'warmup':
-            session['warmup'] = parse_warmup(child)
+            session.warmup = parse_warmup(child)
         elif child.tag == 'cooldown':
-            session['cooldown'] = parse_cooldown(child)
+            session.cooldown = parse_cooldown(child)
         elif child.tag == 'work':
-            session['sets'] = parse_work(child)
+            session.sets = parse_work(child)
         else:
             raise NameError('unknown tag "%s"' % child.tag)
     mandatory = ['start', 'kind', 'venue', 'sets']
     for tag in mandatory:
-        assert tag in session
-    session['filename'] = os.path.basename(file)
+        assert not getattr(session, tag) is None
+    session.filename = filename(file)
     return session
 
 ##############################################################################
-# --landing
+# projected parsing
+##############################################################################
+
+# summary modes pass the session fields they read; the file is streamed,
+# notes are never collected and parsing stops once every field is known
+def parse_projected(file, fields):
+    session = Session()
+    wanted = set(fields)
+    found = set()
+    depth = 0
+    try:
+        for event, el in xml.etree.ElementTree.iterparse(file, ('start', 'end')):
+            if event == 'start':
+                if depth == 0:
+                    assert el.tag == 'session'
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if el.tag == 'meta' and wanted & {'start', 'kind', 'volume'}:
+                session.start, session.kind, session.volume = parse_meta(el)
+                found |= {'start', 'kind', 'volume'}
+            elif el.tag == 'venue' and 'venue' in wanted:
+                assert 'name' in el.attrib
+                spacious = 'spacious' in el.attrib and bool(el.attrib['spacious'])
+                session.venue = intern_venue(el.attrib['name'], None, spacious)
+                found.add('venue')
+            elif el.tag == 'work' and 'sets' in wanted:
+                assert len(el) == 1
+                session.sets = []
+                for child in next(iter(el)):
+                    assert child.tag == 'set'
+                    s = SwimSet(summary=child.findtext('summary'),
+                        stroke=child.attrib.get('stroke'))
+                    assert s.summary
+                    session.sets.append(s)
+                found.add('sets')
+            el.clear()
+            if wanted <= found:
+                break
+    except Exception as e:
+        print('in file:', file)
+        raise e
+    for field in wanted:
+        assert field in found
+    session.filename = filename(file)
+    return session
+
+def parse_fields(file, fields):
+    if fields is None:
+        return parse(file)
+    return parse_projected(file, fields)
+
+##############################################################################
+# parsed-session cache
 ##############################################################################
 
-def landing(files, title, url_generator):
+# bump whenever the shape of parse() output changes to drop stale entries
+cache_version = 3
+cache = None
+
+def cache_default_path():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'exercise-log', 'swim-sessions.pickle')
+
+def cache_open(path, limit):
+    # entries are loaded on first use so that --single never pays for them
+    return {'path': path, 'limit': limit, 'entries': None,
+        'hits': 0, 'misses': 0, 'dirty': False,
+        'rollups': None, 'rollups_dirty': False}
+
+def cache_load(cache):
+    import pickle
+    cache['entries'] = {}
+    try:
+        with open(cache['path'], 'rb') as fh:
+            version, entries = pickle.load(fh)
+        if version == cache_version:
+            cache['entries'] = entries
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print('warning: ignoring unreadable cache %s: %s' % (cache['path'], e),
+            file=sys.stderr)
+
+# entries remember the projection they were parsed with, None meaning all
+def cache_get(cache, file, fields):
+    st = os.stat(file)
+    key = os.path.abspath(file)
+    entry = cache['entries'].pop(key, None)
+    if entry and entry[0] == (st.st_size, st.st_mtime_ns) and \
+            (entry[1] is None or (fields is not None and fields <= entry[1])):
+        cache['hits'] += 1
+        # re-insert so that dict order doubles as least-recently-used order
+        cache['entries'][key] = entry
+        return entry[2]
+    cache['misses'] += 1
+    return None
+
+def cache_put(cache, file, fields, session):
+    st = os.stat(file)
+    cache['entries'][os.path.abspath(file)] = \
+        ((st.st_size, st.st_mtime_ns), fields, session)
+    cache['dirty'] = True
+
+# pickled to a temporary file of its own and renamed, so that concurrent
+# runs never see or replace half a cache; failing to write only means the
+# next run parses again
+def cache_write(path, data):
+    import pickle
+    import tempfile
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+            prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        print('warning: not writing cache %s: %s' % (path, e), file=sys.stderr)
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+def cache_close(cache):
+    if cache['rollups_dirty']:
+        cache_write(rollups_path(cache['path']),
+            (rollups_version, cache['rollups']))
+    if cache['entries'] is None:
+        return
+    entries = cache['entries']
+    while len(entries) > cache['limit']:
+        del entries[next(iter(entries))]
+        cache['dirty'] = True
+    if cache['dirty']:
+        cache_write(cache['path'], (cache_version, entries))
+    print('cache: %d hits, %d misses' % (cache['hits'], cache['misses']),
+        file=sys.stderr)
+
+def parse_all(files, fields=None):
+    if files is None:
+        # no XML files named on the command line, use --pack or --index
+        if store is not None:
+            return store_sessions(store, fields, **store_filters)
+        return index_sessions(index, **index_filters)
+    if fields is not None:
+        fields = frozenset(fields)
+    if cache is None:
+        return parse_many(files, fields)
+    if cache['entries'] is None:
+        cache_load(cache)
+    sessions = [cache_get(cache, file, fields) for file in files]
+    missing = [i for i, session in enumerate(sessions) if session is None]
+    parsed = parse_many([files[i] for i in missing], fields)
+    for i, session in zip(missing, parsed):
+        cache_put(cache, files[i], fields, session)
+        sessions[i] = session
+    return sessions
+
+##############################################################################
+# parallel parsing
+##############################################################################
+
+jobs = 1
+
+def parse_chunk(files, fields):
     sessions = []
     for file in files:
-        sessions.append(parse(file))
-    sessions = sorted(sessions, key=lambda s: s['start'])
-    year = ''
+        try:
+            sessions.append(parse_fields(file, fields))
+        except Exception as e:
+            # the traceback of a worker process does not show its arguments
+            raise RuntimeError('in file: %s' % file) from e
+    return sessions
+
+def parse_many(files, fields):
+    profile_read(files)
+    if jobs <= 1 or len(files) < 2:
+        return [parse_fields(file, fields) for file in files]
+    import concurrent.futures
+    # a few chunks per worker keeps them busy without one IPC trip per file
+    size = max(1, len(files) // (jobs * 4))
+    chunks = [files[i:i + size] for i in range(0, len(files), size)]
+    sessions = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        for chunk in pool.map(parse_chunk, chunks, [fields] * len(chunks)):
+            sessions.extend(chunk)
+    return sessions
+
+##############################################################################
+# SQLite index
+##############################################################################
+
+# same schema as lift/render.py so both archives can share one database file
+index_schema = '''
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS venues (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    start TEXT NOT NULL,
+    kind TEXT,
+    volume INTEGER,
+    venue_id INTEGER NOT NULL REFERENCES venues(id),
+    spacious INTEGER);
+CREATE INDEX IF NOT EXISTS sessions_type_start ON sessions(type, start);
+CREATE TABLE IF NOT EXISTS sets (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    stroke TEXT,
+    summary TEXT);
+CREATE INDEX IF NOT EXISTS sets_session ON sets(session_id);
+CREATE INDEX IF NOT EXISTS sets_stroke ON sets(stroke);
+CREATE TABLE IF NOT EXISTS lifts (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    weight REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS lifts_session ON lifts(session_id);
+CREATE INDEX IF NOT EXISTS lifts_kind ON lifts(kind);
+CREATE TABLE IF NOT EXISTS notes (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    item INTEGER, -- position of the set or lift, NULL for the whole session
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT);
+CREATE INDEX IF NOT EXISTS notes_session ON notes(session_id);
+'''
+
+index = None
+index_filters = {}
+
+def index_open(path):
+    import sqlite3
+    db = sqlite3.connect(path)
+    db.executescript(index_schema)
+    return db
+
+def index_notes(db, session_id, item, field, notes):
+    if notes is None:
+        return
+    if type(notes) != list:
+        notes = [notes]
+    db.executemany('INSERT INTO notes VALUES (?, ?, ?, ?, ?)',
+        [(session_id, item, field, pos, note) for pos, note in enumerate(notes)])
+
+def index_session(db, path, stamp, session):
+    db.execute('DELETE FROM sessions WHERE path = ?', (path,))
+    db.execute('INSERT OR IGNORE INTO venues (name) VALUES (?)',
+        (session.venue.name,))
+    venue_id = db.execute('SELECT id FROM venues WHERE name = ?',
+        (session.venue.name,)).fetchone()[0]
+    session_id = db.execute('INSERT INTO sessions (path, size, mtime_ns, '
+        'type, start, kind, volume, venue_id, spacious) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (path, stamp[0], stamp[1], 'swim', str(session.start),
+        session.kind, session.volume, venue_id,
+        session.venue.spacious)).lastrowid
+    index_notes(db, session_id, None, 'venue', session.venue.notes)
+    for field in ['injuries', 'warmup', 'cooldown']:
+        index_notes(db, session_id, None, field, getattr(session, field))
+    for pos, s in enumerate(session.sets):
+        db.execute('INSERT INTO sets VALUES (?, ?, ?, ?)',
+            (session_id, pos, s.stroke, s.summary))
+        for field in ['preparation', 'structure', 'comments', 'times',
+                'next', 'video']:
+            index_notes(db, session_id, pos, field, getattr(s, field))
+
+def index_update(db, directories):
+    known = {path: (size, mtime_ns) for path, size, mtime_ns in db.execute(
+        'SELECT path, size, mtime_ns FROM sessions WHERE type = ?', ('swim',))}
+    seen = set()
+    changed = []
+    for directory in directories:
+        for file in glob.glob(os.path.join(directory, '*.xml')):
+            path = os.path.abspath(file)
+            st = os.stat(path)
+            seen.add(path)
+            if known.get(path) != (st.st_size, st.st_mtime_ns):
+                changed.append((path, (st.st_size, st.st_mtime_ns)))
+    parsed = parse_many([path for path, stamp in changed], None)
+    for (path, stamp), session in zip(changed, parsed):
+        index_session(db, path, stamp, session)
+    # only forget sessions from the directories that were scanned
+    scanned = {os.path.abspath(directory) for directory in directories}
+    removed = [path for path in known
+        if path not in seen and os.path.dirname(path) in scanned]
+    db.executemany('DELETE FROM sessions WHERE path = ?',
+        [(path,) for path in removed])
+    db.commit()
+    print('index: %d updated, %d removed' % (len(changed), len(removed)),
+        file=sys.stderr)
+
+def index_sessions(db, since=None, until=None, venue=None, stroke=None):
+    where = ['s.type = ?']
+    params = ['swim']
+    if since:
+        where.append('s.start >= ?')
+        params.append(str(since))
+    # before the next day keeps to the (type, start) index; there is no
+    # day after date.max, and nothing to leave out either
+    if until and until < datetime.date.max:
+        where.append('s.start < ?')
+        params.append(str(until + datetime.timedelta(days=1)))
+    if venue:
+        where.append('v.name = ?')
+        params.append(venue)
+    if stroke:
+        where.append('s.id IN (SELECT session_id FROM sets WHERE stroke = ?)')
+        params.append(stroke)
+    where = ' AND '.join(where)
+    sessions = {}
+    for row in db.execute('SELECT s.id, s.path, s.start, s.kind, s.volume, '
+            'v.name, s.spacious FROM sessions s '
+            'JOIN venues v ON v.id = s.venue_id WHERE ' + where, params):
+        session_id, path, start, kind, volume, name, spacious = row
+        sessions[session_id] = Session(
+            start=datetime.datetime.fromisoformat(start),
+            kind=sys.intern(kind),
+            volume=volume,
+            venue=intern_venue(name, None, bool(spacious)),
+            sets=[],
+            filename=os.path.basename(path))
+    for session_id, stroke, summary in db.execute('SELECT t.session_id, '
+            't.stroke, t.summary FROM sets t '
+            'JOIN sessions s ON s.id = t.session_id '
+            'JOIN venues v ON v.id = s.venue_id WHERE ' + where +
+            ' ORDER BY t.session_id, t.position', params):
+        sessions[session_id].sets.append(SwimSet(summary=summary, stroke=stroke))
+    return list(sessions.values())
+
+##############################################################################
+# packed store
+##############################################################################
+
+# --pack: sessions are read from a pack.py store rather than XML files,
+# straight out of its memory map without a syscall per session
+store = None
+store_filters = {}
+
+def store_sessions(store, fields, since=None, until=None):
+    import pack
+    since = since or datetime.date.min
+    until = until or datetime.date.max
+    if fields is not None:
+        fields = frozenset(fields) | {'start'}
+    sessions = []
+    for name in pack.pack_names(store):
+        date = file_date(name)
+        if date is not None and not since <= date <= until:
+            continue
+        member = pack.pack_member(store, name)
+        profile_read([member])
+        session = parse_fields(member, fields)
+        if date is None and not since <= session.start.date() <= until:
+            continue
+        sessions.append(session)
+    return sessions
 
-    print('<html><head><title>%s</title>' % title)
-    print('<link rel="icon" type="image/x-icon" href="favicon.ico">')
-    print('''<style> /* Top-Right-Bottom-Left */
+# --single names a session in the --pack store, with or without .xml
+def member(file):
+    import pack
+    if store is None:
+        return file
+    name = os.path.basename(file)
+    if not name.endswith('.xml'):
+        name += '.xml'
+    return pack.pack_member(store, name)
+
+##############################################################################
+# output
+##############################################################################
+
+# pages are collected as a list of strings filled in from the templates
+# below and written out with one write() instead of a print() per line
+def write_page(page, out):
+    out.write(''.join(page))
+
+landing_head = '''<html><head><title>%s</title>
+<link rel="icon" type="image/x-icon" href="favicon.ico">%s
+<style> /* Top-Right-Bottom-Left */
       TD.link:hover    { cursor: pointer; }
       HTML             { font-family: Helvetica; padding: 20pt 0pt 0pt 20pt; }
       TD               { font-size: 7pt; }
@@ -180,37 +697,180 @@ def landing(files, title, url_generator):
       .im200           { background: #4B4B4B; }
       .distance        { background: $929292; }
       .other           { background: black; }
-    </style>''')
-    venue_dimensions = 'width="18" height="18"'
-    print('</head><body>')
+      .steady          { background: #88FA4E; }
+      .spike           { background: #FE774A; }
+    </style>
+</head><body>
+'''
+landing_month = '<h1>%s%s</h1>\n<table><tbody>\n'
+landing_month_end = '</tbody></table>\n'
+# day, weekday, spacious, time, venue icon, url, stroke colour, url, stroke
+# prefix, kind, summary, volume
+landing_row = '<tr> ' \
+    '<td class="col1">%d</td> ' \
+    '<td class="col2">%s</td> ' \
+    '<td class="col3%s">%s</td> ' \
+    '<td class="col4">%s</td> ' \
+    '<td onclick="window.location=\'%s\';" class="col5 link %s"><a href="%s">%s%s</a></td> ' \
+    '<td class="col6">%s</td> ' \
+    '<td class="col7">%dm</td> ' \
+    '</tr>\n'
+# venue slug, venue, venue; an image per venue or a class of the sprites.py
+# sheet, whose stylesheet is then linked from the head; venues missing from
+# the sheet keep their image
+landing_icon = '<img width="18" height="18" src="%s.png" alt="%s" title="%s">'
+landing_sprite = '<span class="venue %s" role="img" aria-label="%s" title="%s"></span>'
+landing_sprites = '\n<link rel="stylesheet" href="venues.css">'
+landing_foot = '<p><a href="..">../</a></p>\n</body></html>\n'
+# --landing-load section
+load_head = '<h1>Training load</h1>\n<table><tbody>\n'
+# week ending, acute load, chronic load, ratio colour, ratio
+load_row = '<tr> ' \
+    '<td class="col3">%s</td> ' \
+    '<td class="col7">%dm</td> ' \
+    '<td class="col7">%dm</td> ' \
+    '<td class="col4%s">%s</td> ' \
+    '</tr>\n'
+load_end = '</tbody></table>\n'
+shards_row = '<p><a href="%s.html">%s</a>, %d sessions</p>\n'
+shard_foot = '<p><a href="index.html">%s</a></p>\n</body></html>\n'
 
-    block = None
-    for s in sessions:
-        year_suffix = ' %d' % s['start'].year if year != s['start'].year else ''
-        month = s['start'].strftime('%B')
-        year = s['start'].year
-        if block != month:
-            if block:
-                print('</tbody></table>')
-            print('<h1>%s%s</h1>' % (month, year_suffix))
-            print('<table><tbody>')
-            block = month
+single_head = '''<html><head><meta charset="utf-8">
+<link rel="icon" type="image/x-icon" href="favicon.ico">
+<title>%s</title></head><body><main>
+<header><h2>%s</h2>
+<p>%s, %s, %s%s, %dm</p></header>
+'''
+single_ul = '<section>%s<ul>\n%s</ul></section>\n'
+single_li = '<li>%s</li>\n'
+single_p = '<section><p>%s%s</p></section>\n'
+single_h3 = '<h3>%s</h3>\n'
+single_picture = '<section><p><img width="480" src="%s" alt="%s"></p><section>\n'
+# mobile Safari reader mode seems to require the 'main' semantic HTML tag
+single_foot = '</main></body></html>\n'
+
+##############################################################################
+# --publish
+##############################################################################
+
+# for static hosting every page written gets .gz (and, with the brotli
+# module, .br) siblings and its SHA-256 in a manifest.json next to it;
+# pages whose content did not change are left alone, mtimes and all
+publish = None
 
-        spacious = False
+def publish_start():
+    global publish
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    publish = {'manifests': {}, 'brotli': brotli, 'written': 0, 'unchanged': 0}
+
+def publish_manifest(directory):
+    import json
+    if directory not in publish['manifests']:
+        try:
+            with open(os.path.join(directory, 'manifest.json')) as fh:
+                publish['manifests'][directory] = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            publish['manifests'][directory] = {}
+    return publish['manifests'][directory]
+
+# compressed siblings --publish writes next to each page, part of the
+# --shards fingerprints so that adding --publish (or brotli) redoes them
+def publish_siblings():
+    if publish is None:
+        return []
+    return ['.gz', '.br'] if publish['brotli'] else ['.gz']
+
+def publish_file(path, text):
+    import gzip
+    import hashlib
+    data = text.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    directory, name = os.path.split(os.path.abspath(path))
+    manifest = publish_manifest(directory)
+    if manifest.get(name) == digest and all(os.path.exists(path + ext)
+            for ext in [''] + publish_siblings()):
+        publish['unchanged'] += 1
+        return
+    siblings = {'': data, '.gz': gzip.compress(data, 9, mtime=0)}
+    if publish['brotli']:
+        siblings['.br'] = publish['brotli'].compress(data)
+    for ext, body in siblings.items():
+        tmp = os.path.join(directory, '.%s%s.tmp' % (name, ext))
+        with open(tmp, 'wb') as fh:
+            fh.write(body)
+        os.replace(tmp, path + ext)
+    manifest[name] = digest
+    publish['written'] += 1
+
+def publish_close():
+    import json
+    for directory, manifest in publish['manifests'].items():
+        text = json.dumps(manifest, indent=1, sort_keys=True) + '\n'
+        path = os.path.join(directory, 'manifest.json')
         try:
-            spacious = s['venue']['spacious']
-        except KeyError:
+            with open(path) as fh:
+                if fh.read() == text:
+                    continue
+        except FileNotFoundError:
             pass
+        with open(path + '.tmp', 'w') as fh:
+            fh.write(text)
+        os.replace(path + '.tmp', path)
+    print('publish: %d written, %d unchanged' % (publish['written'],
+        publish['unchanged']), file=sys.stderr)
+
+##############################################################################
+# --landing
+##############################################################################
+
+landing_fields = ('start', 'kind', 'volume', 'venue', 'sets')
+
+# --sprites: the venue slugs rows show from one sprite sheet rather than a
+# PNG each
+venue_sprites = ()
+# --landing-load: weeks of training load shown after the sessions
+landing_load = 0
+
+def landing_start(title):
+    return landing_head % (title, landing_sprites if venue_sprites else '')
+
+# appends the month blocks of SESSIONS, in order, to PAGE
+def landing_blocks(sessions, url_generator, page):
+    year = ''
+    block = None
+    icons = {}
+    for s in sessions:
+        start = s.start
+        year_suffix = ' %d' % start.year if year != start.year else ''
+        year = start.year
+        if block != start.month:
+            if block:
+                page.append(landing_month_end)
+            page.append(landing_month % (start.strftime('%B'), year_suffix))
+            block = start.month
 
         url = url_generator(s)
-        venue_short = unidecode.unidecode(s['venue']['name']).lower().replace(' ', '')
-        venue_full = s['venue']['name'].encode('ascii', 'xmlcharrefreplace').decode()
+        icon = icons.get(s.venue.name)
+        if icon is None:
+            venue_full = s.venue.name.encode('ascii', 'xmlcharrefreplace').decode()
+            if venue_slug(s.venue.name) in venue_sprites:
+                import sprites
+                icon = landing_sprite % (
+                    sprites.sprite_class(venue_slug(s.venue.name)),
+                    venue_full, venue_full)
+            else:
+                icon = landing_icon % (venue_slug(s.venue.name), venue_full,
+                    venue_full)
+            icons[s.venue.name] = icon
         summary = []
         strokes = []
-        for workset in s['sets']:
-            summary.append(workset['summary'])
-            if 'stroke' in workset:
-                strokes.append(workset['stroke'])
+        for workset in s.sets:
+            summary.append(workset.summary)
+            if workset.stroke is not None:
+                strokes.append(workset.stroke)
         stroke_color = 'other' # could support multi-stroke sessions, etc
         stroke_prefix = ''
         if len(list(set(strokes))) == 1:
@@ -221,200 +881,994 @@ def landing(files, title, url_generator):
             elif stroke == 'IM':
                 stroke_color = 'im200'
                 stroke_prefix = 'IM '
-        print(
-            '<tr>',
-            '<td class="col1">%s</td>' % \
-                (s['start'].strftime('%-d')),
-            '<td class="col2">%s</td>' % \
-                (s['start'].strftime('%a')[0:2]),
-            '<td class="col3%s">%s</td>' % \
-                (' spacious' if spacious else '',
-                time_ampm(s['start'])),
-            '<td class="col4"><img %s src="%s" alt="%s" title="%s"></td>' % \
-                (venue_dimensions, '%s.png' % venue_short, venue_full, venue_full),
-            '<td onclick="window.location=\'%s\';" class="col5 link %s">' \
-                '<a href="%s">%s%s</a></td>' % \
-                (url, stroke_color, url, stroke_prefix, s['kind']),
-            '<td class="col6">%s</td>' % ', '.join(summary),
-            '<td class="col7">%dm</td>' % s['volume'],
-            '</tr>')
+        page.append(landing_row % (
+            start.day,
+            weekdays[start.weekday()],
+            ' spacious' if s.venue.spacious else '',
+            time_ampm(start),
+            icon,
+            url, stroke_color, url, stroke_prefix, s.kind,
+            ', '.join(summary),
+            s.volume))
     if block:
-        print('</tbody></table>')
+        page.append(landing_month_end)
+
+def landing(files, title, url_generator, out=None):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    sessions = parse_all(files, landing_fields)
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    page = [landing_start(title)]
+    landing_blocks(sessions, url_generator, page)
+    if landing_load:
+        load_section(sessions, page)
+    page.append(landing_foot)
+    stage('write')
+    write_page(page, out)
+
+##############################################################################
+# --shards
+##############################################################################
+
+# one landing page per year (or per N months) and an index of them; the
+# stamps of each shard's files are kept in OUTDIR/.shards.json so shards
+# whose files did not change are not parsed or written again
+def shard_key(date, months):
+    if months == 12:
+        return '%d' % date.year
+    return '%d-%02d' % (date.year, (date.month - 1) // months * months + 1)
+
+# first and last day of the shard KEY
+def shard_range(key, months):
+    import calendar
+    if '-' not in key:
+        year = int(key)
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    year, month = [int(part) for part in key.split('-')]
+    last = min(month + months - 1, 12)
+    return datetime.date(year, month, 1), \
+        datetime.date(year, last, calendar.monthrange(year, last)[1])
+
+def shard_write(outdir, name, page):
+    if publish:
+        publish_file(os.path.join(outdir, name), ''.join(page))
+        return
+    tmp = os.path.join(outdir, '.%s.tmp' % name)
+    with open(tmp, 'w') as fh:
+        write_page(page, fh)
+    os.replace(tmp, os.path.join(outdir, name))
+
+# and its --publish siblings
+def shard_remove(outdir, name):
+    if publish:
+        publish_manifest(os.path.abspath(outdir)).pop(name, None)
+    for ext in ['', '.gz', '.br']:
+        try:
+            os.remove(os.path.join(outdir, name + ext))
+        except FileNotFoundError:
+            pass
 
-    print('<p><a href="..">../</a></p>')
-    print('</body></html>')
+# SINCE and UNTIL are the --since/--until the files were pruned to, widened
+# to whole shards; shards outside them are left as they are
+def shards(files, title, url_generator, outdir, months=12, since=None,
+        until=None):
+    import hashlib
+    import json
+    stage('parse')
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, '.shards.json')
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    groups = {}
+    if files is None:
+        # --pack or --index sessions have no stamps, render every shard
+        for s in parse_all(None, landing_fields):
+            groups.setdefault(shard_key(s.start, months), []).append(s)
+        fingerprints = {key: None for key in groups}
+    else:
+        unnamed = []
+        for file in files:
+            date = file_date(file)
+            if date is None:
+                unnamed.append(file)
+            else:
+                groups.setdefault(shard_key(date, months), []).append(file)
+        for file, s in zip(unnamed, parse_all(unnamed, ('start',))):
+            groups.setdefault(shard_key(s.start, months), []).append(file)
+        fingerprints = {}
+        for key, group in groups.items():
+            stamps = sorted((os.path.abspath(file), os.stat(file).st_size,
+                os.stat(file).st_mtime_ns) for file in group)
+            fingerprints[key] = hashlib.sha1(repr((title, venue_sprites,
+                publish_siblings(), stamps)).encode()
+                ).hexdigest()
+        changed = [key for key in groups if fingerprints[key] !=
+            manifest.get(key, {}).get('fingerprint') or
+            not all(os.path.exists(os.path.join(outdir, key + '.html' + ext))
+            for ext in [''] + publish_siblings())]
+        parsed = iter(parse_all([file for key in changed
+            for file in groups[key]], landing_fields))
+        groups = {key: [next(parsed) for file in groups[key]]
+            if key in changed else None for key in groups}
+    stage('render')
+    written = 0
+    for key, sessions in groups.items():
+        if sessions is None:
+            continue
+        written += 1
+        sessions.sort(key=lambda s: s.start)
+        page = [landing_start('%s %s' % (title, key))]
+        landing_blocks(sessions, url_generator, page)
+        page.append(shard_foot % title)
+        shard_write(outdir, key + '.html', page)
+        manifest[key] = {'fingerprint': fingerprints[key],
+            'sessions': len(sessions)}
+    for key in list(manifest):
+        first, last = shard_range(key, months)
+        if key not in groups and (since is None or first >= since) and \
+                (until is None or last <= until):
+            del manifest[key]
+            shard_remove(outdir, key + '.html')
+    page = [landing_start(title)]
+    for key in sorted(manifest, reverse=True):
+        page.append(shards_row % (key, key, manifest[key]['sessions']))
+    page.append(landing_foot)
+    stage('write')
+    shard_write(outdir, 'index.html', page)
+    with open(manifest_path, 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    print('shards: %d written, %d unchanged' % (written,
+        len(groups) - written), file=sys.stderr)
 
 ##############################################################################
 # --single
 ##############################################################################
 
-def single(file, picture):
+def single(file, picture, out=None):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    profile_read([file])
     session = parse(file)
+    stage('render')
+    page = single_page(session, picture)
+    stage('write')
+    write_page(page, out)
 
-    shortdate = session['start'].strftime('%b %-d')
-    print('<html><head><meta charset="utf-8">')
-    print('<link rel="icon" type="image/x-icon" href="favicon.ico">')
-    print('<title>%s</title></head><body><main>' % shortdate)
-    print('<header><h2>%s</h2>' % shortdate)
-
+def single_page(session, picture):
+    import html
     strokes = []
-    for s in session['sets']:
-        if 'stroke' in s:
-            strokes.append(html.escape(s['stroke']))
+    for s in session.sets:
+        if s.stroke is not None:
+            strokes.append(html.escape(s.stroke))
 
-    print('<p>%s, %s, %s%s, %dm</p></header>' % (\
-        time_ampm(session['start']),
-        session['venue']['name'],
+    shortdate = session.start.strftime('%b %-d')
+    page = [single_head % (shortdate, shortdate,
+        time_ampm(session.start),
+        session.venue.name,
         ' & '.join(strokes) + ', ' if len(strokes) > 0 else '',
-        session['kind'],
-        session['volume']))
+        session.kind,
+        session.volume)]
 
     def p_or_ul(obj, prefix):
         if type(obj) == list:
-            print('<section>%s<ul>' % prefix)
-            for bullet in obj:
-                print('<li>%s</li>' % bullet)
-            print('</ul></section>')
+            page.append(single_ul % (prefix,
+                ''.join(single_li % bullet for bullet in obj)))
         else:
-            print('<section><p>%s%s</p></section>' % (prefix, capitalise(obj)))
+            page.append(single_p % (prefix, capitalise(obj)))
 
-    if 'notes' in session['venue']:
-        p_or_ul(session['venue']['notes'], '')
+    if session.venue.notes:
+        p_or_ul(session.venue.notes, '')
 
-    if 'injuries' in session and session['injuries']:
-        p_or_ul(session['injuries'], 'Injuries: ')
+    if session.injuries:
+        p_or_ul(session.injuries, 'Injuries: ')
 
-    if 'warmup' in session:
-        p_or_ul(session['warmup'], 'Warm-up: ')
+    if session.warmup is not None:
+        p_or_ul(session.warmup, 'Warm-up: ')
 
-    for s in session['sets']:
-        print('<h3>%s</h3>' % s['summary'])
+    for s in session.sets:
+        page.append(single_h3 % s.summary)
 
-        p_or_ul(s['preparation'], '')
-        if 'comments' in s:
-            p_or_ul(s['comments'], 'Comments: ')
-        if 'structure' in s:
-            p_or_ul(s['structure'], 'Structure: ')
-        if 'times' in s:
-            p_or_ul(s['times'], 'Times: ')
-        if 'video' in s:
-            p_or_ul(s['video'], 'Video: ')
-        p_or_ul(s['next'], 'Next: ')
+        p_or_ul(s.preparation, '')
+        if s.comments is not None:
+            p_or_ul(s.comments, 'Comments: ')
+        if s.structure is not None:
+            p_or_ul(s.structure, 'Structure: ')
+        if s.times is not None:
+            p_or_ul(s.times, 'Times: ')
+        if s.video is not None:
+            p_or_ul(s.video, 'Video: ')
+        p_or_ul(s.next, 'Next: ')
 
-    if 'cooldown' in session:
-        p_or_ul(session['cooldown'], 'Cool-down: ')
+    if session.cooldown is not None:
+        p_or_ul(session.cooldown, 'Cool-down: ')
 
     if picture:
-        print('<section><p><img width="480" src="%s" alt="%s"></p><section>' % \
-            (picture, shortdate))
+        page.append(single_picture % (picture, shortdate))
 
-    # mobile Safari reader mode seems to require the 'main' semantic HTML tag
-    print('</main></body></html>')
+    page.append(single_foot)
+    return page
 
 ##############################################################################
 # --totals
 ##############################################################################
 
-def totals(files):
-    sessions = []
+# volume and session count per group, kept next to the parse cache as
+# {'files': {by: {path: (stamp, key, volume)}}, 'totals': {by: {key: [volume, count]}}}
+# so that only added, changed or removed files touch the totals; each group
+# is kept up to date only once asked for, parsing just the fields it needs
+rollup_groups = ['week', 'month', 'year', 'venue', 'stroke']
+rollup_fields = {'week': ('start', 'volume'), 'month': ('start', 'volume'),
+    'year': ('start', 'volume'), 'venue': ('venue', 'volume'),
+    'stroke': ('sets', 'volume')}
+
+def rollup_key(s, by):
+    if by == 'week':
+        return tuple(s.start.isocalendar()[:2])
+    elif by == 'month':
+        return (s.start.year, s.start.month)
+    elif by == 'year':
+        return s.start.year
+    elif by == 'venue':
+        return s.venue.name
+    else:
+        return session_stroke(s)
+
+def rollup_label(key, by):
+    if by == 'week':
+        return '%d-W%02d' % key
+    elif by == 'month':
+        return datetime.date(key[0], key[1], 1).strftime('%B %Y')
+    return str(key)
+
+def rollup_add(totals, keys, volume, count):
+    for by, key in keys.items():
+        group = totals.setdefault(by, {})
+        entry = group.setdefault(key, [0, 0])
+        entry[0] += volume * count
+        entry[1] += count
+        if entry[1] == 0:
+            del group[key]
+
+# numbered on from cache_version, which the rollups shared when they were
+# kept for every group at once
+rollups_version = 4
+
+def rollups_path(path):
+    return '%s-rollups%s' % os.path.splitext(path)
+
+def rollups_load(cache):
+    import pickle
+    cache['rollups'] = {'files': {}, 'totals': {}}
+    try:
+        with open(rollups_path(cache['path']), 'rb') as fh:
+            version, rollups = pickle.load(fh)
+        if version == rollups_version:
+            cache['rollups'] = rollups
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print('warning: ignoring unreadable rollups %s: %s' % \
+            (rollups_path(cache['path']), e), file=sys.stderr)
+
+def rollups_update(rollups, files, by):
+    known = rollups['files'].setdefault(by, {})
+    seen = set()
+    changed = []
     for file in files:
-        sessions.append(parse(file))
-    sessions = sorted(sessions, key=lambda s: s['start'])
-    volume = {}
-    for s in sessions:
-        month = s['start'].replace(day=1).strftime('%B %Y')
-        volume.setdefault(month, [])
-        volume[month].append(s['volume'])
-    writer = csv.writer(sys.stdout)
-    for month in volume:
-        writer.writerow([month, sum(volume[month]), len(volume[month])])
+        path = os.path.abspath(file)
+        st = os.stat(path)
+        seen.add(path)
+        if path not in known or known[path][0] != (st.st_size, st.st_mtime_ns):
+            changed.append((file, path, (st.st_size, st.st_mtime_ns)))
+    removed = [path for path in known if path not in seen]
+    for path in removed:
+        stamp, key, volume = known.pop(path)
+        rollup_add(rollups['totals'], {by: key}, volume, -1)
+    if not changed:
+        return len(removed)
+    sessions = parse_all([file for file, path, stamp in changed],
+        rollup_fields[by])
+    for (file, path, stamp), s in zip(changed, sessions):
+        if path in known:
+            rollup_add(rollups['totals'], {by: known[path][1]}, known[path][2],
+                -1)
+        key = rollup_key(s, by)
+        known[path] = (stamp, key, s.volume)
+        rollup_add(rollups['totals'], {by: key}, s.volume, 1)
+    return len(changed) + len(removed)
+
+def totals(files, out=None, by='month', rollups=True):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    if rollups and files is not None and cache is not None:
+        if cache['rollups'] is None:
+            rollups_load(cache)
+        if rollups_update(cache['rollups'], files, by):
+            cache['rollups_dirty'] = True
+        groups = cache['rollups']['totals'].get(by, {})
+    else:
+        # no file stamps to keep rollups current with, or only part of the
+        # archive, so add up afresh
+        sums = {}
+        for s in parse_all(files, rollup_fields[by]):
+            rollup_add(sums, {by: rollup_key(s, by)}, s.volume, 1)
+        groups = sums.get(by, {})
+    stage('write')
+    totals_write(groups, by, out)
+
+def totals_write(groups, by, out):
+    import csv
+    writer = csv.writer(out)
+    for key in sorted(groups):
+        writer.writerow([rollup_label(key, by)] + groups[key])
 
 ##############################################################################
-# --database
+# --load
 ##############################################################################
 
-def database(files):
-    sessions = []
-    for file in files:
-        sessions.append(parse(file))
-    sessions = sorted(sessions, key=lambda s: s['start'])
-    writer = csv.writer(sys.stdout, delimiter='\t', lineterminator='\n')
-    for s in sessions:
-        spacious = False
-        try:
-            spacious = s['venue']['spacious']
-        except KeyError:
-            pass
+# daily volume with the acute (last 7 days) and chronic (last 28 days, per
+# week) training load and their ratio, about 0.8 to 1.3 when training
+# steadily and over 1.5 after a sudden jump; the acute load is also given
+# per stroke. Uses NumPy when installed, plain lists otherwise
+load_fields = ('start', 'volume', 'sets')
+load_strokes = ['free', 'back', 'breast', 'fly', 'IM', 'other']
+load_acute = 7
+load_chronic = 28
 
-        venue_short = unidecode.unidecode(s['venue']['name']).lower().replace(' ', '')
+# first day and {'volume', 'acute', 'chronic', 'ratio', stroke...: [per day]}
+# from the first session's day to the last's, the ratio None without load
+# or before there are 28 days to take the chronic load over
+def load_series(sessions):
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if not sessions:
+        return None, {}
+    first = min(s.start for s in sessions).date()
+    days = [(s.start.date() - first).days for s in sessions]
+    strokes = [load_strokes.index(session_stroke(s)) for s in sessions]
+    volumes = [s.volume for s in sessions]
+    if numpy is None:
+        return first, load_lists(days, strokes, volumes, max(days) + 1)
+    return first, load_arrays(numpy, days, strokes, volumes, max(days) + 1)
 
-        summary = []
-        strokes = []
-        for workset in s['sets']:
-            summary.append(workset['summary'])
-            if 'stroke' in workset:
-                strokes.append(workset['stroke'])
+def load_arrays(numpy, days, strokes, volumes, count):
+    days = numpy.array(days)
+    volumes = numpy.array(volumes, dtype=numpy.float64)
+    daily = numpy.zeros((len(load_strokes), count))
+    numpy.add.at(daily, (numpy.array(strokes), days), volumes)
+    # sums over the last N days along each row
+    def rolling(x, n):
+        total = numpy.cumsum(x, axis=-1)
+        window = total.copy()
+        window[..., n:] -= total[..., :-n]
+        return window
+    volume = daily.sum(axis=0)
+    acute = rolling(volume, load_acute)
+    chronic = rolling(volume, load_chronic) * load_acute / load_chronic
+    ratio = numpy.full(count, numpy.nan)
+    numpy.divide(acute, chronic, out=ratio, where=chronic > 0)
+    ratio[:load_chronic - 1] = numpy.nan
+    series = {'volume': volume.tolist(), 'acute': acute.tolist(),
+        'chronic': chronic.tolist(),
+        'ratio': [None if r != r else r for r in ratio.tolist()]}
+    for stroke, row in zip(load_strokes, rolling(daily, load_acute)):
+        series[stroke] = row.tolist()
+    return series
 
-        # could support multi-stroke sessions, etc
-        stroke = 'other'
-        if len(list(set(strokes))) == 1:
-            if strokes[0] in ['fly', 'back', 'breast', 'free']:
-                stroke = strokes[0]
-            elif strokes[0].startswith('IM'):
-                stroke = 'IM'
+def load_lists(days, strokes, volumes, count):
+    import itertools
+    daily = [[0.0] * count for stroke in load_strokes]
+    for day, stroke, volume in zip(days, strokes, volumes):
+        daily[stroke][day] += volume
+    def rolling(x, n):
+        total = list(itertools.accumulate(x, initial=0.0))
+        return [total[i + 1] - total[max(0, i + 1 - n)] for i in range(len(x))]
+    volume = [sum(day) for day in zip(*daily)]
+    acute = rolling(volume, load_acute)
+    chronic = [x * load_acute / load_chronic
+        for x in rolling(volume, load_chronic)]
+    series = {'volume': volume, 'acute': acute, 'chronic': chronic,
+        'ratio': [a / c if c > 0 and day >= load_chronic - 1 else None
+            for day, (a, c) in enumerate(zip(acute, chronic))]}
+    for stroke, row in zip(load_strokes, daily):
+        series[stroke] = rolling(row, load_acute)
+    return series
+
+def load(files, out=None):
+    if out is None:
+        out = sys.stdout
+    stage('parse')
+    sessions = parse_all(files, load_fields)
+    stage('render')
+    load_write(sessions, out)
+
+def load_write(sessions, out):
+    import csv
+    first, series = load_series(sessions)
+    writer = csv.writer(out)
+    for day in range(len(series.get('volume', []))):
+        ratio = series['ratio'][day]
+        writer.writerow([first + datetime.timedelta(days=day),
+            '%d' % series['volume'][day],
+            '%d' % series['acute'][day],
+            '%.1f' % series['chronic'][day],
+            '' if ratio is None else '%.2f' % ratio] +
+            ['%d' % series[stroke][day] for stroke in load_strokes])
+
+# the acute and chronic load at the end of each of the last --landing-load
+# weeks, up to the last session
+def load_section(sessions, page):
+    first, series = load_series(sessions)
+    if not series:
+        return
+    last = len(series['volume']) - 1
+    page.append(load_head)
+    for day in range(max(last % 7, last - 7 * (landing_load - 1)), last + 1, 7):
+        ratio = series['ratio'][day]
+        colour = ''
+        if ratio is not None and 0.8 <= ratio <= 1.3:
+            colour = ' steady'
+        elif ratio is not None and ratio > 1.5:
+            colour = ' spike'
+        page.append(load_row % (
+            (first + datetime.timedelta(days=day)).strftime('%b %-d %Y'),
+            series['acute'][day], series['chronic'][day], colour,
+            '' if ratio is None else '%.2f' % ratio))
+    page.append(load_end)
+
+##############################################################################
+# --database
+##############################################################################
+
+def database(files, out=None):
+    if out is None:
+        out = sys.stdout
+    fields = ('start', 'kind', 'volume', 'venue', 'sets')
+    stage('parse')
+    sessions = parse_all(files, fields)
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    database_write(sessions, out)
+
+# SESSIONS in order
+def database_write(sessions, out):
+    import csv
+    writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+    for s in sessions:
+        venue_short = venue_slug(s.venue.name)
 
         writer.writerow([
-            s['start'],
+            s.start,
             venue_short,
-            s['venue']['name'],
-            spacious,
-            s['volume'],
-            s['kind'],
-            stroke,
-            ', '.join(summary)
+            s.venue.name,
+            s.venue.spacious,
+            s.volume,
+            s.kind,
+            session_stroke(s),
+            ', '.join(workset.summary for workset in s.sets)
         ])
 
+##############################################################################
+# --columnar
+##############################################################################
+
+# long-form tables for analytics, a row per session and one per set joined
+# on "session"; written as Arrow IPC or Parquet with pyarrow, otherwise as
+# .columns files (see columns_write), strings dictionary-encoded either way
+columnar_types = {'session': 'int64', 'position': 'int64',
+    'start': 'timestamp', 'kind': 'dictionary', 'volume': 'int64',
+    'venue': 'dictionary', 'spacious': 'bool', 'stroke': 'dictionary',
+    'summary': 'dictionary', 'filename': 'dictionary'}
+
+def columnar_tables(sessions):
+    tables = {
+        'sessions': {column: [] for column in ['session', 'start', 'kind',
+            'volume', 'venue', 'spacious', 'stroke', 'filename']},
+        'sets': {column: [] for column in ['session', 'position', 'stroke',
+            'summary']}
+    }
+    rows = tables['sessions']
+    sets = tables['sets']
+    for i, s in enumerate(sessions):
+        rows['session'].append(i)
+        rows['start'].append(s.start)
+        rows['kind'].append(s.kind)
+        rows['volume'].append(s.volume)
+        rows['venue'].append(s.venue.name)
+        rows['spacious'].append(s.venue.spacious)
+        rows['stroke'].append(session_stroke(s))
+        rows['filename'].append(s.filename)
+        for position, workset in enumerate(s.sets):
+            sets['session'].append(i)
+            sets['position'].append(position)
+            sets['stroke'].append(workset.stroke)
+            sets['summary'].append(workset.summary)
+    return tables
+
+def columnar(files, outdir, format=None):
+    if format is None:
+        try:
+            import pyarrow
+            format = 'arrow'
+        except ImportError:
+            format = 'columns'
+    stage('parse')
+    sessions = parse_all(files, ('start', 'kind', 'volume', 'venue', 'sets'))
+    stage('sort')
+    sessions.sort(key=lambda s: s.start)
+    stage('render')
+    tables = columnar_tables(sessions)
+    stage('write')
+    os.makedirs(outdir, exist_ok=True)
+    for name, table in tables.items():
+        path = os.path.join(outdir, '%s.%s' % (name, format))
+        if format == 'columns':
+            columns_write(path, table)
+        else:
+            arrow_write(path, table, format)
+
+def arrow_write(path, table, format):
+    import pyarrow
+    types = {'int64': pyarrow.int64(), 'float64': pyarrow.float64(),
+        'bool': pyarrow.bool_(), 'timestamp': pyarrow.timestamp('s'),
+        'dictionary': pyarrow.string()}
+    arrays = {}
+    for column, values in table.items():
+        kind = columnar_types[column]
+        arrays[column] = pyarrow.array(values, types[kind])
+        if kind == 'dictionary':
+            arrays[column] = arrays[column].dictionary_encode()
+    table = pyarrow.table(arrays)
+    if format == 'parquet':
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, path)
+    else:
+        import pyarrow.ipc
+        with pyarrow.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+# a .columns file is one line of JSON describing the columns followed by
+# their little-endian arrays back to back: int64 and timestamp (seconds
+# since 1970, wall-clock time) as "q", float64 as "d", bool as "b" and
+# dictionary columns as "i" codes into the header's dictionary, -1 for None
+columns_codes = {'int64': 'q', 'timestamp': 'q', 'float64': 'd', 'bool': 'b',
+    'dictionary': 'i'}
+epoch = datetime.datetime(1970, 1, 1)
+second = datetime.timedelta(seconds=1)
+
+def columns_write(path, table):
+    import array
+    import json
+    header = {'rows': len(table['session']), 'columns': []}
+    buffers = []
+    offset = 0
+    for column, values in table.items():
+        kind = columnar_types[column]
+        entry = {'name': column, 'type': kind}
+        if kind == 'dictionary':
+            codes = {}
+            values = [-1 if v is None else codes.setdefault(v, len(codes))
+                for v in values]
+            entry['dictionary'] = list(codes)
+        elif kind == 'timestamp':
+            values = [(v - epoch) // second for v in values]
+        data = array.array(columns_codes[kind], values)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        entry['offset'] = offset
+        entry['length'] = len(data) * data.itemsize
+        offset += entry['length']
+        header['columns'].append(entry)
+        buffers.append(data.tobytes())
+    with open(path, 'wb') as fh:
+        fh.write(json.dumps(header).encode() + b'\n')
+        fh.write(b''.join(buffers))
+
+# column name -> list of values, for notebooks without pyarrow
+def columns_read(path):
+    import array
+    import json
+    with open(path, 'rb') as fh:
+        header = json.loads(fh.readline())
+        body = fh.read()
+    table = {}
+    for entry in header['columns']:
+        kind = entry['type']
+        data = array.array(columns_codes[kind])
+        data.frombytes(body[entry['offset']:entry['offset'] + entry['length']])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        if kind == 'dictionary':
+            dictionary = entry['dictionary']
+            table[entry['name']] = [None if code < 0 else dictionary[code]
+                for code in data]
+        elif kind == 'timestamp':
+            table[entry['name']] = [epoch + v * second for v in data]
+        elif kind == 'bool':
+            table[entry['name']] = [bool(v) for v in data]
+        else:
+            table[entry['name']] = data.tolist()
+    return table
+
+##############################################################################
+# --build
+##############################################################################
+
+# the landing page, totals, load and database of all sessions and a diary page
+# for each, from one parse of every file; OUTDIR/.build.json keeps a
+# fingerprint of the inputs each output was made from (every XML file for
+# the summaries, its XML file and picture for a diary page) so outputs
+# whose inputs did not change are not rendered or written again
+build_summaries = ['index.html', 'totals.csv', 'load.csv', 'database.tsv']
+
+# NAME.jpg next to NAME.xml, as serve.py and watch.py look for it
+def build_picture(file, outdir):
+    picture = os.path.splitext(file)[0] + '.jpg'
+    if os.path.exists(picture):
+        return os.path.relpath(picture, outdir)
+    return None
+
+# every output also depends on what --publish writes next to it
+def build_fingerprint(*inputs):
+    import hashlib
+    return hashlib.sha1(repr((publish_siblings(),) + inputs).encode()
+        ).hexdigest()
+
+def build(files, title, outdir, by='month'):
+    import json
+    stage('parse')
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, '.build.json')
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    url = lambda s: '%s.html' % s.filename.replace('.xml', '')
+    fingerprints = {}
+    pictures = {}
+    if files is None:
+        # --pack sessions have no stamps or pictures, render everything
+        sessions = parse_all(None)
+        pages = {url(s): s for s in sessions}
+        fingerprints = {name: None for name in build_summaries + list(pages)}
+        pictures = {name: None for name in pages}
+    else:
+        pages = {}
+        stamps = []
+        for file in files:
+            st = os.stat(file)
+            stamp = (os.path.abspath(file), st.st_size, st.st_mtime_ns)
+            stamps.append(stamp)
+            name = '%s.html' % filename(file).replace('.xml', '')
+            # pages are flat in OUTDIR, named like their XML files
+            if name in pages:
+                raise NameError('%s and %s would both be %s' % (pages[name],
+                    file, os.path.join(outdir, name)))
+            pages[name] = file
+            pictures[name] = build_picture(file, outdir)
+            fingerprints[name] = build_fingerprint(stamp, pictures[name])
+        stamps.sort()
+        fingerprints['index.html'] = build_fingerprint(title, venue_sprites,
+            landing_load, stamps)
+        fingerprints['totals.csv'] = build_fingerprint(by, stamps)
+        fingerprints['load.csv'] = build_fingerprint(stamps)
+        fingerprints['database.tsv'] = build_fingerprint(stamps)
+    stale = {name for name in fingerprints
+        if fingerprints[name] is None or fingerprints[name] !=
+        manifest.get(name) or not all(os.path.exists(os.path.join(outdir,
+        name + ext)) for ext in [''] + publish_siblings())}
+    if files is not None:
+        # the summaries need every session, otherwise only stale pages parse
+        if stale.intersection(build_summaries):
+            wanted = files
+        else:
+            wanted = [pages[name] for name in pages if name in stale]
+        parsed = dict(zip(wanted, parse_all(wanted)))
+        sessions = list(parsed.values())
+        pages = {name: parsed.get(file) for name, file in pages.items()}
+    stage('render')
+    for name, session in pages.items():
+        if name in stale:
+            shard_write(outdir, name, single_page(session, pictures[name]))
+    sessions.sort(key=lambda s: s.start)
+    if 'index.html' in stale:
+        page = [landing_start(title)]
+        landing_blocks(sessions, url, page)
+        if landing_load:
+            load_section(sessions, page)
+        page.append(landing_foot)
+        shard_write(outdir, 'index.html', page)
+    if 'totals.csv' in stale:
+        sums = {}
+        for s in sessions:
+            rollup_add(sums, {by: rollup_key(s, by)}, s.volume, 1)
+        shard_write(outdir, 'totals.csv',
+            [to_string(totals_write, sums.get(by, {}), by)])
+    if 'load.csv' in stale:
+        shard_write(outdir, 'load.csv', [to_string(load_write, sessions)])
+    if 'database.tsv' in stale:
+        shard_write(outdir, 'database.tsv',
+            [to_string(database_write, sessions)])
+    stage('write')
+    for name in manifest:
+        if name not in fingerprints:
+            shard_remove(outdir, name)
+    with open(manifest_path, 'w') as fh:
+        json.dump(fingerprints, fh, indent=1)
+    print('build: %d written, %d unchanged, %d removed' % (len(stale),
+        len(fingerprints) - len(stale),
+        len(set(manifest) - set(fingerprints))), file=sys.stderr)
+
+##############################################################################
+# date pruning
+##############################################################################
+
+# session files are named YYYYMMDD[-SUFFIX].xml, None for other names
+def file_date(file):
+    name = os.path.basename(file).split('.')[0].split('-')[0]
+    if len(name) != 8 or not name.isdigit():
+        return None
+    try:
+        return datetime.date(int(name[:4]), int(name[4:6]), int(name[6:]))
+    except ValueError:
+        return None
+
+# drop files outside [since, until] by name, opening only the oddly named
+def prune(files, since, until):
+    if files is None or (since is None and until is None):
+        return files
+    stage('prune')
+    since = since or datetime.date.min
+    until = until or datetime.date.max
+    kept = []
+    unnamed = []
+    for file in files:
+        date = file_date(file)
+        if date is None:
+            unnamed.append(file)
+        elif since <= date <= until:
+            kept.append(file)
+    if unnamed:
+        for file, s in zip(unnamed, parse_all(unnamed, ('start',))):
+            if since <= s.start.date() <= until:
+                kept.append(file)
+    return kept
+
 ##############################################################################
 # main
 ##############################################################################
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--title',
-    metavar='TITLE', help='HTML title')
-parser.add_argument('-p', '--picture',
-    metavar='JPGFILE', help='Picture to reference from HTML')
-parser.add_argument('-l', '--landing', nargs='+',
-    metavar='XMLFILE', help='HTML landing page (HTML filenames from XML ones)')
-parser.add_argument('-s', '--totals', nargs='+',
-    metavar='XMLFILE', help='Totals listing')
-parser.add_argument('-d', '--database', nargs='+',
-    metavar='XMLFILE', help='Database-friendly summary with some detail')
-parser.add_argument('-D', '--database-dir', nargs='+',
-    metavar='DIRECTORY', help='Database-friendly summary with some detail (scan directory for XML files)')
-parser.add_argument('-1', '--single',
-    metavar='XMLFILE', help='HTML diary page')
-args = vars(parser.parse_args())
-if len(sys.argv) == 1:
-    parser.print_usage()
-    sys.exit(2)
-
-if args['landing']:
+def main(argv=None):
+    global cache, jobs, index, index_filters, store, store_filters, venue_sprites
+    global landing_load
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--title',
+        metavar='TITLE', help='HTML title')
+    parser.add_argument('-p', '--picture',
+        metavar='JPGFILE', help='Picture to reference from HTML')
+    parser.add_argument('-l', '--landing', nargs='*',
+        metavar='XMLFILE', help='HTML landing page (HTML filenames from XML ones, or from --index if none given)')
+    parser.add_argument('-s', '--totals', nargs='*',
+        metavar='XMLFILE', help='Totals listing (from --index if no XMLFILE given)')
+    parser.add_argument('--by', choices=rollup_groups, default='month',
+        help='Group --totals (and --build totals.csv) by week, month, year, venue or stroke (default: %(default)s)')
+    parser.add_argument('-L', '--load', nargs='*',
+        metavar='XMLFILE', help='Training load CSV, a row per day: date, volume, acute (7-day) load, chronic (28-day, per week) load, their ratio, then the acute load of free, back, breast, fly, IM and other (from --index if no XMLFILE given)')
+    parser.add_argument('--landing-load', type=int, default=0,
+        metavar='WEEKS', help='With --landing or --build, end the landing page with the training load of the last WEEKS weeks')
+    parser.add_argument('-d', '--database', nargs='*',
+        metavar='XMLFILE', help='Database-friendly summary with some detail (from --index if no XMLFILE given)')
+    parser.add_argument('-D', '--database-dir', nargs='+',
+        metavar='DIRECTORY', help='Database-friendly summary with some detail (scan directory for XML files)')
+    parser.add_argument('--columnar',
+        metavar='OUTDIR', help='With --database, --database-dir or --query, write long-form tables to OUTDIR instead of TSV')
+    parser.add_argument('--columnar-format', choices=['arrow', 'parquet', 'columns'],
+        help='Arrow IPC or Parquet (need pyarrow) or the built-in .columns format (default: arrow if pyarrow is installed)')
+    parser.add_argument('-1', '--single',
+        metavar='XMLFILE', help='HTML diary page')
+    parser.add_argument('--shards',
+        metavar='OUTDIR', help='With --landing, write OUTDIR/YYYY.html per year and an OUTDIR/index.html of them, only redoing changed years')
+    parser.add_argument('--shard-months', type=int, default=12,
+        choices=[1, 2, 3, 4, 6, 12],
+        metavar='N', help='With --shards, one page per N months named YYYY-MM.html (default: %(default)s)')
+    parser.add_argument('-b', '--build', nargs='+',
+        metavar=('OUTDIR', 'XMLFILE'), help='Write the landing page, totals, load, database and every diary page to OUTDIR, only redoing those whose XML files or pictures (NAME.jpg next to NAME.xml) changed (from --pack if no XMLFILE given)')
+    parser.add_argument('--sprites',
+        metavar='PNGDIR', help='Pack the venue icons PNGDIR/*.png into one PNGDIR/venues.png and venues.css, and have landing pages (kept next to them) use it')
+    parser.add_argument('-o', '--output',
+        metavar='FILE', help='Write to FILE instead of standard output')
+    parser.add_argument('--publish', action='store_true',
+        help='For static hosting: leave unchanged --output and --shards pages alone, add .gz/.br siblings and a manifest.json of SHA-256 hashes')
+    parser.add_argument('--cache', default=cache_default_path(),
+        metavar='FILE', help='Parsed-session cache (default: %(default)s)')
+    parser.add_argument('--cache-limit', type=int, default=100000,
+        metavar='N', help='Maximum number of sessions kept in the cache')
+    parser.add_argument('--no-cache', action='store_true',
+        help='Parse every XML file, bypassing the cache')
+    parser.add_argument('--clear-cache', action='store_true',
+        help='Delete the cache before doing anything else')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        metavar='N', help='Parse XML files with N worker processes')
+    parser.add_argument('--pack',
+        metavar='PACKFILE', help='Read sessions from a pack.py store when no XMLFILE is given (--single then takes a session name)')
+    parser.add_argument('-i', '--index',
+        metavar='DBFILE', help='SQLite session index (can be shared with lift sessions)')
+    parser.add_argument('-u', '--index-update', nargs='+',
+        metavar='DIRECTORY', help='Add new and changed XML files from DIRECTORY to --index, drop deleted ones')
+    parser.add_argument('-q', '--query', action='store_true',
+        help='Database-friendly summary of the --index sessions matching the filters below')
+    parser.add_argument('--since', type=datetime.date.fromisoformat,
+        metavar='YYYY-MM-DD', help='Only sessions on or after this date (XML files are picked by name where possible)')
+    parser.add_argument('--until', type=datetime.date.fromisoformat,
+        metavar='YYYY-MM-DD', help='Only sessions on or before this date')
+    parser.add_argument('--year', type=int,
+        metavar='YYYY', help='Only sessions in this year')
+    parser.add_argument('--venue',
+        metavar='NAME', help='Only indexed sessions at this venue')
+    parser.add_argument('--stroke',
+        metavar='STROKE', help='Only indexed sessions with a set of this stroke')
+    parser.add_argument('--profile', action='store_true',
+        help='Report per-stage timings, files read and peak memory on standard error')
+    parser.add_argument('--profile-json',
+        metavar='JSONFILE', help='Write the --profile report as JSON to JSONFILE instead')
+    parser.add_argument('--profile-dump',
+        metavar='PSTATSFILE', help='Also write cProfile statistics to PSTATSFILE')
+    if argv is None:
+        argv = sys.argv[1:]
+    args = vars(parser.parse_args(argv))
+    if len(argv) == 0:
+        parser.print_usage()
+        sys.exit(2)
+
+    if args['profile'] or args['profile_json'] or args['profile_dump']:
+        profile_start(args['profile_dump'])
+        stage('setup')
+
+    if args['clear_cache']:
+        for path in [args['cache'], rollups_path(args['cache'])]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    if not args['no_cache']:
+        cache = cache_open(args['cache'], args['cache_limit'])
+    jobs = args['jobs']
+
+    since, until = args['since'], args['until']
+    if args['year']:
+        since = max(since or datetime.date.min, datetime.date(args['year'], 1, 1))
+        until = min(until or datetime.date.max, datetime.date(args['year'], 12, 31))
+        args['since'], args['until'] = since, until
+    if args['shards'] and args['landing'] is not None:
+        # a shard is always rendered from all of its sessions
+        if since:
+            since = shard_range(shard_key(since, args['shard_months']),
+                args['shard_months'])[0]
+        if until:
+            until = shard_range(shard_key(until, args['shard_months']),
+                args['shard_months'])[1]
+        args['since'], args['until'] = since, until
+
+    if args['pack']:
+        import pack
+        if args['index']:
+            parser.error('--pack and --index cannot be combined')
+        if args['index_update'] or args['query']:
+            parser.error('--index-update and --query need --index')
+        store = pack.pack_open(args['pack'])
+        store_filters = {'since': since, 'until': until}
+    elif args['index']:
+        index = index_open(args['index'])
+        index_filters = {key: args[key]
+            for key in ['since', 'until', 'venue', 'stroke']}
+        if args['index_update']:
+            stage('index')
+            index_update(index, args['index_update'])
+    else:
+        for mode in ['landing', 'totals', 'load', 'database']:
+            if args[mode] == []:
+                parser.error('--%s without XMLFILE needs --index or --pack' % mode)
+        if args['index_update'] or args['query']:
+            parser.error('--index-update and --query need --index')
+    if args['build'] and len(args['build']) == 1 and not args['pack']:
+        # indexed sessions have no notes to make diary pages from
+        parser.error('--build without XMLFILE needs --pack')
+    if args['build'] and (since or until):
+        # its summaries and page removals are for the whole archive
+        parser.error('--build cannot be combined with --since, --until or --year')
+
+    if args['publish']:
+        if not args['output'] and not args['shards'] and not args['build']:
+            parser.error('--publish needs --output, --shards or --build')
+        publish_start()
+        out = io.StringIO()
+    elif args['output']:
+        out = open(args['output'], 'w')
+    else:
+        out = sys.stdout
+
+    if args['sprites']:
+        import sprites
+        venue_sprites, changed = sprites.sprites(args['sprites'])
+        print('sprites: %d icons%s' % (len(venue_sprites),
+            '' if changed else ', unchanged'), file=sys.stderr)
+
+    landing_load = args['landing_load']
+
     title = args['title']
-    if not title:
+    if not title and (args['landing'] is not None or args['build']):
         title = 'Swimming'
         print('warning: --title not specifed, will use default "%s"' % title,
             file=sys.stderr)
-    landing(args['landing'], args['title'],
-        lambda s: '%s.html' % s['filename'].replace('.xml', ''))
-elif args['totals']:
-    totals(args['totals'])
-elif args['database']:
-    database(args['database'])
-elif args['database_dir']:
-    for directory in args['database_dir']:
-        database(glob.glob(os.path.join(directory, '*.xml')))
-elif args['single']:
-    single(args['single'], args['picture'])
-else:
-    print('must specify --landing, --totals or --single', file=sys.stderr)
-    sys.exit(2)
+
+    if args['build']:
+        build(args['build'][1:] or None, title, args['build'][0], args['by'])
+    elif args['landing'] is not None:
+        url = lambda s: '%s.html' % s.filename.replace('.xml', '')
+        if args['shards']:
+            shards(prune(args['landing'] or None, since, until), title, url,
+                args['shards'], args['shard_months'], since, until)
+        else:
+            landing(prune(args['landing'] or None, since, until),
+                args['title'], url, out)
+    elif args['totals'] is not None:
+        # the rollups on disk are for whole archives, not date ranges
+        totals(prune(args['totals'] or None, since, until), out, args['by'],
+            since is None and until is None)
+    elif args['load'] is not None:
+        load(prune(args['load'] or None, since, until), out)
+    elif args['database'] is not None:
+        files = prune(args['database'] or None, since, until)
+        if args['columnar']:
+            columnar(files, args['columnar'], args['columnar_format'])
+        else:
+            database(files, out)
+    elif args['database_dir']:
+        if args['columnar']:
+            files = [file for directory in args['database_dir']
+                for file in glob.glob(os.path.join(directory, '*.xml'))]
+            columnar(prune(files, since, until), args['columnar'],
+                args['columnar_format'])
+        else:
+            for directory in args['database_dir']:
+                database(prune(glob.glob(os.path.join(directory, '*.xml')),
+                    since, until), out)
+    elif args['single']:
+        single(member(args['single']), args['picture'], out)
+    elif args['query']:
+        if args['columnar']:
+            columnar(None, args['columnar'], args['columnar_format'])
+        else:
+            database(None, out)
+    elif not args['clear_cache'] and not args['index_update'] and \
+            not args['sprites']:
+        print('must specify --landing, --totals or --single', file=sys.stderr)
+        sys.exit(2)
+
+    if publish:
+        if args['output']:
+            publish_file(args['output'], out.getvalue())
+        publish_close()
+    elif out is not sys.stdout:
+        out.close()
+    if cache:
+        stage('cache')
+        cache_close(cache)
+    if profile:
+        profile_report(args['profile_json'] or '-')
+
+# guarded so that worker processes can import this file
+if __name__ == '__main__':
+    main()
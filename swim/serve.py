@@ -0,0 +1,223 @@
+import argparse
+import email.utils
+import hashlib
+import http.server
+import mimetypes
+import os
+import re
+import sys
+import threading
+import time
+
+import render
+
+##############################################################################
+# page cache
+##############################################################################
+
+directory = '.'
+title = 'Swimming'
+rescan_interval = 1.0
+
+# path -> (stamp, mtime, body, etag), dict order doubles as LRU order; mtime
+# is when the body last changed, as deleting a session or adding a picture
+# changes a page without any file getting newer
+pages = {}
+pages_limit = 256
+lock = threading.Lock()
+scanned = {'at': 0.0, 'files': [], 'stamp': None}
+
+def scan():
+    # the landing page depends on every XML file, but rescanning the
+    # directory on each request would cost one stat per session
+    now = time.monotonic()
+    if now - scanned['at'] >= rescan_interval:
+        files = []
+        stamp = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.xml') and entry.is_file():
+                st = entry.stat()
+                files.append(entry.path)
+                stamp.append((entry.name, st.st_size, st.st_mtime_ns))
+        scanned.update(at=now, files=sorted(files), stamp=tuple(sorted(stamp)))
+    return scanned
+
+def url(s):
+    return '%s.html' % s.filename.replace('.xml', '')
+
+def page(path):
+    if path in ['/', '/index.html']:
+        landing = scan()
+        stamp = landing['stamp']
+        generate = lambda: render.to_string(render.landing,
+            landing['files'], title, url).encode()
+    elif re.fullmatch(r'/[\w.-]+\.html', path):
+        xmlfile = os.path.join(directory, path[1:-len('.html')] + '.xml')
+        try:
+            st = os.stat(xmlfile)
+        except FileNotFoundError:
+            return None
+        picture = path[1:-len('.html')] + '.jpg'
+        if not os.path.exists(os.path.join(directory, picture)):
+            picture = None
+        stamp = (st.st_size, st.st_mtime_ns, picture)
+        generate = lambda: render.to_string(render.single, xmlfile,
+            picture).encode()
+    else:
+        return None
+    entry = pages.pop(path, None)
+    if entry is None or entry[0] != stamp:
+        body = generate()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        # a page regenerated the same keeps its time
+        if entry is None or entry[3] != etag:
+            mtime = time.time()
+        else:
+            mtime = entry[1]
+        entry = (stamp, mtime, body, etag)
+    pages[path] = entry
+    while len(pages) > pages_limit:
+        del pages[next(iter(pages))]
+    return entry
+
+##############################################################################
+# HTTP
+##############################################################################
+
+quiet = False
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def not_modified(self, mtime, etag):
+        if 'If-None-Match' in self.headers:
+            tags = [t.strip() for t in self.headers['If-None-Match'].split(',')]
+            return etag in tags or '*' in tags
+        if 'If-Modified-Since' in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers['If-Modified-Since'])
+                return int(mtime) <= since.timestamp()
+            except (TypeError, ValueError):
+                pass
+        return False
+
+    def send_file(self, path, head):
+        name = path[1:]
+        if not re.fullmatch(r'[\w.-]+\.(png|jpg|ico|css)', name):
+            self.send_error(404)
+            return
+        try:
+            with open(os.path.join(directory, name), 'rb') as fh:
+                body = fh.read()
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(name)[0])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_GET(self, head=False):
+        path = self.path.split('?')[0]
+        try:
+            with lock:
+                entry = page(path)
+        except Exception as e:
+            self.send_error(500, explain=str(e))
+            return
+        if entry is None:
+            self.send_file(path, head)
+            return
+        stamp, mtime, body, etag = entry
+        fresh = self.not_modified(mtime, etag)
+        if fresh:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(mtime,
+            usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head and not fresh:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_POST(self):
+        # session XML as written by transcribe.py, saved as /NAME.xml
+        name = self.path[1:]
+        if not re.fullmatch(r'[\w.-]+\.xml', name):
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        target = os.path.join(directory, name)
+        tmp = os.path.join(directory, '.%s.tmp' % name)
+        with open(tmp, 'wb') as fh:
+            fh.write(body)
+        try:
+            with lock:
+                render.parse(tmp)
+        except Exception as e:
+            os.remove(tmp)
+            self.send_error(400, explain=str(e))
+            return
+        os.replace(tmp, target)
+        scanned['at'] = 0.0
+        self.send_response(201)
+        self.send_header('Location', '/%s.html' % name[:-len('.xml')])
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if not quiet:
+            super().log_message(format, *args)
+
+##############################################################################
+# main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory',
+        metavar='DIRECTORY', help='Directory of session XML files')
+    parser.add_argument('-t', '--title', default=title,
+        metavar='TITLE', help='HTML title (default: %(default)s)')
+    parser.add_argument('-b', '--bind', default='127.0.0.1',
+        metavar='ADDRESS', help='Address to listen on (default: %(default)s)')
+    parser.add_argument('-P', '--port', type=int, default=8000,
+        metavar='PORT', help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--pages', type=int, default=pages_limit,
+        metavar='N', help='Rendered pages kept in memory (default: %(default)s)')
+    parser.add_argument('--rescan', type=float, default=rescan_interval,
+        metavar='SECONDS', help='Minimum time between directory scans for the landing page')
+    parser.add_argument('--quiet', action='store_true',
+        help='Do not log requests')
+    parser.add_argument('--sprites', action='store_true',
+        help='Pack the venue icons in DIRECTORY into one sprite sheet at startup and use it on the landing page')
+    args = vars(parser.parse_args())
+
+    directory = args['directory']
+    title = args['title']
+    pages_limit = args['pages']
+    rescan_interval = args['rescan']
+    if args['sprites']:
+        import sprites
+        render.venue_sprites = sprites.sprites(directory)[0]
+    quiet = args['quiet']
+    # keep parsed sessions in memory so a changed file only reparses itself
+    render.cache = render.cache_open(None, sys.maxsize)
+    render.cache['entries'] = {}
+
+    server = http.server.ThreadingHTTPServer((args['bind'], args['port']),
+        Handler)
+    print('serving %s on http://%s:%d/' % (directory, args['bind'],
+        args['port']), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
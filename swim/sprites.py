@@ -0,0 +1,200 @@
+import argparse
+import glob
+import hashlib
+import os
+import re
+import struct
+import sys
+import zlib
+
+##############################################################################
+# PNG
+##############################################################################
+
+# just enough PNG for venue icons without an imaging library: 8-bit,
+# non-interlaced greyscale, RGB, palette and alpha images in, RGBA out
+signature = b'\x89PNG\r\n\x1a\n'
+channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+def png_chunks(data):
+    at = len(signature)
+    while at < len(data):
+        length, tag = struct.unpack_from('>I4s', data, at)
+        yield tag, data[at + 8:at + 8 + length]
+        at += 12 + length
+
+def png_unfilter(data, width, height, bpp):
+    stride = width * bpp
+    rows = []
+    previous = bytearray(stride)
+    at = 0
+    for y in range(height):
+        kind = data[at]
+        row = bytearray(data[at + 1:at + 1 + stride])
+        at += 1 + stride
+        if kind == 1:
+            for i in range(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xff
+        elif kind == 2:
+            for i in range(stride):
+                row[i] = (row[i] + previous[i]) & 0xff
+        elif kind == 3:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + (left + previous[i]) // 2) & 0xff
+        elif kind == 4:
+            for i in range(stride):
+                a = row[i - bpp] if i >= bpp else 0
+                b = previous[i]
+                c = previous[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                if pa <= pb and pa <= pc:
+                    row[i] = (row[i] + a) & 0xff
+                elif pb <= pc:
+                    row[i] = (row[i] + b) & 0xff
+                else:
+                    row[i] = (row[i] + c) & 0xff
+        rows.append(row)
+        previous = row
+    return rows
+
+# (width, height, rows of RGBA bytes)
+def png_read(path):
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if not data.startswith(signature):
+        raise NameError('not a PNG file: %s' % path)
+    depth = None
+    idat = []
+    palette = b''
+    alpha = b''
+    for tag, body in png_chunks(data):
+        if tag == b'IHDR':
+            width, height, depth, colour, compression, filtering, interlace = \
+                struct.unpack('>IIBBBBB', body)
+        elif tag == b'PLTE':
+            palette = body
+        elif tag == b'tRNS':
+            alpha = body
+        elif tag == b'IDAT':
+            idat.append(body)
+    if depth != 8 or interlace or colour not in channels:
+        raise NameError('unsupported PNG (only 8-bit, non-interlaced): %s' % path)
+    bpp = channels[colour]
+    rows = []
+    for row in png_unfilter(zlib.decompress(b''.join(idat)), width, height, bpp):
+        if colour == 6:
+            rows.append(bytes(row))
+            continue
+        rgba = bytearray()
+        for x in range(0, len(row), bpp):
+            if colour == 0:
+                rgba += bytes((row[x],) * 3) + b'\xff'
+            elif colour == 4:
+                rgba += bytes((row[x],) * 3) + bytes((row[x + 1],))
+            elif colour == 2:
+                rgba += row[x:x + 3] + b'\xff'
+            else:
+                i = row[x]
+                rgba += palette[i * 3:i * 3 + 3] + \
+                    (alpha[i:i + 1] if i < len(alpha) else b'\xff')
+        rows.append(bytes(rgba))
+    return width, height, rows
+
+def png_chunk(tag, body):
+    return struct.pack('>I', len(body)) + tag + body + \
+        struct.pack('>I', zlib.crc32(tag + body))
+
+def png_encode(width, height, rows):
+    raw = b''.join(b'\x00' + row for row in rows)
+    return signature + \
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) + \
+        png_chunk(b'IDAT', zlib.compress(raw, 9)) + \
+        png_chunk(b'IEND', b'')
+
+##############################################################################
+# sprite sheet
+##############################################################################
+
+# venue icons are PNGDIR/SLUG.png, shown at 18x18 on the landing page
+sheet = 'venues.png'
+stylesheet = 'venues.css'
+size = 18
+
+# SLUG as a CSS class; render.py puts the same on each landing page row
+def sprite_class(slug):
+    return 'v-' + re.sub(r'[^a-z0-9_-]', '_', slug)
+
+# the sheet is only in the venue rules, so a class without one shows nothing
+# rather than whichever icon is at the top of the sheet
+sprite_base = '.venue { display: inline-block; width: %dpx; height: %dpx; ' \
+    'vertical-align: middle; }\n'
+# class, sheet, sheet hash, then sheet width, sheet height and offset, all
+# scaled to the shown size
+sprite_rule = '.%s { background: url(%s?%s) no-repeat; ' \
+    'background-size: %gpx %gpx; background-position: 0 -%gpx; }\n'
+
+# writes only what changed so unchanged pages keep their mtimes
+def write_if_changed(path, data):
+    try:
+        with open(path, 'rb') as fh:
+            if fh.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path + '.tmp', 'wb') as fh:
+        fh.write(data)
+    os.replace(path + '.tmp', path)
+    return True
+
+# stacks every icon in PNGDIR into PNGDIR/venues.png with a venues.css
+# class per venue, so a landing page needs one image request in all;
+# returns the slugs packed, in order
+def sprites(pngdir):
+    icons = []
+    for path in sorted(glob.glob(os.path.join(pngdir, '*.png'))):
+        if os.path.basename(path) != sheet:
+            # a venue whose icon cannot be read keeps its own <img>
+            try:
+                icon = png_read(path)
+            except (NameError, OSError, IndexError, struct.error,
+                    zlib.error) as e:
+                print('warning: leaving %s out of the sprites: %s' % (path, e),
+                    file=sys.stderr)
+                continue
+            icons.append((os.path.basename(path)[:-len('.png')], icon))
+    width = max([w for slug, (w, h, rows) in icons], default=1)
+    height = sum(h for slug, (w, h, rows) in icons) or 1
+    rows = []
+    offsets = []
+    for slug, (w, h, icon) in icons:
+        offsets.append((slug, w, h, len(rows)))
+        padding = b'\x00' * ((width - w) * 4)
+        rows.extend(row + padding for row in icon)
+    if not rows:
+        rows = [b'\x00' * 4]
+    data = png_encode(width, height, rows)
+    # the query string changes with the sheet so caches never mix them up
+    digest = hashlib.sha1(data).hexdigest()[:8]
+    css = [sprite_base % (size, size)]
+    for slug, w, h, y in offsets:
+        css.append(sprite_rule % (sprite_class(slug), sheet, digest,
+            width * size / w, height * size / h, y * size / h))
+    changed = write_if_changed(os.path.join(pngdir, sheet), data)
+    changed |= write_if_changed(os.path.join(pngdir, stylesheet),
+        ''.join(css).encode())
+    return tuple(slug for slug, icon in icons), changed
+
+##############################################################################
+# main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pngdir',
+        metavar='PNGDIR', help='Directory of venue icons named like the venues on the landing page, e.g. santjordi.png')
+    args = vars(parser.parse_args())
+    slugs, changed = sprites(args['pngdir'])
+    print('%s: %d icons%s' % (os.path.join(args['pngdir'], sheet), len(slugs),
+        '' if changed else ', unchanged'), file=sys.stderr)
@@ -0,0 +1,137 @@
+import argparse
+import datetime
+import email.utils
+import importlib.util
+import os
+import sys
+import xml.etree.ElementTree
+
+# both transcribers are needed, so load them from their directories; each
+# imports the timeparse.py next to it, so the one the other loaded is
+# dropped from sys.modules first
+def load(kind):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), kind,
+        'transcribe.py')
+    sys.path.insert(0, os.path.dirname(path))
+    sys.modules.pop('timeparse', None)
+    spec = importlib.util.spec_from_file_location('%s_transcribe' % kind, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+swim = load('swim')
+lift = load('lift')
+
+##############################################################################
+# bundle
+##############################################################################
+
+# yield each <opml> note of a bundle, dropping it from the tree once the
+# caller is done with it so memory stays bounded by the largest note
+def notes(bundle):
+    stack = []
+    for event, el in xml.etree.ElementTree.iterparse(bundle, ('start', 'end')):
+        if event == 'start':
+            stack.append(el)
+            continue
+        stack.pop()
+        if el.tag == 'opml':
+            yield el
+            if stack:
+                stack[-1].remove(el)
+
+# each transcriber's check_outline_tags() rejects the other's notes, swim's
+# for a "squat" outline and lift's for a "volume" one; swim notes always
+# have "volume", so a note both accept is a lift session, and one both
+# reject (or without a body) is neither
+def route(note):
+    body = note.find('body')
+    accepted = []
+    for kind, transcriber in [('swim', swim), ('lift', lift)]:
+        try:
+            transcriber.check_outline_tags(body, 0)
+        except (NameError, AssertionError, TypeError):
+            continue
+        accepted.append(kind)
+    if 'lift' in accepted:
+        return 'lift', lift
+    if 'swim' in accepted:
+        return 'swim', swim
+    return None, None
+
+# notes in a bundle have no file name, so use the OPML 2.0 creation date;
+# exports often give it in GMT, so it is taken on the day it was where the
+# notes are taken (timeparse.zone), or a note from 00:30 goes to the day before
+def note_date(note):
+    import zoneinfo
+    created = note.findtext('head/dateCreated')
+    if not created:
+        raise NameError('missing head/dateCreated')
+    created = email.utils.parsedate_to_datetime(created)
+    if created.tzinfo is None:
+        # -0000, a time in UTC from an unknown zone
+        created = created.replace(tzinfo=datetime.timezone.utc)
+    local = created.astimezone(zoneinfo.ZoneInfo(swim.timeparse.zone))
+    return datetime.datetime.combine(local.date(), datetime.time())
+
+def transcribe_bundle(bundle, outdir):
+    names = set()
+    count = 0
+    failed = 0
+    skipped = 0
+    for note in notes(bundle):
+        count += 1
+        title = note.findtext('head/title', '').strip()
+        # notes that are not sessions, or cannot be dated, are left out
+        # without failing the bundle
+        kind, transcriber = route(note)
+        reason = None
+        if transcriber is None:
+            reason = 'neither a swim nor a lift session'
+        elif not note.findtext('head/dateCreated'):
+            reason = 'missing head/dateCreated'
+        if reason is not None:
+            print('skipped note %d "%s": %s' % (count, title, reason),
+                file=sys.stderr)
+            skipped += 1
+            continue
+        try:
+            date = note_date(note)
+            session = transcriber.transcribe_tree(note, date)
+        except Exception as e:
+            print('failed note %d "%s": %s: %s' % \
+                (count, title, type(e).__name__, e), file=sys.stderr)
+            failed += 1
+            continue
+        # several sessions on one day get the usual -SUFFIX
+        name = os.path.join(kind, date.strftime('%Y%m%d'))
+        suffix = 1
+        while name + ('-%d' % suffix if suffix > 1 else '') in names:
+            suffix += 1
+        if suffix > 1:
+            name += '-%d' % suffix
+        names.add(name)
+        os.makedirs(os.path.join(outdir, kind), exist_ok=True)
+        with open(os.path.join(outdir, name + '.xml'), 'w') as fh:
+            print(transcriber.to_string(session), file=fh)
+    print('transcribed %d of %d notes, %d skipped' % (count - failed - skipped,
+        count, skipped), file=sys.stderr)
+    return failed == 0
+
+##############################################################################
+# main
+##############################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outdir',
+        metavar='OUTDIR', help='Write OUTDIR/swim/YYYYMMDD[-N].xml and OUTDIR/lift/YYYYMMDD[-N].xml')
+    parser.add_argument('bundle',
+        metavar='BUNDLEFILE', help='XML file of <opml> notes, "-" for standard input')
+    args = vars(parser.parse_args(argv))
+    bundle = sys.stdin.buffer if args['bundle'] == '-' else args['bundle']
+    if not transcribe_bundle(bundle, args['outdir']):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()